@@ -30,6 +30,17 @@ def make_property(name, field):
     return property(fget=getter, fset=setter)
 
 
+def schema_fields(attrs):
+    """Describes a model's fields for :py:meth:`.gitdb.Table.bind_schema`."""
+    schema = []
+    for name, field in attrs.items():
+        choices = None
+        if isinstance(field, fields.Choice):
+            choices = field.choices
+        schema.append((name, choices))
+    return schema
+
+
 def make_init(initialiser):
 
     def __init__(self, *args, **kwargs):
@@ -53,6 +64,16 @@ class MetaModel(type):
 
     It also provides the :py:meth:`~.MetaModel.get_attributes` class method
     which can be used to get the data for any particular class.
+
+    A model declared with ``compact=True`` binds its fields to its table as a
+    schema (see :py:meth:`.gitdb.Table.bind_schema`), so that its documents
+    are stored without field names, and with numbers, booleans and choices
+    in a compact binary form.
+
+    Fields declared with ``index=False`` have their index dropped from the
+    table, and other fields have theirs created, if it was dropped before
+    (see :py:meth:`.gitdb.Table.create_index`).  Fields declared with
+    ``unique=True`` are made unique in the table.
     """
 
     _type_attributes = {}
@@ -69,6 +90,9 @@ class MetaModel(type):
                     m = ("'id' attribute not allowed as a field, will be "
                          "internally defined")
                     raise TypeError(m)
+                elif key == "as_of":
+                    m = "'as_of' attribute not allowed as a field, is reserved"
+                    raise TypeError(m)
                 attrs[key] = field
                 properties[key] = make_property(key, field)
             elif key == "__init__" and callable(field):
@@ -82,6 +106,7 @@ class MetaModel(type):
 
     def __init__(cls, name, bases, dct, **kwargs):
         db = kwargs.pop('db', None)
+        compact = kwargs.pop('compact', False)
         if db is None and name != "Model":
             raise TypeError("Missing 'db' param.  A database must be provided")
         elif isinstance(db, str):
@@ -102,6 +127,15 @@ class MetaModel(type):
 
         if db is not None:
             cls._table = table
+            if compact:
+                table.bind_schema(schema_fields(cls.get_attributes(cls)))
+            for field_name, field in cls.get_attributes(cls).items():
+                if field.index and not table.is_indexed(field_name):
+                    table.create_index(field_name)
+                elif not field.index and table.is_indexed(field_name):
+                    table.drop_index(field_name)
+                if field.unique and not table.is_unique(field_name):
+                    table.create_index(field_name, unique=True)
 
     @classmethod
     def get_attributes(cls, instance):
@@ -133,6 +167,10 @@ class Model(metaclass=MetaModel):
         database.  This is generally for internal use (i.e, creating the object
         after a search has been completed) but it may be useful.
 
+    :param as_of: Used with ``model_id`` to initialise the model from the
+        document as it was at a past state of the database.  See
+        :py:meth:`.gitdb.Table.find` for the values this can take.
+
     :param mixed kwargs: This is the more usual way of initialising the model
         - that is, by passing in key=val pairs describing the values passed to
         the fields specified by the model.  The default initialiser will then
@@ -145,7 +183,7 @@ class Model(metaclass=MetaModel):
         happen, though!)
     """
 
-    def __init__(self, model_id=None, **kwargs):
+    def __init__(self, model_id=None, as_of=None, **kwargs):
         self._attrs = {}
         self.id = None
 
@@ -153,7 +191,8 @@ class Model(metaclass=MetaModel):
             self._init_from_kwargs(kwargs)
         else:
             self.id = model_id
-            self._init_from_kwargs(self._table.get(model_id), save=False)
+            doc = self._table.get(model_id, as_of=as_of)
+            self._init_from_kwargs(doc, save=False)
 
         assert self.id is not None
 
@@ -195,31 +234,116 @@ class Model(metaclass=MetaModel):
 
         return self.id
 
+    async def asave(self):
+        """Saves this instance to the database without blocking.
+
+        This is the coroutine version of :py:meth:`~.Model.save`.  Saves from
+        several instances made during the same event loop iteration are
+        committed together.
+        """
+        table = self._table.as_async()
+        if self.id is None:
+            self.id = await table.insert(self._attrs)
+        else:
+            self.id = await table.update(self.id, self._attrs)
+
+        return self.id
+
+    @classmethod
+    def upsert(cls, match, **kwargs):
+        """Updates the instance matching a search, or creates one.
+
+        The instance is initialised from ``kwargs`` as the default
+        initialiser would, with any simple terms of ``match`` (ones giving a
+        value rather than a dict of operators) as defaults, and is then
+        written over the document matching ``match``, or inserted if none
+        does.  See :py:meth:`.gitdb.Table.upsert`.
+
+        :param dict match: Search terms (see :py:meth:`~.Model.find`) that
+            match at most one instance, usually the value of a unique field.
+
+        :param mixed kwargs: The attributes of the instance.
+
+        :return: The saved instance.
+        """
+        cls._check_find_terms(match)
+        attrs = {key: value for key, value in match.items()
+                 if key not in gitdb.BOOLEAN_NODES and
+                 not isinstance(value, dict)}
+        attrs.update(kwargs)
+
+        instance = cls.__new__(cls)
+        instance._attrs = {}
+        instance._init_from_kwargs(attrs, save=False)
+        instance.id = cls._table.upsert(match, instance._attrs)
+        return instance
+
     @classmethod
     def get_table(cls):
         """Returns the table associated with this model."""
         return cls._table
 
     @classmethod
-    def find(cls, **kwargs):
+    def find(cls, as_of=None, **kwargs):
         """Finds documents in the database.
 
         Given keyword arguments (which have the same format as the arguments
         given to :py:meth:`.gitdb.GitDB.find`), this method returns a
         :py:class:`~.ReturnSet` containing all of the matching documents.
+        Searches can be combined with ``$or``, ``$and`` and ``$not``, which
+        have to be passed as ``**{'$or': [...]}``.
+
+        :param as_of: Search a past state of the database instead of the
+            current one.  Instances fetched from the returned set will also
+            be initialised from that state.  See :py:meth:`.gitdb.Table.find`
+            for the values this can take.
 
         :param mixed kwargs: See :py:meth:`.gitdb.GitDB.find` for the full
             finding syntax.
 
         :return: :py:class:`~.ReturnSet` of all of the matching documents.
         """
-        for i in kwargs:
-            if i not in MetaModel.get_attributes(cls):
+        cls._check_find_terms(kwargs)
+        if as_of is not None:
+            as_of = cls._table.resolve_state(as_of)
+
+        ids = cls._table.find_ids(kwargs, as_of=as_of)
+        return ReturnSet(ids, cls, as_of=as_of)
+
+    @classmethod
+    async def afind(cls, as_of=None, **kwargs):
+        """Finds documents in the database without blocking.
+
+        This is the coroutine version of :py:meth:`~.Model.find`.
+
+        :param as_of: See :py:meth:`~.Model.find`.
+
+        :param mixed kwargs: See :py:meth:`.gitdb.GitDB.find` for the full
+            finding syntax.
+
+        :return: :py:class:`~.ReturnSet` of all of the matching documents.
+        """
+        cls._check_find_terms(kwargs)
+        table = cls._table.as_async()
+        if as_of is not None:
+            as_of = await table.resolve_state(as_of)
+
+        ids = await table.find_ids(kwargs, as_of=as_of)
+        return ReturnSet(ids, cls, as_of=as_of)
+
+    @classmethod
+    def _check_find_terms(cls, kwargs):
+        for i, term in kwargs.items():
+            if i == '$not' and isinstance(term, dict):
+                cls._check_find_terms(term)
+            elif i in gitdb.BOOLEAN_NODES and isinstance(term, (list, tuple)):
+                for branch in term:
+                    if isinstance(branch, dict):
+                        cls._check_find_terms(branch)
+            elif i not in MetaModel.get_attributes(cls):
                 m = "Cannot find on attributes not owned by this class ({key})"
                 raise TypeError(m.format(key=i))
 
-        return ReturnSet(cls._table.find_ids(kwargs), cls)
-
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
@@ -239,11 +363,16 @@ class ReturnSet:
     The documents are returned sorted in order of the ids.  This ensures that
     further operations on a set will preserve order, but should not be relied
     on, as the specifics of document ids is not part of the public interface.
+
+    If the set was found at a past state of the database (using the ``as_of``
+    parameter of :py:meth:`.Model.find`), then further searches and the
+    returned instances will use that state as well.
     """
 
-    def __init__(self, ids, cls):
+    def __init__(self, ids, cls, as_of=None):
         self.ids = sorted(ids)
         self.cls = cls
+        self.as_of = as_of
 
     def __len__(self):
         return len(self.ids)
@@ -262,7 +391,7 @@ class ReturnSet:
 
         :return: This set, to allow for chaining method calls.
         """
-        other_ids = self.cls.find(**kwargs).ids
+        other_ids = self.cls.find(as_of=self.as_of, **kwargs).ids
         self.ids = sorted(set(other_ids).intersection(self.ids))
         return self
 
@@ -275,7 +404,31 @@ class ReturnSet:
 
     def all(self):
         """Returns a list of all of the documents."""
-        return [self.cls(model_id=i) for i in self.ids]
+        return [self.cls(model_id=i, as_of=self.as_of) for i in self.ids]
+
+    def values(self, *fields):
+        """Returns the values of some fields of every document.
+
+        This doesn't initialise any instances, and if every field is indexed,
+        the values are read from the indexes alone, without reading the
+        documents (see :py:meth:`.gitdb.Table.get_fields`).
+
+        :param str fields: The fields to return.  If none are given, every
+            field of the model is returned.
+
+        :return: A list of dicts of field names to values, in the order of
+            the set.
+        """
+        attrs = MetaModel.get_attributes(self.cls)
+        if not fields:
+            fields = sorted(attrs)
+        for field in fields:
+            if field not in attrs:
+                m = "Cannot get attributes not owned by this class ({key})"
+                raise TypeError(m.format(key=field))
+
+        table = self.cls.get_table()
+        return table.get_fields(self.ids, fields, as_of=self.as_of)
 
     def __getitem__(self, i):
-        return self.cls(model_id=self.ids[i])
+        return self.cls(model_id=self.ids[i], as_of=self.as_of)
@@ -9,3 +9,8 @@ try:  # pragma: no cover
     from collections.abc import MutableMapping  # pragma: no flakes
 except ImportError:  # pragma: no cover
     from collections import MutableMapping  # pragma: no flakes
+
+try:  # pragma: no cover
+    from pygit2 import GIT_OBJECT_COMMIT  # pragma: no flakes
+except ImportError:  # pragma: no cover
+    from pygit2 import GIT_OBJ_COMMIT as GIT_OBJECT_COMMIT  # pragma: no flakes
@@ -32,6 +32,16 @@ class BaseField(metaclass=abc.ABCMeta):
         return "False" or raise a ValueError.  Defaults to a no-op.
 
         Example:  ``coerce=int`` would convert values to int where possible.
+
+    :param bool index:  Whether this field's values are indexed, so that
+        searching on the field doesn't read every document.  Defaults to
+        True.  Large fields that are rarely searched can be left unindexed,
+        which makes saving them cheaper.
+
+    :param bool unique:  Whether no two documents can have the same value of
+        this field.  Saving a model with a value that another document
+        already has raises ValueError.  Unique fields must be indexed.
+        Defaults to False.
     """
 
     def __init__(self, **kwargs):
@@ -42,6 +52,10 @@ class BaseField(metaclass=abc.ABCMeta):
         self._has_default = self.default is not NULL_SENTINEL
         self.nullable = kwargs.pop('nullable', not self._has_default)
         self._accept_none = self.nullable
+        self.index = kwargs.pop('index', True)
+        self.unique = kwargs.pop('unique', False)
+        if self.unique and not self.index:
+            raise TypeError("Unique fields must be indexed")
 
         if len(kwargs) > 0:
             msg = "Unrecognised parameter(s) passed to field: {d}"
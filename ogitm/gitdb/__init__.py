@@ -1,20 +1,53 @@
 import json
+import time
+import hashlib
 import shutil
+import threading
 from os import path
-from functools import reduce
+from functools import partial
 from contextlib import contextmanager
 
 import pygit2 as pg2
 
 from .treewrapper import TreeWrapper
-from .json_wrapper import JsonDictWrapper
+from .json_wrapper import JsonDictWrapper, BlobCache
+from .codecs import DEFAULT_CODEC, get_codec
+from .schema import Schema, SchemaCodec
 from .search_functions import SearchFunction
+from .index_access import CAPABILITIES, IndexAccessor, SortedValues
+from .composite import LIST_ITEM as COMPOSITE_LIST, CompositeIndex
+from .text_index import TextIndex
+from .predicates import PredicateSets
+from .async_table import AsyncTable
+from .backends import StorageBackend, DictBackend
+from .journal import JournaledBackend, JournalThread
+from .memory import memory_repository
+from . import maintenance
 
 
-__all__ = ['DEFAULT_TABLE', 'RESERVED_TABLE_NAMES', 'GitDB', 'Table']
+__all__ = ['DEFAULT_TABLE', 'RESERVED_TABLE_NAMES', 'STORAGE_TYPES',
+           'BOOLEAN_NODES', 'GitDB', 'Table', 'Snapshot', 'AsyncTable',
+           'StorageBackend', 'DictBackend']
 
 DEFAULT_TABLE = '__defaulttable__'
 RESERVED_TABLE_NAMES = {'__meta__', DEFAULT_TABLE}
+STORAGE_TYPES = {'disk', 'memory', 'dict'}
+# keys of a search that combine other searches, rather than naming a key
+BOOLEAN_NODES = {'$and', '$or', '$not'}
+
+
+def _open_backend(location, storage, journal=False, layout='flat'):
+    if storage == 'dict':
+        backend = DictBackend()
+    elif storage == 'memory':
+        backend = TreeWrapper(memory_repository(), layout)
+    else:
+        repo = pg2.init_repository(location, bare=True)
+        backend = TreeWrapper(repo, layout)
+
+    if journal:
+        return JournaledBackend.for_backend(backend)
+    return backend
 
 
 class GitDB:
@@ -30,15 +63,59 @@ class GitDB:
     as a simple one-table document store without worrying about tables at all.
     This isn't recommended, however.
 
+    With ``storage='memory'``, nothing is written to disk: every table is
+    kept in memory, and is lost when the database is closed.  This behaves
+    exactly like a database on disk, but is much faster, which makes it
+    useful for tests and scratch data.  ``storage='dict'`` also keeps every
+    table in memory, but in a :py:class:`~.backends.DictBackend` rather than
+    a git repository, which is faster still.
+
+    With ``journal=True``, every table on disk journals its saves, and
+    commits them in batches (see :py:mod:`~.gitdb.journal`).  Each table is
+    then only opened once per database instance, as unfolded saves are only
+    visible to the instance that made them.
+
+    New tables store their documents in the given
+    :py:mod:`~.gitdb.layout`.  Existing tables keep the layout they have,
+    unless they are migrated with :py:meth:`~.GitDB.migrate_layout`.
+    Likewise, new tables encode their documents with the given
+    :py:mod:`~.gitdb.codecs` codec, and existing tables keep theirs.
+
     Parameters:
-        location (str): The path of the database
+        location (str): The path of the database.  Not needed when the
+            database is stored in memory.
+        storage (str): ``'disk'``, ``'memory'`` or ``'dict'``
+        journal (bool): Whether tables should journal their saves
+        layout (str): ``'flat'`` or ``'fanout'``
+        codec (str): The codec of new tables, ``'json'`` by default
+
+    Raises:
+        ValueError: if the storage type is unknown, if a database on disk
+            isn't given a location, or if a database in memory is journaled
     """
 
-    def __init__(self, location):
+    def __init__(self, location=None, storage='disk', journal=False,
+                 layout='flat', codec=None):
+        if storage not in STORAGE_TYPES:
+            raise ValueError("Unknown storage type " + str(storage))
+        elif location is None and storage == 'disk':
+            raise ValueError("A database on disk needs a location")
+        elif journal and storage != 'disk':
+            raise ValueError("Only databases on disk can be journaled")
+
         self.location = location
-        self.meta_location = path.join(location, '__meta__')
-        self.meta_repo = pg2.init_repository(self.meta_location, bare=True)
-        self.meta_tree = JsonDictWrapper(TreeWrapper(self.meta_repo))
+        self.storage = storage
+        self.journal = journal
+        self.layout = layout
+        self.codec = codec
+        self._open_tables = {}
+        if storage == 'disk':
+            self.meta_location = path.join(location, '__meta__')
+        else:
+            self.meta_location = None
+        meta_backend = _open_backend(self.meta_location, storage)
+        self.meta_repo = meta_backend.repo
+        self.meta_tree = JsonDictWrapper(meta_backend)
         self.default_table = self.table(DEFAULT_TABLE)
 
     def table(self, table_name):
@@ -66,7 +143,33 @@ class GitDB:
             tables.append(table_name)
 
         self.meta_tree['table_list'] = tables
-        return Table(table_name, path.join(self.location, table_name))
+        if self.storage == 'disk' and not self.journal:
+            return Table(table_name, path.join(self.location, table_name),
+                         layout=self.layout, codec=self.codec)
+
+        if table_name not in self._open_tables:
+            location = None
+            if self.storage == 'disk':
+                location = path.join(self.location, table_name)
+            self._open_tables[table_name] = Table(
+                table_name, location, self.storage, self.journal,
+                self.layout, self.codec)
+        return self._open_tables[table_name]
+
+    def migrate_layout(self, layout):
+        """Migrates every table in the database to a new layout.
+
+        See :py:meth:`.Table.migrate_layout`.
+
+        Returns:
+            list: The names of the tables that were migrated
+        """
+        migrated = []
+        for table_name in self.meta_tree.get('table_list', []):
+            if self.table(table_name).migrate_layout(layout):
+                migrated.append(table_name)
+        self.layout = layout
+        return migrated
 
     def __getitem__(self, table_name):
         return self.table(table_name)
@@ -93,6 +196,10 @@ class GitDB:
             return
 
         tables.remove(table_name)
+        self._open_tables.pop(table_name, None)
+        if self.storage != 'disk':
+            return
+
         try:
             shutil.rmtree(path.join(self.location, table_name))
         except OSError as oe:  # pragma: no cover
@@ -103,7 +210,415 @@ class GitDB:
         return getattr(self.default_table, attr)
 
 
-class Table:
+class _DocumentReader:
+    """Read and search methods shared by tables and their snapshots.
+
+    Subclasses provide a ``data_tree`` attribute, a json-decoding mapping of
+    all of the documents and indexes that can be read.
+    """
+
+    def __iter__(self):
+        for doc_id in sorted(self._all_ids()):
+            yield doc_id, self._document(doc_id)
+
+    def _all_ids(self):
+        return {int(i[4:]) for i in self.data_tree.items_list()
+                if i.startswith('doc-')}
+
+    def _document(self, doc_id):
+        return self.data_tree.get('doc-{id}'.format(id=doc_id))
+
+    def get(self, doc_id, as_of=None):
+        """Gets a document given it's document id.
+
+        This is the simplest but least useful way of getting information out of
+        the database.  It returns the document.
+
+        Parameters:
+            doc_id (int): The document ID to fetch
+            as_of: Fetch the document as it was at a past state of the table
+                (see :py:meth:`~.Table.find`)
+
+        Returns:
+            dict: The document
+        """
+        if as_of is not None:
+            return self._at(as_of).get(doc_id)
+
+        if not isinstance(doc_id, int):
+            raise TypeError("id must be an integer")
+
+        doc = self._document(doc_id)
+        if doc is None:
+            err = "No such document under id {id}".format(id=doc_id)
+            raise ValueError(err)
+
+        return doc
+
+    def get_fields(self, doc_ids, fields, as_of=None):
+        """Gets some of the keys of several documents.
+
+        Like :py:meth:`~.Table.find` with ``fields``, the values are taken
+        from the indexes when every key is indexed, without reading the
+        documents.  Documents without one of the keys are returned without
+        it.
+
+        Parameters:
+            doc_ids (list[int]): The document IDs to fetch
+            fields (list[str]): The keys to return
+            as_of: Fetch the documents as they were at a past state of the
+                table (see :py:meth:`~.Table.find`)
+
+        Returns:
+            list[dict]: The keys of each document, in the order of the ids
+
+        Raises:
+            ValueError: if one of the documents doesn't exist
+        """
+        if as_of is not None:
+            return self._at(as_of).get_fields(doc_ids, fields)
+
+        doc_ids = list(doc_ids)
+        found = self._project(doc_ids, fields)
+        missing = set(doc_ids) - {doc_id for doc_id, _ in found}
+        if missing:
+            err = "No such document under id {id}".format(id=min(missing))
+            raise ValueError(err)
+
+        return [doc for _, doc in found]
+
+    def _project(self, doc_ids, fields):
+        """(id, document) pairs of just the ``fields`` of each document,
+        leaving out ids without a document."""
+        fields = list(fields)
+        if not all(self.is_indexed(key) for key in fields):
+            found = []
+            for i in doc_ids:
+                doc = self._document(i)
+                if doc is not None:
+                    found.append(
+                        (i, {key: doc[key] for key in fields if key in doc}))
+            return found
+
+        # the value index of a key has every value that it has in any
+        # document, so the documents don't need to be read
+        postings = [(key, self._postings(key)) for key in fields]
+        existing = self._all_ids()
+        return [(i, {key: values[i] for key, values in postings
+                     if i in values})
+                for i in doc_ids if i in existing]
+
+    def find_ids(self, where, as_of=None):
+        """Find the ids that match a given query.
+
+        This method is the same as :py:meth:`~.Table.find`, but returns the
+        ids rather than (id, doc) pairs.
+
+        Parameters:
+            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            as_of: Past state to search (see :py:meth:`~.Table.find`)
+
+        Returns:
+            list[int]: A list of matching document ids
+        """
+        return [i[0] for i in self.find(where, as_of=as_of)]
+
+    def find_items(self, where, as_of=None, fields=None):
+        """Find the documents that match a given query.
+
+        This method is the same as :py:meth:`~.Table.find`, but returns the
+        documents rather than (id, doc) pairs.
+
+        Parameters:
+            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            as_of: Past state to search (see :py:meth:`~.Table.find`)
+            fields (list[str]): Keys to return (see :py:meth:`~.Table.find`)
+
+        Returns:
+            list[dict]: A list of matching documents
+        """
+        return [i[1] for i in self.find(where, as_of=as_of, fields=fields)]
+
+    def find(self, where, as_of=None, fields=None):
+        """Finds the documents that match a given query.
+
+        For details on searching, see :doc:`/search_queries`.  Searches in the
+        raw :py:class:`~.GitDB` should be documents, rather than keyword
+        arguments, but otherwise searches are the same.
+
+        Every term of a search has to match.  Searches can also be combined
+        with ``{'$or': [search, ...]}``, ``{'$and': [search, ...]}`` and
+        ``{'$not': search}``, which are worked out from the indexes before
+        any document is read.
+
+        This method returns (id, document) pairs.  There are also the
+        convenience methods :py:meth:`~.Table.find_ids` and
+        :py:meth:`~.Table.find_items`, which just return the ids and documents
+        respectively.
+
+        The search can also be run against a past state of the table, without
+        reverting the table itself, by passing ``as_of``.  This can be a
+        marker returned by :py:meth:`~.Table.save_state`, an integer number of
+        commits to step back from the current state, or a
+        :py:class:`~datetime.datetime`, in which case the last state committed
+        at or before that time is used.
+
+        Given a list of ``fields``, only those keys of each document are
+        returned.  If every one of them is indexed, their values are taken
+        from the indexes, and no documents are read at all.
+
+        Parameters:
+            where (dict): Search definition
+            as_of: The past state to search, if any
+            fields (list[str]): The keys to return, if not every key
+
+        Returns:
+            list[(int, dict)]: A list of matching documents
+        """
+        if as_of is not None:
+            return self._at(as_of).find(where, fields=fields)
+
+        doc_ids = self._conjunction(self._plan(where, {}))
+        if doc_ids is None:
+            doc_ids = self._all_ids()
+        if fields is not None:
+            return self._project(doc_ids, fields)
+
+        found = []
+        for i in doc_ids:
+            doc = self._document(i)
+            if doc is not None:
+                found.append((i, doc))
+        return found
+
+    def find_one(self, where, as_of=None):
+        """Finds one document
+
+        This method functions the same as :py:meth:`~.Table.find`, but returns
+        just one element, or None if no element found.
+
+        Parameters:
+            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            as_of: Past state to search (see :py:meth:`~.Table.find`)
+
+        Returns:
+            *(int, document)* or *None*
+        """
+        res = self.find(where, as_of=as_of)
+        if len(res) > 0:
+            return res[0]
+        else:
+            return None
+
+    def _plan(self, where, accessors):
+        """Every term of a search, as (cost, search) pairs, cheapest first.
+
+        Every operator is looked up before anything is searched, so unknown
+        operators are always reported.  ``$and`` nodes are merged into the
+        terms around them, and ``$or`` and ``$not`` nodes become one term,
+        which costs as much as the most expensive term inside it.
+
+        Parameters:
+            where (dict): Search definition
+            accessors (dict): The index accessor of each key, shared by every
+                term of the search, so each index is read at most once
+
+        Raises:
+            ValueError: if a boolean node isn't given search definitions
+        """
+        if not isinstance(where, dict):
+            raise ValueError("Searches must be dicts, not " + repr(where))
+
+        terms = []
+        where, composite = self._composite_terms(where)
+        if composite is not None:
+            terms.append((CAPABILITIES.index('lookup'), composite))
+
+        for key, term in where.items():
+            # unindexed keys are searched after everything else, as building
+            # their index reads every document
+            extra = 0 if key in BOOLEAN_NODES or self.is_indexed(key) \
+                else len(CAPABILITIES)
+
+            if key in BOOLEAN_NODES:
+                if key == '$not':
+                    plans = [self._plan(term, accessors)]
+                    search = partial(self._find_not, plans[0])
+                elif not isinstance(term, (list, tuple)):
+                    m = "{key} takes a list of searches".format(key=key)
+                    raise ValueError(m)
+                else:
+                    plans = [self._plan(branch, accessors) for branch in term]
+                    search = partial(self._find_any, plans)
+
+                if key == '$and':
+                    for plan in plans:
+                        terms.extend(plan)
+                else:
+                    cost = max((cost for plan in plans for cost, _ in plan),
+                               default=0)
+                    terms.append((cost, search))
+
+            elif isinstance(term, dict):
+                for operator, arg in term.items():
+                    func = SearchFunction.get(operator)
+                    search = partial(self._find_complex, key, operator, arg,
+                                     term, func, accessors)
+                    terms.append((SearchFunction.cost(operator) + extra,
+                                  search))
+
+            else:  # simple term, i.e. name="bob"
+                search = partial(self._find_simple, key, term, accessors)
+                terms.append((CAPABILITIES.index('lookup') + extra, search))
+
+        terms.sort(key=lambda term: term[0])
+        return terms
+
+    def _composite_terms(self, where):
+        """Replaces the simple terms covered by a composite index.
+
+        The composite index that covers the most keys is used, as long as it
+        covers more than one.
+
+        Returns:
+            (dict, callable): The terms that are left, and a search of the
+            composite index for the others (or None)
+        """
+        simple = {key: term for key, term in where.items()
+                  if key not in BOOLEAN_NODES and not isinstance(term, dict)}
+        if len(simple) < 2:
+            return where, None
+
+        best, covered = None, 1
+        for keys in self.data_tree.get(COMPOSITE_LIST, []):
+            count = CompositeIndex(keys).covered(simple)
+            if count > covered or (count == covered and best is not None and
+                                   len(keys) < len(best)):
+                best, covered = keys, count
+        if best is None:
+            return where, None
+
+        keys = best[:covered]
+        search = partial(self._find_composite, best,
+                         [simple[key] for key in keys])
+        return {key: term for key, term in where.items()
+                if key not in keys}, search
+
+    def _find_composite(self, keys, values):
+        data = self.data_tree.get(CompositeIndex.item_name(keys), {})
+        return CompositeIndex(keys, data).lookup(values)
+
+    @staticmethod
+    def _conjunction(plan):
+        """The ids that match every term of a plan, or None if it has none.
+
+        Searching stops as soon as no ids are left.
+        """
+        doc_ids = None
+        for _, search in plan:
+            ids = search()
+            doc_ids = ids if doc_ids is None else doc_ids & ids
+            if not doc_ids:
+                return set()
+        return doc_ids
+
+    def _find_any(self, plans):
+        doc_ids = set()
+        for plan in plans:
+            ids = self._conjunction(plan)
+            if ids is None:  # an empty search, which matches everything
+                return self._all_ids()
+            doc_ids |= ids
+        return doc_ids
+
+    def _find_not(self, plan):
+        ids = self._conjunction(plan)
+        if ids is None:
+            return set()
+        return self._all_ids() - ids
+
+    def _accessor(self, key, accessors):
+        if key not in accessors:
+            if self.is_indexed(key):
+                index = self.data_tree.get('index-{key}'.format(key=key), {})
+            else:
+                index = self._scan_index(key)
+            accessors[key] = IndexAccessor(key, index, self)
+        return accessors[key]
+
+    def _scan_index(self, key):
+        """Builds the value index of an unindexed key from every document."""
+        index = {}
+        for doc_id in sorted(self._all_ids()):
+            doc = self._document(doc_id)
+            if doc is not None and key in doc:
+                index.setdefault(json.dumps(doc[key]), []).append(doc_id)
+        return index
+
+    def is_indexed(self, key):
+        """Whether a key's values are indexed.
+
+        Every key is indexed, unless its index has been dropped with
+        :py:meth:`~.Table.drop_index`.  Searches on unindexed keys still
+        work, but read every document in the table.  Given a tuple of keys,
+        this is whether they have a composite index.
+        """
+        if isinstance(key, (tuple, list)) and len(key) > 1:
+            return list(key) in self.data_tree.get(COMPOSITE_LIST, [])
+        elif isinstance(key, (tuple, list)):
+            key = key[0]
+        return 'noindex-{key}'.format(key=key) not in self.data_tree
+
+    def _find_simple(self, key, val, accessors):
+        return self._accessor(key, accessors).lookup(val)
+
+    def _find_complex(self, key, operator, arg, query, func, accessors):
+        accessor = self._accessor(key, accessors)
+        if SearchFunction.needs(operator) is not None:
+            return func(key, operator, arg, accessor, query)
+        return func(key, operator, arg, accessor.index, query,
+                    self._all_ids())
+
+    def _index_item(self, kind, key):
+        return self.data_tree.get('{kind}-{key}'.format(kind=kind, key=key))
+
+    def _sorted_values(self, key, index):
+        # sorted once per version of the index, which is one blob
+        try:
+            blob_id = self.data_tree.blob_id('index-{key}'.format(key=key))
+        except KeyError:
+            return SortedValues(index)
+
+        cache_key = ('sorted', blob_id)
+        values = self._blob_cache.get(cache_key)
+        if values is None:
+            values = SortedValues(index)
+            self._blob_cache.put(cache_key, values)
+        return values
+
+    def _postings(self, key):
+        """Maps the id of every document with a key to its value, from the
+        key's value index."""
+        # built once per version of the index, like the sorted values
+        name = 'index-{key}'.format(key=key)
+        try:
+            blob_id = self.data_tree.blob_id(name)
+        except KeyError:
+            return {}
+
+        cache_key = ('postings', blob_id)
+        values = self._blob_cache.get(cache_key)
+        if values is None:
+            values = {}
+            for value_key, ids in self.data_tree[name].items():
+                value = json.loads(value_key)
+                for doc_id in ids:
+                    values[doc_id] = value
+            self._blob_cache.put(cache_key, values)
+        return values
+
+
+class Table(_DocumentReader):
     """A class to represent an individual table in a database
 
     This class should only really  be created by a :py:class:`~.gitdb.GitDB`
@@ -114,6 +629,18 @@ class Table:
         name (str): The name of the table
         path (str): The path of the table  (Note that this is the path to this
             particular table's location, not the root path of the database.)
+        storage (str): ``'disk'``, ``'memory'`` or ``'dict'``.  A table that
+            isn't stored on disk has no path, and is only equal to itself.
+        journal (bool): Whether to journal saves, and commit them in batches
+            (see :py:mod:`~.gitdb.journal`)
+        layout (str): The :py:mod:`~.gitdb.layout` of a new table's
+            documents, either ``'flat'`` or ``'fanout'``
+        codec (str): The :py:mod:`~.gitdb.codecs` codec that a new table
+            encodes its documents and indexes with, ``'json'`` by default.
+            Existing tables always use the codec they were created with.
+
+    Raises:
+        ValueError: if a new table is given an unknown or unavailable codec
     """
 
     def _get_next_id(self):
@@ -128,24 +655,106 @@ class Table:
 
         return new_meta
 
-    def __init__(self, name, location):
+    def __init__(self, name, location=None, storage='disk', journal=False,
+                 layout='flat', codec=None):
         self.name = name
 
         self.location = location
-        self.dr_loc = path.join(location, 'data')
-        self.data_repo = pg2.init_repository(self.dr_loc, bare=True)
-        self.data_tree = JsonDictWrapper(TreeWrapper(self.data_repo))
+        self.storage = storage
+        if storage == 'disk':
+            self.dr_loc = path.join(location, 'data')
+            self.mr_loc = path.join(location, 'meta')
+        else:
+            self.dr_loc = self.mr_loc = None
+
+        data_backend = _open_backend(self.dr_loc, storage, journal, layout)
+        self.meta_tree = _open_backend(self.mr_loc, storage, journal)
+        self.meta_repo = self.meta_tree.repo
 
-        self.mr_loc = path.join(location, 'meta')
-        self.meta_repo = pg2.init_repository(self.mr_loc, bare=True)
-        self.meta_tree = TreeWrapper(self.meta_repo)
+        self.codec = self._recorded_codec(data_backend, codec)
+        self.data_tree = JsonDictWrapper(data_backend, codec=self.codec)
+        self.data_repo = self.data_tree.repo
+        if 'meta-schema' in self.meta_tree:
+            self.data_tree.codec = SchemaCodec(
+                self._stored_schema(), get_codec(self.codec),
+                self._stored_schema)
 
         self._transaction_open = False
         self._context_managed = False
+        self._lock = threading.RLock()
+        self._async_table = None
+        self._blob_cache = BlobCache()
+        self._maintenance_limits = None
+        self._saves_since_check = 0
+        self._maintenance_thread = None
+        self._journal_thread = None
+
+    def _recorded_codec(self, data_backend, codec):
+        if 'meta-codec' in self.meta_tree:
+            return self.meta_tree['meta-codec']
+        elif data_backend.items_list():
+            # tables from before codecs were recorded are all json
+            return DEFAULT_CODEC
+
+        codec = get_codec(codec or DEFAULT_CODEC).name
+        self.meta_tree['meta-codec'] = codec
+        self.meta_tree.save('Set codec')
+        return codec
+
+    def _stored_schema(self):
+        return Schema.from_json(self.meta_tree['meta-schema'])
+
+    def bind_schema(self, fields):
+        """Encodes documents compactly, using the fields that they have.
+
+        Documents with only these fields are stored without their field
+        names, with numbers and booleans as fixed-width binary, and with the
+        values of fields with choices as ordinals (see
+        :py:mod:`~.gitdb.schema`).  Other documents, and indexes, are still
+        stored with the table's codec.
+
+        The schema is recorded in the table's metadata.  If the fields differ
+        from those last bound, they are recorded as a new version of the
+        schema, and documents written with earlier versions can still be
+        read.
+
+        Parameters:
+            fields (list[(str, list)]): The name of every field, and its
+                choices, or None if it has none
+
+        Returns:
+            int: The schema version that documents are now written with
+        """
+        with self._lock:
+            if 'meta-schema' in self.meta_tree:
+                schema = self._stored_schema()
+            else:
+                schema = Schema()
+
+            if schema.add_version(fields):
+                self.meta_tree['meta-schema'] = schema.to_json()
+                self.meta_tree.save('Bind schema version {v}'.format(
+                    v=schema.latest))
+
+            self.data_tree.codec = SchemaCodec(
+                schema, get_codec(self.codec), self._stored_schema)
+            return schema.latest
 
     def __eq__(self, other):
+        if self.storage != 'disk':
+            return other is self
         return isinstance(other, Table) and other.location == self.location
 
+    def as_async(self):
+        """Returns an :py:class:`~.gitdb.AsyncTable` wrapping this table.
+
+        The same wrapper is returned on every call, so that all asyncio users
+        of a table share one executor and one write queue.
+        """
+        if self._async_table is None:
+            self._async_table = AsyncTable(self)
+        return self._async_table
+
     @property
     def transaction_open(self):
         """Returns whether there is currently a transaction open.
@@ -170,11 +779,14 @@ class Table:
         if self._context_managed:
             m = "Cannot manually manage transaction inside context manager"
             raise ValueError(m)
-        elif self._transaction_open:
-            m = "Cannot begin transaction when there is an open transaction"
-            raise ValueError(m)
 
-        self._transaction_open = True
+        with self._lock:
+            if self._transaction_open:
+                m = ("Cannot begin transaction when there is an open "
+                     "transaction")
+                raise ValueError(m)
+
+            self._transaction_open = True
 
     def commit(self):
         """Commits all work performed during a transaction.
@@ -196,12 +808,14 @@ class Table:
         if self._context_managed:
             m = "Cannot manually manage transaction inside context manager"
             raise ValueError(m)
-        elif not self._transaction_open:
-            m = "Cannot commit when there is not open transaction"
-            raise ValueError(m)
 
-        self._transaction_open = False
-        self.save()
+        with self._lock:
+            if not self._transaction_open:
+                m = "Cannot commit when there is not open transaction"
+                raise ValueError(m)
+
+            self._transaction_open = False
+            self.save()
 
     def rollback(self):
         """Rolls back all work performed during a transaction.
@@ -223,12 +837,14 @@ class Table:
         if self._context_managed:
             m = "Cannot manually manage transaction inside context manager"
             raise ValueError(m)
-        elif not self._transaction_open:
-            m = "Cannot rollback when there is not open transaction"
-            raise ValueError(m)
 
-        self._transaction_open = False
-        self.data_tree.rollback()
+        with self._lock:
+            if not self._transaction_open:
+                m = "Cannot rollback when there is not open transaction"
+                raise ValueError(m)
+
+            self._transaction_open = False
+            self.data_tree.rollback()
 
     @contextmanager
     def transaction(self):
@@ -260,21 +876,75 @@ class Table:
             self.commit()
 
     def revert_steps(self, steps, doc_id=None):
-        """Reverts the whole database a number of steps.
+        """Reverts the whole database, or a single document, a number of steps.
+
+        If a document id is given, only that document (and its index entries)
+        is reverted, to the version it had ``steps`` changes ago.  This is
+        committed as a new change, and it behaves like an undo: reverting a
+        document one step, and then another step, goes back two versions
+        rather than returning to where it started.  Reverting a document
+        further back than its first version removes it.
 
         Parameters:
             steps (int): The number of steps to revert
-            doc_id (int): Not implemented yet
+            doc_id (int): The document to revert, if any
+
+        Raises:
+            ValueError: if the version a document is reverted to has the same
+                value of a unique key as another document
 
         See Also:
             :py:meth:`~.Table.revert_to_state`
                 Another way of reverting changes to the database
+            :py:meth:`~.Table.history`
+                The versions that a document can be reverted to
         """
-        if doc_id is None:
-            self.data_tree.revert_steps(steps)
-        else:
+        with self._lock:
+            if doc_id is None:
+                self.data_tree.revert_steps(steps)
+                return
+
             doc_name = 'doc-{id}'.format(id=doc_id)
-            self.data_tree.revert_steps(steps, doc=doc_name)
+            restored = self.data_tree.reverted_version(steps, doc_name)
+            if restored is not None:
+                self._check_unique(doc_id, self._load_document(restored))
+
+            old_doc = self.data_tree.get(doc_name)
+            if not self.data_tree.revert_steps(steps, doc=doc_name):
+                return
+
+            if old_doc is not None:
+                self._remove_from_indexes(doc_id, old_doc)
+            new_doc = self.data_tree.get(doc_name)
+            if new_doc is not None:
+                self._add_to_indexes(doc_id, new_doc)
+
+            if not self._transaction_open:
+                self.save('revert ' + doc_name)
+
+    def history(self, doc_id):
+        """Iterates over every committed version of a document.
+
+        Versions are produced lazily, most recent first, as (state, document)
+        pairs, where the state is a marker that can be passed to
+        :py:meth:`~.Table.revert_to_state` or :py:meth:`~.Table.snapshot`.
+        If the document was removed at some state, that version's document
+        is None.
+
+        Parameters:
+            doc_id (int): The document id
+
+        Returns:
+            iterator[(state, dict)]: The versions of the document
+        """
+        doc_name = 'doc-{id}'.format(id=doc_id)
+        for state, blob_id in self.data_tree.history(doc_name):
+            yield state, self._load_document(blob_id)
+
+    def _load_document(self, blob_id):
+        if blob_id is None:
+            return None
+        return dict(self.data_tree.load_blob(blob_id, self._blob_cache))
 
     def revert_to_state(self, state, doc_id=None):
         """Reverts the whole database to a previously stored state.
@@ -289,7 +959,8 @@ class Table:
             :py:meth:`~.Table.save_state`
                 A method that allows saving the state of the database
         """
-        self.data_tree.revert_to_state(state)
+        with self._lock:
+            self.data_tree.revert_to_state(state)
 
     def save_state(self):
         """Returns a marker that can be used later to revert to the same state.
@@ -309,6 +980,162 @@ class Table:
         """
         return self.data_tree.save_state()
 
+    def list_states(self, count=None):
+        """Lists the states leading up to the current state of the table.
+
+        Parameters:
+            count (int): The maximum number of states to return.  If not
+                given, all states are returned.
+
+        Returns:
+            list: State markers, most recent first.  The first marker is the
+            same as the one returned by :py:meth:`~.Table.save_state`.
+        """
+        return self.data_tree.states(count)
+
+    def compact_history(self, keep_last=None, keep_since=None,
+                        keep_every=None):
+        """Thins out old states to stop history growing without bound.
+
+        Every state in the retention window is kept: the last ``keep_last``
+        states, and every state saved at or after ``keep_since``.  Older
+        states are dropped, except for the very first one and any checkpoints
+        picked by ``keep_every``.  The current contents of the table are not
+        changed.
+
+        Markers for states that were kept still work after compaction, but
+        using a marker for a dropped state raises a ValueError.  The objects
+        used only by dropped states are removed by the next call to
+        :py:meth:`~.Table.maintain`.
+
+        Parameters:
+            keep_last (int): The number of recent states to keep
+            keep_since (datetime or float): Keep every state saved at or
+                after this time (a datetime, or a timestamp)
+            keep_every (int or timedelta): Before the window, keep every nth
+                state, or the last state in each period of this length
+
+        Returns:
+            int: The number of states dropped
+
+        Raises:
+            ValueError: if there is an open transaction
+        """
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot compact history during a transaction"
+                raise ValueError(m)
+
+            mapping = self.data_tree.compact(keep_last, keep_since,
+                                             keep_every)
+            self.meta_tree.compact(keep_last, keep_since, keep_every)
+            return sum(1 for new in mapping.values() if new is None)
+
+    def changes(self, since_state, until_state=None):
+        """Iterates over the documents changed between two states.
+
+        Each change is an ``(op, doc_id, old_doc, new_doc)`` tuple, where
+        ``op`` is one of ``'insert'``, ``'update'`` or ``'delete'``.  Inserted
+        documents have an ``old_doc`` of None, and deleted documents have a
+        ``new_doc`` of None.  Only the entries that differ between the two
+        states are read, so this costs time proportional to the number of
+        changes rather than the size of the table.
+
+        Parameters:
+            since_state: The state marker to compare from
+            until_state: The state marker to compare to.  If not given, the
+                most recently committed state is used.
+
+        Returns:
+            iterator[(str, int, dict, dict)]: The changed documents
+        """
+        diff = self.data_tree.diff(since_state, until_state)
+        for name, old_blob, new_blob in diff:
+            if not name.startswith('doc-'):
+                continue
+
+            old_doc = self._load_document(old_blob)
+            new_doc = self._load_document(new_blob)
+
+            if old_doc is None:
+                op = 'insert'
+            elif new_doc is None:
+                op = 'delete'
+            else:
+                op = 'update'
+
+            yield op, int(name[4:]), old_doc, new_doc
+
+    def watch(self, since_state=None, poll_interval=1.0):
+        """Follows the table, producing changes as they are committed.
+
+        The table's state is polled every ``poll_interval`` seconds, and
+        whenever it has moved on, all of the changes made since the last poll
+        are produced, in the same format as :py:meth:`~.Table.changes`.  The
+        returned iterator never finishes on its own.
+
+        Parameters:
+            since_state: The state to start watching from.  If not given, only
+                changes committed after this method is called are produced.
+            poll_interval (float): Seconds to wait between polls
+
+        Returns:
+            iterator[(str, int, dict, dict)]: The changed documents
+        """
+        if since_state is None:
+            since_state = self.save_state()
+
+        def follow(last):
+            while True:
+                current = self.save_state()
+                if current == last:
+                    time.sleep(poll_interval)
+                    continue
+
+                for change in self.changes(last, current):
+                    yield change
+                last = current
+
+        return follow(since_state)
+
+    def snapshot(self, state=None):
+        """Returns a read-only view of the table at a particular state.
+
+        The view is pinned to the state it was created with, so it keeps
+        returning the same results while other writers continue to commit to
+        the table, and it never moves the table's head the way
+        :py:meth:`~.Table.revert_to_state` does.  Uncommitted changes from an
+        open transaction are not visible in the view.
+
+        Parameters:
+            state: A marker returned by :py:meth:`~.Table.save_state`.  If
+                not given, the most recently committed state is used.
+
+        Returns:
+            Snapshot: The read-only view
+
+        Raises:
+            ValueError: if the state does not exist
+        """
+        with self._lock:
+            return Snapshot(self, self.data_tree.view(state))
+
+    def resolve_state(self, as_of):
+        """Finds the state marker that an ``as_of`` argument refers to.
+
+        See :py:meth:`~.Table.find` for the values that ``as_of`` can take.
+        Resolving a relative ``as_of`` once and reusing the marker ensures
+        that several queries all see the same state.
+
+        Raises:
+            ValueError: if no state matches
+        """
+        return self.data_tree.resolve_state(as_of)
+
+    def _at(self, as_of):
+        with self._lock:
+            return self.snapshot(self.resolve_state(as_of))
+
     def insert(self, document):
         """Inserts a document into this database.
 
@@ -330,20 +1157,23 @@ class Table:
 
         Returns:
             int: Document ID
+
+        Raises:
+            ValueError: if another document has the same value of a unique
+                key (see :py:meth:`~.Table.create_index`)
         """
-        d_id = self._get_next_id()
-        self.data_tree['doc-{id}'.format(id=d_id)] = document
+        with self._lock:
+            d_id = self._insert(document)
 
-        # set up indexes
-        for key, val in document.items():
-            val = json.dumps(val)
-            index_name = 'index-{key}'.format(key=key)
-            index = self.data_tree.get(index_name, {})
-            index.setdefault(val, []).append(d_id)
-            self.data_tree[index_name] = index
+            if not self.transaction_open:
+                self.save('insert doc-{id}'.format(id=d_id))
+        return d_id
 
-        if not self.transaction_open:
-            self.save('insert doc-{id}'.format(id=d_id))
+    def _insert(self, document):
+        self._check_unique(None, document)
+        d_id = self._get_next_id()
+        self.data_tree['doc-{id}'.format(id=d_id)] = document
+        self._add_to_indexes(d_id, document)
         return d_id
 
     def update(self, d_id, document):
@@ -364,162 +1194,645 @@ class Table:
             int: Document ID
 
         Raises:
-            ValueError: if the document id does not exist
+            ValueError: if the document id does not exist, or another
+                document has the same value of a unique key
         """
+        with self._lock:
+            self._update(d_id, document)
+
+            if not self._transaction_open:
+                self.save('update doc-{id}'.format(id=d_id))
+
+        return d_id
+
+    def _update(self, d_id, document):
         doc_name = 'doc-{id}'.format(id=d_id)
         if doc_name not in self.data_tree:
             raise ValueError("Cannot update document that doesn't exist")
 
+        self._check_unique(d_id, document)
         old_doc = self.data_tree[doc_name]
         self.data_tree[doc_name] = document
 
-        # remove old indexes
-        for key, val in old_doc.items():
-            val = json.dumps(val)
+        self._remove_from_indexes(d_id, old_doc)
+        self._add_to_indexes(d_id, document)
+
+    def upsert(self, match_where, document):
+        """Updates the document matching a search, or inserts one if there
+        isn't one.
+
+        The simple terms of ``match_where`` (the ones that give a value,
+        rather than a dict of operators) are copied into the document that
+        is written, unless ``document`` has its own value for that key, so
+        that upserting the same search again finds the same document.
+
+        The match is found without reading any documents where possible:
+        a simple term for a unique key (see :py:meth:`~.Table.create_index`)
+        is a single item lookup, and other searches use the indexes as
+        :py:meth:`~.Table.find` does, including composite indexes.  Either
+        way, the search and the write happen under the table's lock, and are
+        saved as one commit (or as part of the open transaction).
+
+        Parameters:
+            match_where (dict): Search definition (see
+                :py:meth:`~.Table.find`), matching at most one document
+            document (dict): The document to write
+
+        Returns:
+            int: The id of the updated or inserted document
+
+        Raises:
+            ValueError: if more than one document matches, or another
+                document has the same value of a unique key
+        """
+        terms = {key: value for key, value in match_where.items()
+                 if key not in BOOLEAN_NODES and not isinstance(value, dict)}
+        terms.update(document)
+
+        with self._lock:
+            d_id = self._upsert_match(match_where)
+            if d_id is None:
+                d_id = self._insert(terms)
+            else:
+                self._update(d_id, terms)
+
+            if not self._transaction_open:
+                self.save('upsert doc-{id}'.format(id=d_id))
+
+        return d_id
+
+    def _upsert_match(self, match_where):
+        """The id of the one document matching ``match_where``, or None."""
+        where = dict(match_where)
+        ids = None
+        for key, value in match_where.items():
+            if key in BOOLEAN_NODES or isinstance(value, dict) or \
+                    not self.is_unique(key):
+                continue
+            owner = self.data_tree.get(self._claim_name(key, value))
+            if owner is None:
+                return None
+            ids = {owner}
+            del where[key]
+            break
+
+        if where or ids is None:
+            found = self._conjunction(self._plan(where, {}))
+            if found is None:
+                found = self._all_ids()
+            ids = set(found) if ids is None else ids.intersection(found)
+
+        if len(ids) > 1:
+            m = "Cannot upsert, {n} documents match {where!r}"
+            raise ValueError(m.format(n=len(ids), where=match_where))
+        return next(iter(ids), None)
+
+    def delete(self, d_id):
+        """Deletes the document at `d_id`, and removes it from every index.
+
+        Parameters:
+            d_id (int): A previously-saved document id
+
+        Raises:
+            ValueError: if the document id does not exist
+        """
+        with self._lock:
+            doc_name = 'doc-{id}'.format(id=d_id)
+            if doc_name not in self.data_tree:
+                raise ValueError("Cannot delete document that doesn't exist")
+
+            old_doc = self.data_tree[doc_name]
+            del self.data_tree[doc_name]
+            self._remove_from_indexes(d_id, old_doc)
+
+            if not self._transaction_open:
+                self.save('delete ' + doc_name)
+
+    def _add_to_indexes(self, d_id, document):
+        for key, value in document.items():
+            if not self.is_indexed(key):
+                continue
+            val = json.dumps(value)
             index_name = 'index-{key}'.format(key=key)
             index = self.data_tree.get(index_name, {})
-            index.setdefault(val, []).pop(d_id)
+            if val not in index:
+                self._update_predicates(key, val, value, True)
+                self._update_text_index(key, val, value, True)
+            index.setdefault(val, []).append(d_id)
             self.data_tree[index_name] = index
-
-        # insert new indexes
-        for key, val in document.items():
-            val = json.dumps(val)
+        self._update_composites(d_id, document, True)
+        self._update_claims(d_id, document, True)
+
+    def _remove_from_indexes(self, d_id, document):
+        for key, value in document.items():
+            if not self.is_indexed(key):
+                continue
+            val = json.dumps(value)
             index_name = 'index-{key}'.format(key=key)
             index = self.data_tree.get(index_name, {})
-            index.setdefault(val, []).append(d_id)
+            ids = index.get(val, [])
+            if d_id in ids:
+                ids.remove(d_id)
+            if not ids and val in index:
+                del index[val]
+                self._update_predicates(key, val, value, False)
+                self._update_text_index(key, val, value, False)
             self.data_tree[index_name] = index
+        self._update_composites(d_id, document, False)
+        self._update_claims(d_id, document, False)
+
+    def is_unique(self, key):
+        """Whether no two documents can have the same value of a key."""
+        return 'unique-{key}'.format(key=key) in self.data_tree
+
+    @staticmethod
+    def _claim_name(key, value):
+        # hashed, as values can be any length, and contain any character
+        text = json.dumps([key, value]).encode('utf-8')
+        return 'claim-' + hashlib.sha1(text).hexdigest()
+
+    def _check_unique(self, d_id, document):
+        """Raises ValueError if another document has claimed the value of a
+        unique key in ``document``."""
+        for key, value in document.items():
+            if not self.is_unique(key):
+                continue
+            owner = self.data_tree.get(self._claim_name(key, value))
+            if owner is not None and owner != d_id:
+                m = "Document {owner} already has {key} = {value!r}"
+                raise ValueError(m.format(owner=owner, key=key, value=value))
+
+    def _update_claims(self, d_id, document, added):
+        for key, value in document.items():
+            if not self.is_unique(key):
+                continue
+            name = self._claim_name(key, value)
+            if added:
+                self.data_tree[name] = d_id
+            elif self.data_tree.get(name) == d_id:
+                del self.data_tree[name]
+
+    def _update_composites(self, d_id, document, added):
+        for keys in self.data_tree.get(COMPOSITE_LIST, []):
+            if keys[0] not in document:
+                continue
+
+            name = CompositeIndex.item_name(keys)
+            index = CompositeIndex(keys, self.data_tree.get(name, {}))
+            if added:
+                index.add(d_id, document)
+            else:
+                index.remove(d_id, document)
+            self.data_tree[name] = index.dump()
+
+    def _update_predicates(self, key, val, value, added):
+        props_name = 'props-{key}'.format(key=key)
+        if not isinstance(value, str) or props_name not in self.data_tree:
+            return
 
-        if not self._transaction_open:
-            self.save('update ' + doc_name)
-
-        return d_id
+        sets = PredicateSets(self.data_tree[props_name])
+        if added:
+            changed = sets.add(val, value)
+        else:
+            changed = sets.remove(val, value)
+        if changed:
+            self.data_tree[props_name] = sets.dump()
 
-    def save(self, msg=''):
-        """Commits all current unsaved changes
+    def _update_text_index(self, key, val, value, added):
+        text_name = 'text-{key}'.format(key=key)
+        if text_name not in self.data_tree:
+            return
 
-        Normally, this will be automatically called by any methods that
-        make changes, or by the transaction methods.  This shouldn't be called
-        otherwise, unless in exceptional circumstances (in which case, file an
-        issue because something's probably gone wrong.)
+        text = TextIndex(self.data_tree[text_name])
+        if added:
+            text.add(val, value)
+        else:
+            text.remove(val, value)
+        self.data_tree[text_name] = text.dump()
+
+    def create_index(self, key, unique=False):
+        """Indexes the values of a key, if they aren't already.
+
+        Every key is indexed when it is first written, so for single keys,
+        this is only needed for keys whose index was dropped with
+        :py:meth:`drop_index`, or to make a key unique.  Given a tuple of
+        keys, this creates a composite index of their values (see
+        :py:mod:`~.gitdb.composite`), which searches with simple terms for
+        the first two or more of those keys use instead of the index of each
+        key.  Either way, the index is built from every document in the
+        table.
+
+        With ``unique=True``, no two documents can have the same value of
+        the key (with values compared as json, as in scalar searches), and
+        writes that would break this raise ValueError.  Each value is
+        claimed by its document with an item of its own in the table, so
+        checking a write only looks that one item up, in the same working
+        copy that the write is made in.
 
         Parameters:
-            msg (str): This will become git's commit message
+            key (str or tuple): The key to index, or the keys of a composite
+                index
+            unique (bool): Whether values of the key must be unique
+
+        Raises:
+            ValueError: if there is an open transaction, if a key is given
+                more than once, if a composite index is made unique, or if
+                documents already share a value of a key made unique
         """
-        return self.data_tree.save(msg)
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot create an index during a transaction"
+                raise ValueError(m)
+            elif isinstance(key, (tuple, list)) and len(key) > 1:
+                if unique:
+                    raise ValueError("Composite indexes can't be unique")
+                return self._create_composite(list(key))
+            elif isinstance(key, (tuple, list)):
+                key = key[0]
+
+            indexed = self.is_indexed(key)
+            make_unique = unique and not self.is_unique(key)
+            if indexed and not make_unique:
+                return
+
+            if indexed:
+                index = self.data_tree.get('index-{key}'.format(key=key), {})
+            else:
+                index = self._scan_index(key)
+            if make_unique:
+                for value_key, ids in index.items():
+                    if len(ids) > 1:
+                        m = "Documents {ids} all have {key} = {value}"
+                        raise ValueError(m.format(ids=ids, key=key,
+                                                  value=value_key))
+
+            changes = []
+            if not indexed:
+                del self.data_tree['noindex-{key}'.format(key=key)]
+                self.data_tree['index-{key}'.format(key=key)] = index
+                changes.append('create index ' + key)
+
+            if make_unique:
+                for value_key, ids in index.items():
+                    name = self._claim_name(key, json.loads(value_key))
+                    self.data_tree[name] = ids[0]
+                self.data_tree['unique-{key}'.format(key=key)] = True
+                changes.append('make ' + key + ' unique')
+
+            self.save('\n'.join(changes))
+
+    def _create_composite(self, keys):
+        if len(set(keys)) != len(keys):
+            raise ValueError("Composite indexes need different keys")
+
+        composites = self.data_tree.get(COMPOSITE_LIST, [])
+        if keys in composites:
+            return
 
-    def get(self, doc_id):
-        """Gets a document given it's document id.
+        index = CompositeIndex.build(keys, self)
+        self.data_tree[CompositeIndex.item_name(keys)] = index.dump()
+        self.data_tree[COMPOSITE_LIST] = composites + [keys]
+        self.save('create index ' + ', '.join(keys))
 
-        This is the simplest but least useful way of getting information out of
-        the database.  It returns the document.
+    def drop_index(self, key):
+        """Stops indexing the values of a key.
+
+        Writes to the key no longer update an index (or its text index, or
+        predicate sets), which makes writing large values that are rarely
+        searched much cheaper.  The key can still be searched, but every
+        search on it reads every document in the table.  If the key was
+        unique, it no longer is.
+
+        Given a tuple of keys, this drops their composite index, and the
+        keys themselves stay indexed.
 
         Parameters:
-            doc_id (int): The document ID to fetch
+            key (str or tuple): The key to stop indexing, or the keys of a
+                composite index
 
-        Returns:
-            dict: The document
+        Raises:
+            ValueError: if there is an open transaction
         """
-        if not isinstance(doc_id, int):
-            raise TypeError("id must be an integer")
-
-        doc = self.data_tree.get('doc-{id}'.format(id=doc_id))
-        if doc is None:
-            err = "No such document under id {id}".format(id=doc_id)
-            raise ValueError(err)
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot drop an index during a transaction"
+                raise ValueError(m)
+            elif isinstance(key, (tuple, list)) and len(key) > 1:
+                return self._drop_composite(list(key))
+            elif isinstance(key, (tuple, list)):
+                key = key[0]
+
+            if not self.is_indexed(key):
+                return
+
+            if self.is_unique(key):
+                index = self.data_tree.get('index-{key}'.format(key=key), {})
+                for value_key in index:
+                    name = self._claim_name(key, json.loads(value_key))
+                    del self.data_tree[name]
+                del self.data_tree['unique-{key}'.format(key=key)]
+
+            for kind in ('index', 'props', 'text'):
+                name = '{kind}-{key}'.format(kind=kind, key=key)
+                if name in self.data_tree:
+                    del self.data_tree[name]
+            self.data_tree['noindex-{key}'.format(key=key)] = True
+            self.save('drop index ' + key)
+
+    def _drop_composite(self, keys):
+        composites = self.data_tree.get(COMPOSITE_LIST, [])
+        if keys not in composites:
+            return
 
-        return doc
+        composites.remove(keys)
+        del self.data_tree[CompositeIndex.item_name(keys)]
+        if composites:
+            self.data_tree[COMPOSITE_LIST] = composites
+        else:
+            del self.data_tree[COMPOSITE_LIST]
+        self.save('drop index ' + ', '.join(keys))
 
-    def find_ids(self, where):
-        """Find the ids that match a given query.
+    def create_text_index(self, key):
+        """Indexes a key for substring, prefix and suffix searches.
 
-        This method is the same as :py:meth:`~.Table.find`, but returns the
-        ids rather than (id, doc) pairs.
+        The ``contains``, ``startswith`` and ``endswith`` operators on the
+        key then look up the matching values in the text index, rather than
+        testing every distinct value (see :py:mod:`~.gitdb.text_index`).
+        The text index is kept up to date by every later write.
 
         Parameters:
-            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            key (str): The key to index
 
-        Returns:
-            list[int]: A list of matching document ids
+        Raises:
+            ValueError: if there is an open transaction, or the key isn't
+                indexed
         """
-        return [i[0] for i in self.find(where)]
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot create an index during a transaction"
+                raise ValueError(m)
+            elif not self.is_indexed(key):
+                raise ValueError("Key " + key + " is not indexed")
 
-    def find_items(self, where):
-        """Find the documents that match a given query.
+            index = self.data_tree.get('index-{key}'.format(key=key), {})
+            text = TextIndex.build(index)
+            self.data_tree['text-{key}'.format(key=key)] = text.dump()
+            self.save('create text index ' + key)
 
-        This method is the same as :py:meth:`~.Table.find`, but returns the
-        documents rather than (id, doc) pairs.
+    def drop_text_index(self, key):
+        """Removes the text index of a key, if it has one.
+
+        Raises:
+            ValueError: if there is an open transaction
+        """
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot drop an index during a transaction"
+                raise ValueError(m)
+
+            text_name = 'text-{key}'.format(key=key)
+            if text_name in self.data_tree:
+                del self.data_tree[text_name]
+                self.save('drop text index ' + key)
+
+    def create_predicate_index(self, key):
+        """Stores the results of the ``is*`` string methods for a key.
+
+        Searches on the key with ``isdigit``, ``isupper`` and the other
+        ``is*`` operators then look the results up, rather than calling the
+        method on every distinct value (see :py:mod:`~.gitdb.predicates`).
+        The results are worked out once for each distinct value, by every
+        later write that adds one.
 
         Parameters:
-            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            key (str): The key to index
 
-        Returns:
-            list[dict]: A list of matching documents
+        Raises:
+            ValueError: if there is an open transaction, or the key isn't
+                indexed
         """
-        return [i[1] for i in self.find(where)]
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot create an index during a transaction"
+                raise ValueError(m)
+            elif not self.is_indexed(key):
+                raise ValueError("Key " + key + " is not indexed")
 
-    def find(self, where):
-        """Finds the documents that match a given query.
+            index = self.data_tree.get('index-{key}'.format(key=key), {})
+            props = PredicateSets.build(index)
+            self.data_tree['props-{key}'.format(key=key)] = props.dump()
+            self.save('create predicate index ' + key)
 
-        For details on searching, see :doc:`/search_queries`.  Searches in the
-        raw :py:class:`~.GitDB` should be documents, rather than keyword
-        arguments, but otherwise searches are the same.
+    def drop_predicate_index(self, key):
+        """Removes the predicate sets of a key, if it has them.
 
-        This method returns (id, document) pairs.  There are also the
-        convenience methods :py:meth:`~.Table.find_ids` and
-        :py:meth:`~.Table.find_items`, which just return the ids and documents
-        respectively.
+        Raises:
+            ValueError: if there is an open transaction
+        """
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot drop an index during a transaction"
+                raise ValueError(m)
 
-        Parameters:
-            where (dict): Search definition
+            props_name = 'props-{key}'.format(key=key)
+            if props_name in self.data_tree:
+                del self.data_tree[props_name]
+                self.save('drop predicate index ' + key)
 
-        Returns:
-            list[(int, dict)]: A list of matching documents
+    def save(self, msg=''):
+        """Commits all current unsaved changes
+
+        Normally, this will be automatically called by any methods that
+        make changes, or by the transaction methods.  This shouldn't be called
+        otherwise, unless in exceptional circumstances (in which case, file an
+        issue because something's probably gone wrong.)
+
+        Parameters:
+            msg (str): This will become git's commit message
         """
-        all_ids = {int(i[4:]) for i in self.data_tree.items_list()
-                   if i.startswith('doc-')}
+        with self._lock:
+            result = self.data_tree.save(msg)
 
-        id_sets = [all_ids]
+            limits = self._maintenance_limits
+            if limits is not None:
+                self._saves_since_check += 1
+                if self._saves_since_check >= limits['every']:
+                    self.maintain_if_needed()
 
-        for key, term in where.items():
-            index = self.data_tree.get('index-{key}'.format(key=key), {})
+            return result
 
-            if isinstance(term, dict):
-                id_sets.append(self._find_complex(key, term, index, all_ids))
+    def migrate_layout(self, layout):
+        """Rewrites the table's documents into a different layout.
 
-            else:  # simple term, i.e. name="bob"
-                id_sets.append(self._find_simple(key, term, index))
+        The ``'fanout'`` layout keeps the cost of a save low for large tables
+        (see :py:mod:`~.gitdb.layout`).  Migration rewrites every entry once,
+        and is saved as a new state.  Earlier states can still be read and
+        reverted to.  Tables that aren't stored in git are left as they are.
 
-        doc_ids = reduce(lambda x, y: x & y, id_sets)
+        Parameters:
+            layout (str): ``'flat'`` or ``'fanout'``
 
-        return [(i, self.data_tree['doc-{id}'.format(id=i)]) for i in doc_ids]
+        Returns:
+            bool: Whether the table was migrated
 
-    def find_one(self, where):
-        """Finds one document
+        Raises:
+            ValueError: if there is an open transaction, or the layout is
+                unknown
+        """
+        with self._lock:
+            if self.transaction_open:
+                m = "Cannot migrate layout during a transaction"
+                raise ValueError(m)
+            return self.data_tree.migrate_layout(layout)
+
+    def fold_journal(self):
+        """Commits every journaled save as a single state.
+
+        This does nothing unless the table was opened with ``journal=True``.
+        Journals synchronise their own folds with saves, so this doesn't
+        wait for the table's lock.
+        """
+        self.meta_tree.fold()
+        self.data_tree.fold()
 
-        This method functions the same as :py:meth:`~.Table.find`, but returns
-        just one element, or None if no element found.
+    def auto_fold(self, interval=1.0):
+        """Starts a :py:class:`~.journal.JournalThread` that calls
+        :py:meth:`~.Table.fold_journal` every ``interval`` seconds.
+
+        Returns:
+            The background thread
+        """
+        if self._journal_thread is None:
+            self._journal_thread = JournalThread(self, interval)
+            self._journal_thread.start()
+        return self._journal_thread
+
+    def stop_folding(self):
+        """Stops the background thread started by :py:meth:`auto_fold`."""
+        if self._journal_thread is not None:
+            self._journal_thread.stop()
+            self._journal_thread = None
+
+    def maintain(self, prune_grace=maintenance.DEFAULT_PRUNE_GRACE):
+        """Packs loose objects and prunes unreachable ones.
+
+        Every write to the table stores its documents, indexes and commit as
+        individual loose files in the table's repositories.  This packs all
+        of the objects that are still used into a single packfile, and
+        deletes the loose copies, along with any loose objects that no saved
+        state refers to (for example, those written during a transaction that
+        was rolled back).  Unreferenced objects younger than ``prune_grace``
+        seconds are kept, in case another writer is still using them.
 
         Parameters:
-            where (dict): Search definition (see :py:meth:`~.Table.find`)
+            prune_grace (float): The minimum age of objects to prune
 
         Returns:
-            *(int, document)* or *None*
+            dict: Statistics for the ``'data'`` and ``'meta'`` repositories,
+            as returned by :py:func:`.maintenance.maintain`
         """
-        res = self.find(where)
-        if len(res) > 0:
-            return res[0]
-        else:
-            return None
+        with self._lock:
+            self._saves_since_check = 0
+            return {
+                'data': self.data_tree.maintain(prune_grace),
+                'meta': self.meta_tree.maintain(prune_grace),
+            }
+
+    def auto_maintain(self, max_loose_objects=10000,
+                      max_loose_size=64 * 1024 * 1024, check_every=100,
+                      background=False, interval=60.0):
+        """Runs :py:meth:`~.Table.maintain` automatically when needed.
+
+        Maintenance is needed once either repository holds more than
+        ``max_loose_objects`` loose objects, or more than ``max_loose_size``
+        bytes of them.  This is checked after every ``check_every`` saves,
+        and, if ``background`` is true, every ``interval`` seconds on a
+        :py:class:`~.maintenance.MaintenanceThread`.
 
-    def _find_simple(self, key, val, index):
-        vals = json.dumps(val)
-        return set(index.get(vals, []))
+        Parameters:
+            max_loose_objects (int): Loose object count threshold
+            max_loose_size (int): Loose object size threshold, in bytes
+            check_every (int): Number of saves between checks, or None to
+                only check in the background
+            background (bool): Whether to start a background thread
+            interval (float): Seconds between background checks
 
-    def _find_complex(self, key, query, index, al):
-        inc_sets = []
+        Returns:
+            The background thread, or None
+        """
+        self._maintenance_limits = {
+            'objects': max_loose_objects,
+            'size': max_loose_size,
+            'every': float('inf') if check_every is None else check_every,
+        }
+
+        if background and self._maintenance_thread is None:
+            thread = maintenance.MaintenanceThread(self, interval)
+            thread.start()
+            self._maintenance_thread = thread
+
+        return self._maintenance_thread
+
+    def stop_maintenance(self):
+        """Turns off automatic maintenance, and stops any background thread."""
+        self._maintenance_limits = None
+        if self._maintenance_thread is not None:
+            self._maintenance_thread.stop()
+            self._maintenance_thread = None
+
+    def needs_maintenance(self):
+        """Whether either repository has passed the maintenance thresholds."""
+        limits = self._maintenance_limits
+        if limits is None:
+            return False
+
+        for backend in (self.data_tree, self.meta_tree):
+            stats = backend.object_stats()
+            if stats['loose_objects'] > limits['objects']:
+                return True
+            if stats['loose_size'] > limits['size']:
+                return True
+        return False
+
+    def maintain_if_needed(self):
+        """Runs :py:meth:`~.Table.maintain` if the thresholds are passed.
+
+        Returns:
+            dict: The maintenance statistics, or None if nothing was done
+        """
+        self._saves_since_check = 0
+        if self.needs_maintenance():
+            return self.maintain()
+        return None
+
+
+class Snapshot(_DocumentReader):
+    """A read-only view of a table at a fixed state.
+
+    Snapshots are created by :py:meth:`.Table.snapshot`, and support the same
+    :py:meth:`~.Table.get` and :py:meth:`~.Table.find` methods as the table
+    they came from.  Iterating over a snapshot yields every (id, document)
+    pair in it, ordered by id.
+
+    Decoded documents and indexes are cached by the id of the blob that they
+    were read from, and that cache is shared with all other snapshots of the
+    same table.
+    """
+
+    def __init__(self, table, view):
+        self.table = table
+        self._blob_cache = table._blob_cache
+        self.data_tree = JsonDictWrapper(view, cache=table._blob_cache,
+                                         codec=table.data_tree.codec)
+
+    @property
+    def state(self):
+        """The state marker that this snapshot is pinned to."""
+        return self.data_tree.state
 
-        for operator, arg in query.items():
-            func = SearchFunction.get(operator)
-            inc_sets.append(func(key, operator, arg, index, query, al))
+    def _document(self, doc_id):
+        doc = super()._document(doc_id)
+        return None if doc is None else dict(doc)
 
-        return reduce(lambda x, y: x & y, inc_sets)
+    def _at(self, as_of):
+        return self.table._at(as_of)
@@ -0,0 +1,194 @@
+"""An asyncio front-end for :py:class:`~.gitdb.Table`
+
+Every operation on a :py:class:`~.gitdb.Table` blocks on libgit2 I/O and
+document decoding.  :py:class:`AsyncTable` runs that work in a bounded
+thread pool so that it can be awaited from a running event loop.
+
+Reads are run against a :py:class:`~.gitdb.Snapshot` of the last committed
+state, which is taken under the table's lock, and then read without holding
+it, so several reads can run in the pool at once.  While a transaction is
+open on the table, reads that don't give ``as_of`` are run on the table
+itself, under its lock, so that they see the transaction's changes.
+
+Writes are not sent to the pool straight away.  Instead, every write that
+arrives during the same iteration of the event loop is queued, and the queue
+is then flushed as a single transaction, so that a burst of concurrent
+writers produces one commit rather than one commit each.  A batch never
+joins a transaction that was opened on the table some other way, as it can't
+know whether that transaction will be committed: if one is open when the
+batch is written, every write in the batch fails with a ValueError.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+__all__ = ['AsyncTable']
+
+
+class AsyncTable:
+    """Awaitable wrapper around a :py:class:`~.gitdb.Table`
+
+    All methods are coroutines that mirror the methods of the same name on
+    the wrapped table.  Writes are serialised through the table's own lock,
+    which the table's own write methods also take, so the wrapped table can
+    still be written to directly: a direct write waits for any batch that is
+    being written, rather than joining it.
+
+    Parameters:
+        table (Table): The table to wrap
+        max_workers (int): The maximum number of threads used to run
+            blocking table operations, and so the number of reads that can
+            run at once
+    """
+
+    def __init__(self, table, max_workers=4):
+        self.table = table
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+        self._flush_scheduled = False
+
+    def __eq__(self, other):
+        return isinstance(other, AsyncTable) and other.table == self.table
+
+    def close(self):
+        """Shuts down the executor once all queued work has finished."""
+        self._executor.shutdown(wait=True)
+
+    def _locked(self, func, *args, **kwargs):
+        with self.table._lock:
+            return func(*args, **kwargs)
+
+    def _read(self, method, *args, as_of=None, **kwargs):
+        table = self.table
+        with table._lock:
+            if as_of is None and table.transaction_open:
+                return getattr(table, method)(*args, **kwargs)
+            reader = table.snapshot() if as_of is None else table._at(as_of)
+        return getattr(reader, method)(*args, **kwargs)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return loop.run_in_executor(self._executor, call)
+
+    def _queue_write(self, method, *args):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((method, args, future))
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._start_flush, loop)
+
+        return future
+
+    def _start_flush(self, loop):
+        batch, self._pending = self._pending, []
+        self._flush_scheduled = False
+        loop.create_task(self._flush(batch))
+
+    async def _flush(self, batch):
+        try:
+            results = await self._run(self._locked, self._write_batch,
+                                      batch)
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (_, _, future), (result, exc) in zip(batch, results):
+            if future.done():  # cancelled while waiting
+                continue
+            elif exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def _write_batch(self, batch):
+        table = self.table
+        if table.transaction_open:
+            # joining it would lose the batch if that transaction rolls back
+            m = "Cannot write asynchronously while a transaction is open"
+            raise ValueError(m)
+
+        table.begin_transaction()
+        results = []
+        try:
+            for method, args, _ in batch:
+                try:
+                    results.append((getattr(table, method)(*args), None))
+                except Exception as exc:
+                    results.append((None, exc))
+        except BaseException:
+            table.rollback()
+            raise
+
+        table.commit()
+        return results
+
+    async def insert(self, document):
+        """Inserts a document.  See :py:meth:`.Table.insert`.
+
+        Inserts made during the same event loop iteration share a commit.
+        """
+        return await self._queue_write('insert', document)
+
+    async def update(self, d_id, document):
+        """Updates a document.  See :py:meth:`.Table.update`.
+
+        Updates made during the same event loop iteration share a commit.
+        """
+        return await self._queue_write('update', d_id, document)
+
+    async def delete(self, d_id):
+        """Deletes a document.  See :py:meth:`.Table.delete`.
+
+        Deletes made during the same event loop iteration share a commit.
+        """
+        return await self._queue_write('delete', d_id)
+
+    async def upsert(self, match_where, document):
+        """Updates or inserts a document.  See :py:meth:`.Table.upsert`.
+
+        Upserts made during the same event loop iteration share a commit.
+        """
+        return await self._queue_write('upsert', match_where, document)
+
+    async def get(self, doc_id, as_of=None):
+        """Gets a document.  See :py:meth:`.Table.get`."""
+        return await self._run(self._read, 'get', doc_id, as_of=as_of)
+
+    async def get_fields(self, doc_ids, fields, as_of=None):
+        """Gets keys of documents.  See :py:meth:`.Table.get_fields`."""
+        return await self._run(self._read, 'get_fields', doc_ids, fields,
+                               as_of=as_of)
+
+    async def find(self, where, as_of=None, fields=None):
+        """Finds documents.  See :py:meth:`.Table.find`."""
+        return await self._run(self._read, 'find', where, as_of=as_of,
+                               fields=fields)
+
+    async def find_ids(self, where, as_of=None):
+        """Finds document ids.  See :py:meth:`.Table.find_ids`."""
+        return await self._run(self._read, 'find_ids', where, as_of=as_of)
+
+    async def find_items(self, where, as_of=None, fields=None):
+        """Finds documents.  See :py:meth:`.Table.find_items`."""
+        return await self._run(self._read, 'find_items', where, as_of=as_of,
+                               fields=fields)
+
+    async def find_one(self, where, as_of=None):
+        """Finds one document.  See :py:meth:`.Table.find_one`."""
+        return await self._run(self._read, 'find_one', where, as_of=as_of)
+
+    async def resolve_state(self, as_of):
+        """Resolves a past state.  See :py:meth:`.Table.resolve_state`."""
+        return await self._run(self._locked, self.table.resolve_state,
+                               as_of)
+
+    async def save_state(self):
+        """Gets a state marker.  See :py:meth:`.Table.save_state`."""
+        return await self._run(self._locked, self.table.save_state)
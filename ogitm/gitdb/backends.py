@@ -0,0 +1,472 @@
+"""Storage backends for tables
+
+A :py:class:`~.gitdb.Table` stores its documents and indexes as named text
+items in a :py:class:`StorageBackend`.  Writes go to a working copy, which is
+either committed as a new state by :py:meth:`~StorageBackend.save`, or
+thrown away by :py:meth:`~StorageBackend.rollback`, and every committed
+state can be returned to later.
+
+Two backends are provided:
+
+* :py:class:`~.treewrapper.TreeWrapper` stores every state as a git commit,
+  either in a repository on disk, or in memory.
+* :py:class:`DictBackend` stores every state as a plain dict, linked to the
+  state before it.  It is never written to disk, and doesn't need to build
+  git objects for every write, so it is much faster, but it can't be shared
+  between processes or reopened.
+
+Both support the same operations, so a table behaves the same whichever
+backend it uses.
+"""
+
+import abc
+import bisect
+import datetime
+import time
+
+from .history import undo_stack, retained_positions
+
+
+__all__ = ['StorageBackend', 'DictBackend', 'DictView', 'as_bytes']
+
+
+def as_bytes(data):
+    """Encodes text as UTF-8, and returns bytes-like objects as they are."""
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return data
+
+
+class StorageBackend(abc.ABC):
+    """The interface between a table and the place its items are stored.
+
+    Items are text or bytes, stored under string names.  Reading an item
+    reads the working copy if anything has been written since the last save,
+    and the current state otherwise.  Items can also be read as bytes, with
+    :py:meth:`get_bytes`, so that codecs (see :py:mod:`~.gitdb.codecs`) can
+    decode them without going through text.  State markers are opaque, but
+    must not be integers or datetimes, as :py:meth:`resolve_state` gives
+    those a different meaning.
+
+    Backends also identify the value of each stored item by a "blob id",
+    which never refers to a different value once handed out, so that decoded
+    values can be cached by it (see :py:class:`~.json_wrapper.BlobCache`).
+    """
+
+    # The git repository behind this backend, if there is one
+    repo = None
+
+    @abc.abstractmethod
+    def __getitem__(self, name):
+        """Reads an item, raising KeyError if it doesn't exist."""
+
+    @abc.abstractmethod
+    def __setitem__(self, name, text):
+        """Writes an item to the working copy."""
+
+    @abc.abstractmethod
+    def __delitem__(self, name):
+        """Deletes an item from the working copy."""
+
+    @abc.abstractmethod
+    def __contains__(self, name):
+        """Whether an item exists."""
+
+    @abc.abstractmethod
+    def items_list(self):
+        """The names of every item."""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Deletes every item from the working copy."""
+
+    @abc.abstractmethod
+    def save(self, msg=''):
+        """Commits the working copy as a new state."""
+
+    @abc.abstractmethod
+    def rollback(self):
+        """Discards the working copy."""
+
+    @abc.abstractmethod
+    def save_state(self):
+        """A marker for the current state."""
+
+    @abc.abstractmethod
+    def revert_to_state(self, state):
+        """Makes the given state the current one."""
+
+    @abc.abstractmethod
+    def states(self, count=None):
+        """The last ``count`` states, most recent first."""
+
+    @abc.abstractmethod
+    def resolve_state(self, as_of):
+        """Turns a state, a number of steps back, or a time into a state."""
+
+    @abc.abstractmethod
+    def view(self, state=None):
+        """A read-only view of the items at a state (by default the current
+        one), with ``state`` and ``blob_id`` attributes."""
+
+    @abc.abstractmethod
+    def revert_steps(self, steps, doc=None):
+        """Steps the whole store, or only the item ``doc``, back in time.
+
+        Returns:
+            int: The number of steps taken
+        """
+
+    @abc.abstractmethod
+    def reverted_version(self, steps, doc):
+        """The blob id that ``revert_steps(steps, doc)`` would give the item
+        ``doc``, without reverting it, or None if it would be removed or
+        left as it is."""
+
+    @abc.abstractmethod
+    def history(self, name):
+        """Every (state, blob id) version of ``name``, most recent first."""
+
+    @abc.abstractmethod
+    def diff(self, since, until=None):
+        """Every (name, old blob id, new blob id) change between two
+        states."""
+
+    @abc.abstractmethod
+    def read_blob(self, blob_id):
+        """The text stored under a blob id."""
+
+    def get_bytes(self, name):
+        """Reads an item as a bytes-like object, raising KeyError if it
+        doesn't exist."""
+        return as_bytes(self[name])
+
+    def read_blob_bytes(self, blob_id):
+        """The data stored under a blob id, as a bytes-like object."""
+        return as_bytes(self.read_blob(blob_id))
+
+    def blob_id(self, name):
+        """The blob id of an item, raising KeyError if it doesn't exist.
+
+        By default this is the stored value itself, which identifies it as
+        well as anything else.
+        """
+        return self[name]
+
+    @abc.abstractmethod
+    def compact(self, keep_last=None, keep_since=None, keep_every=None):
+        """Drops old states.  See :py:func:`.history.retained_positions`.
+
+        Returns:
+            dict: The replacement of every rewritten state, with None for the
+            states that were dropped
+        """
+
+    def fold(self):
+        """Commits any saves that the backend has buffered."""
+
+    def migrate_layout(self, layout):
+        """Rewrites the stored items into a different
+        :py:mod:`~.gitdb.layout`.  Backends without layouts ignore this.
+
+        Returns:
+            bool: Whether the layout changed
+        """
+        return False
+
+    def retired_states(self):
+        """Every state that was replaced or dropped by :py:meth:`compact`."""
+        return set()
+
+    def object_stats(self):
+        """Statistics about stored objects.  See
+        :py:func:`.maintenance.object_stats`."""
+        return {'loose_objects': 0, 'loose_size': 0, 'packs': 0}
+
+    def maintain(self, prune_grace):
+        """Tidies up storage.  See :py:func:`.maintenance.maintain`."""
+        stats = self.object_stats()
+        return {'before': stats, 'after': stats, 'packed': 0, 'pruned': 0}
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self.items_list())
+
+
+class _DictState:
+    """One committed state of a :py:class:`DictBackend`.
+
+    ``items`` is never modified once the state has been committed, so it can
+    be shared with views and with later states that don't change anything.
+    """
+
+    __slots__ = ('parent', 'items', 'changes', 'undos', 'message', 'time',
+                 'dropped')
+
+    def __init__(self, parent, items, changes, undos, message):
+        self.parent = parent
+        self.items = items
+        self.changes = changes  # name -> text, or None if deleted
+        self.undos = undos  # name -> number of versions undone
+        self.message = message
+        self.time = time.time()
+        self.dropped = False
+
+    def __repr__(self):
+        return '<DictState {m!r} at {t}>'.format(m=self.message, t=self.time)
+
+
+class DictBackend(StorageBackend):
+    """A storage backend that keeps every state in memory as a dict.
+
+    Every state holds a complete dict of its items, so reading from any state
+    is a single lookup, and committing costs one copy of the dict per
+    transaction.  Items are strings or bytes, which are immutable, so a blob
+    id is simply the item itself.
+    """
+
+    def __init__(self):
+        self._working = None
+        self._touched = {}
+        self._pending_undos = {}
+        self._head = None
+        self._chain = []  # the states leading to the head, oldest first
+        self._retired = set()
+        self.save("Initial State")
+
+    def _items(self):
+        if self._working is not None:
+            return self._working
+        return self._head.items if self._head is not None else {}
+
+    def _writable(self):
+        if self._working is None:
+            self._working = dict(self._items())
+        return self._working
+
+    def __getitem__(self, name):
+        try:
+            return self._items()[name]
+        except KeyError:
+            raise KeyError('{name} not in current tree'.format(name=name))
+
+    def __setitem__(self, name, text):
+        self._writable()[name] = text
+        self._touched[name] = text
+
+    def __delitem__(self, name):
+        working = self._writable()
+        if name not in working:
+            raise KeyError('{name} not in current tree'.format(name=name))
+        del working[name]
+        self._touched[name] = None
+
+    def __contains__(self, name):
+        return name in self._items()
+
+    def items_list(self):
+        return list(self._items())
+
+    def clear(self):
+        for name in self._writable():
+            self._touched[name] = None
+        self._working.clear()
+
+    def read_blob(self, blob_id):
+        return blob_id
+
+    def blob_id(self, name):
+        return self[name]
+
+    def save(self, msg=''):
+        items = self._items()
+        if self._head is None:
+            changes = dict(items)
+        else:
+            old = self._head.items
+            changes = {name: text for name, text in self._touched.items()
+                       if old.get(name) != text}
+            changes.update({name: items.get(name)
+                            for name in self._pending_undos})
+
+        self._head = _DictState(self._head, items, changes,
+                                dict(self._pending_undos), msg)
+        self._chain.append(self._head)
+        self.rollback()
+
+    def rollback(self):
+        self._working = None
+        self._touched.clear()
+        self._pending_undos.clear()
+
+    def save_state(self):
+        return self._head
+
+    def _check_state(self, state):
+        if not isinstance(state, _DictState):
+            raise ValueError("Unknown state {s}".format(s=state))
+        elif state.dropped:
+            raise ValueError("State was removed by history compaction")
+        return state
+
+    def revert_to_state(self, state):
+        self._head = self._check_state(state)
+        chain = []
+        while state is not None:
+            chain.append(state)
+            state = state.parent
+        self._chain = chain[::-1]
+
+    def states(self, count=None):
+        start = 0 if count is None else max(len(self._chain) - count, 0)
+        return self._chain[start:][::-1]
+
+    def resolve_state(self, as_of):
+        if isinstance(as_of, datetime.datetime):
+            times = [state.time for state in self._chain]
+            position = bisect.bisect_right(times, as_of.timestamp())
+            if position == 0:
+                raise ValueError("No state exists at {t}".format(t=as_of))
+            return self._chain[position - 1]
+
+        elif isinstance(as_of, int) and not isinstance(as_of, bool):
+            if as_of < 0:
+                raise ValueError("Cannot step back a negative number of steps")
+            return self._chain[max(len(self._chain) - 1 - as_of, 0)]
+
+        else:
+            return self._check_state(as_of)
+
+    def view(self, state=None):
+        if state is None:
+            state = self._head
+        return DictView(self._check_state(state))
+
+    def revert_steps(self, steps, doc=None):
+        if doc is not None:
+            return self._revert_steps_doc(steps, doc)
+
+        self.revert_to_state(self.resolve_state(steps))
+        return steps
+
+    def _changes(self, name):
+        return [(position, state.changes[name], state.undos.get(name, 0))
+                for position, state in enumerate(self._chain)
+                if name in state.changes]
+
+    def _undoable(self, doc):
+        """The versions of ``doc`` that it can still be reverted to."""
+        pending = self._pending_undos.get(doc, 0)
+        versions = undo_stack(self._changes(doc))
+        return versions[:max(len(versions) - pending, 0)]
+
+    def reverted_version(self, steps, doc):
+        versions = self._undoable(doc)
+        if 0 < steps < len(versions):
+            return versions[-1 - steps][1]
+        return None
+
+    def _revert_steps_doc(self, steps, doc):
+        if steps <= 0:
+            return
+
+        pending = self._pending_undos.get(doc, 0)
+        versions = self._undoable(doc)
+        undo = min(steps, len(versions))
+        if not undo:
+            return 0
+
+        if undo < len(versions):
+            self[doc] = versions[-1 - undo][1]
+        elif doc in self:
+            del self[doc]
+
+        self._pending_undos[doc] = pending + undo
+        return undo
+
+    def history(self, name):
+        for position, text, _ in reversed(self._changes(name)):
+            yield self._chain[position], text
+
+    def diff(self, since, until=None):
+        old = self.view(since)._items
+        new = self.view(until)._items
+        for name in old.keys() | new.keys():
+            old_text, new_text = old.get(name), new.get(name)
+            if old_text != new_text:
+                yield name, old_text, new_text
+
+    def retired_states(self):
+        return set(self._retired)
+
+    def compact(self, keep_last=None, keep_since=None, keep_every=None):
+        if self._working is not None:
+            raise ValueError("Cannot compact history with unsaved changes")
+
+        keep = retained_positions([state.time for state in self._chain],
+                                  keep_last, keep_since, keep_every)
+        if len(keep) == len(self._chain):
+            return {}
+
+        mapping = {}
+        parent = None
+        for position, state in enumerate(self._chain):
+            if position not in keep:
+                state.dropped = True
+                mapping[state] = None
+                continue
+
+            if parent is not None and state.parent is not parent:
+                items = state.items
+                state.changes = {
+                    name: items.get(name)
+                    for name in items.keys() | parent.items.keys()
+                    if items.get(name) != parent.items.get(name)}
+                state.changes.update(
+                    {name: items.get(name) for name in state.undos})
+                state.parent = parent
+            parent = state
+
+        self._retired.update(mapping)
+        self.revert_to_state(self._head)
+        return mapping
+
+
+class DictView:
+    """A read-only view of one state of a :py:class:`DictBackend`."""
+
+    def __init__(self, state):
+        self.state = state
+        self._items = state.items
+
+    def __getitem__(self, name):
+        try:
+            return self._items[name]
+        except KeyError:
+            raise KeyError('{name} not in tree'.format(name=name))
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def get_bytes(self, name):
+        return as_bytes(self[name])
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self.items_list())
+
+    def blob_id(self, name):
+        return self[name]
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def items_list(self):
+        return list(self._items)
@@ -0,0 +1,146 @@
+"""Encodings for stored documents and indexes
+
+Every table encodes the values it stores with one codec, which is picked
+when the table is created, and recorded in the table's metadata, so that the
+table is always read back with the codec it was written with.
+
+* ``json`` uses the standard library's :py:mod:`json` module.  This is the
+  default, and is what every table created before codecs were added uses.
+* ``fastjson`` writes the same JSON text, using the fastest JSON library
+  that is installed (``orjson`` or ``ujson``), and falls back to
+  :py:mod:`json` if neither is.  As the stored format is plain JSON, a
+  table can be read wherever it is opened, whichever libraries are there.
+* ``marshal`` uses the standard library's :py:mod:`marshal` module, pinned
+  to format version 4, which is much faster to decode than JSON.
+* ``msgpack`` uses the MessagePack format, and needs the ``msgpack`` package.
+
+Codecs decode straight from the bytes (or a memoryview of the bytes) that a
+backend reads, without decoding them into a :py:class:`str` first.
+
+The JSON codecs turn tuples into lists and dict keys into strings, as JSON
+has no other way to store them.  The binary codecs keep tuples and non-string
+keys as they are.
+"""
+
+import json
+import marshal
+
+try:  # pragma: no cover
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:  # pragma: no cover
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:  # pragma: no cover
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+__all__ = ['CODECS', 'DEFAULT_CODEC', 'get_codec', 'available_codecs',
+           'JsonCodec', 'FastJsonCodec', 'MarshalCodec', 'MsgpackCodec']
+
+DEFAULT_CODEC = 'json'
+
+
+class JsonCodec:
+    """Encodes values as JSON text, with the :py:mod:`json` module."""
+
+    name = 'json'
+    available = True
+
+    def encode(self, value):
+        return json.dumps(value)
+
+    def decode(self, data):
+        """Decodes a str, bytes, or any other bytes-like object."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class FastJsonCodec(JsonCodec):
+    """Encodes values as JSON text, with the fastest available library."""
+
+    name = 'fastjson'
+
+    if orjson is not None:  # pragma: no cover
+
+        def encode(self, value):
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+        def decode(self, data):
+            return orjson.loads(data)
+
+    elif ujson is not None:  # pragma: no cover
+
+        def encode(self, value):
+            return ujson.dumps(value)
+
+        def decode(self, data):
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            return ujson.loads(data)
+
+
+class MarshalCodec:
+    """Encodes values in the binary :py:mod:`marshal` format."""
+
+    name = 'marshal'
+    available = True
+    # format 4 has been stable since Python 3.4
+    version = 4
+
+    def encode(self, value):
+        return marshal.dumps(value, self.version)
+
+    def decode(self, data):
+        if isinstance(data, str):
+            raise ValueError("Binary codecs cannot decode text")
+        return marshal.loads(data)
+
+
+class MsgpackCodec:
+    """Encodes values in the binary MessagePack format."""
+
+    name = 'msgpack'
+    available = msgpack is not None
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data):
+        if isinstance(data, str):
+            raise ValueError("Binary codecs cannot decode text")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec for codec in
+          (JsonCodec(), FastJsonCodec(), MarshalCodec(), MsgpackCodec())}
+
+
+def get_codec(name):
+    """The codec with the given name.
+
+    Raises:
+        ValueError: if there is no such codec, or it needs a library that
+            isn't installed
+    """
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown codec {name}".format(name=name))
+
+    if not codec.available:
+        m = "The {name} codec needs the {name} package to be installed"
+        raise ValueError(m.format(name=name))
+    return codec
+
+
+def available_codecs():
+    """The names of every codec that can be used here."""
+    return sorted(name for name, codec in CODECS.items() if codec.available)
@@ -0,0 +1,138 @@
+"""Composite indexes over several keys
+
+Searching for documents by the values of two keys (``{'tenant': 'acme',
+'status': 'open'}``) reads the value index of each key, and intersects the
+ids of every document with either value, even when very few documents have
+both.  A composite index, created with :py:meth:`.Table.create_index` and a
+tuple of keys, maps each combination of values straight to the documents
+that have it.
+
+The index is stored as ``composite-<keys>``, where the keys are written as
+json, and is a tree of dicts, one level per key, in the order the keys were
+given.  Each level maps the json of a value (as in a value index) to the
+next level, and the last level maps values to lists of ids.  A search with
+simple terms for the first few keys can then use the index, even if it
+doesn't have terms for every key.
+
+Documents without some of the keys are indexed under the values of the
+leading keys they do have, in a list of ids kept under an empty name (which
+no json value has) at the level where they stop, so that those searches
+still find them.  Documents without the first key aren't indexed at all.
+
+The keys of every composite index of a table are listed in
+``composite-list``, so that writes can keep them up to date.
+"""
+
+import json
+
+
+__all__ = ['LIST_ITEM', 'CompositeIndex']
+
+LIST_ITEM = 'composite-list'
+# where the documents that stop at a level are listed
+_MISSING = ''
+
+
+class CompositeIndex:
+    """The composite index of one combination of keys.
+
+    Parameters:
+        keys (list[str]): The keys, in the order they are indexed in
+        data (dict): A stored index, as returned by :py:meth:`dump`
+    """
+
+    def __init__(self, keys, data=None):
+        self.keys = list(keys)
+        self.tree = {} if data is None else data
+
+    @staticmethod
+    def item_name(keys):
+        """The name of the item the index of these keys is stored in."""
+        return 'composite-' + json.dumps(list(keys))
+
+    @classmethod
+    def build(cls, keys, documents):
+        """Creates the index of every (id, document) pair."""
+        index = cls(keys)
+        for d_id, document in documents:
+            index.add(d_id, document)
+        return index
+
+    def dump(self):
+        return self.tree
+
+    def _path(self, document):
+        """The names leading to the list of ids a document belongs in, or
+        None if it doesn't have the first key."""
+        path = []
+        for key in self.keys:
+            if key not in document:
+                break
+            path.append(json.dumps(document[key]))
+        if path and len(path) < len(self.keys):
+            path.append(_MISSING)
+        return path or None
+
+    def add(self, d_id, document):
+        """Adds a document, under the values of the leading keys it has."""
+        path = self._path(document)
+        if path is None:
+            return
+
+        level = self.tree
+        for name in path[:-1]:
+            level = level.setdefault(name, {})
+        level.setdefault(path[-1], []).append(d_id)
+
+    def remove(self, d_id, document):
+        """Removes a document, and every level left empty without it."""
+        path = self._path(document)
+        if path is None:
+            return
+
+        levels = [self.tree]
+        for name in path[:-1]:
+            levels.append(levels[-1].get(name, {}))
+        ids = levels[-1].get(path[-1], [])
+        if d_id in ids:
+            ids.remove(d_id)
+
+        for level, name in reversed(list(zip(levels, path))):
+            if level.get(name):
+                break
+            level.pop(name, None)
+
+    def lookup(self, values):
+        """The ids of the documents with these values of the first keys.
+
+        Parameters:
+            values (list): A value for each of the first ``len(values)`` keys
+        """
+        level = self.tree
+        for value in values:
+            level = level.get(json.dumps(value))
+            if level is None:
+                return set()
+
+        ids = set()
+        pending = [(level, len(values))]
+        while pending:
+            level, depth = pending.pop()
+            if depth == len(self.keys):
+                ids.update(level)
+                continue
+            for name, child in level.items():
+                if name == _MISSING:
+                    ids.update(child)
+                else:
+                    pending.append((child, depth + 1))
+        return ids
+
+    def covered(self, terms):
+        """How many of the first keys have a term in ``terms``."""
+        count = 0
+        for key in self.keys:
+            if key not in terms:
+                break
+            count += 1
+        return count
@@ -0,0 +1,264 @@
+"""Per-item change history
+
+Finding every version of a single item means looking at every commit on the
+branch.  :py:class:`ChangePoints` does that work once: it diffs each commit in
+a :py:class:`~.sequence.CommitSequence` against its parent, and records, for
+every item name, the positions in the sequence where the item's blob changed.
+When the sequence grows, only the new commits are diffed, and when the
+sequence is truncated (because the branch was reverted) the points recorded
+for the dropped commits are discarded.
+
+Commits can also carry ``OGitM-Undo: <name> <count>`` lines in their message,
+which mark a change to ``name`` as undoing its previous ``count`` versions.
+These are recorded alongside the blob changes, so that the versions an item
+can be reverted to behave as a stack.
+
+Like the commit sequence, the recorded changes are stored next to the
+repository, so that a new process doesn't have to diff every commit again.
+The file holds one line of json per commit: the commit id, and the (name,
+blob id, undo count) changes it made.  Lines are only appended, except when
+the sequence is truncated, and the file can always be rebuilt from the
+repository: if it is missing, if a line can't be read, or if the commits
+don't match the sequence, the changes are recorded again from that point.
+"""
+
+import datetime
+import json
+import os
+
+import pygit2 as pg2
+
+from .layout import layout_of, diff_trees
+
+
+__all__ = ['ChangePoints', 'UNDO_TRAILER', 'undo_trailer', 'undo_stack',
+           'retained_positions']
+
+CHANGES_FILE = 'ogitm-changes'
+
+UNDO_TRAILER = 'OGitM-Undo: '
+
+
+def undo_trailer(name, count):
+    return '{t}{name} {count}'.format(t=UNDO_TRAILER, name=name, count=count)
+
+
+def undo_stack(changes):
+    """The versions left after applying the undos in a list of changes.
+
+    Parameters:
+        changes (list): (position, value, undo count) changes, oldest first
+
+    Returns:
+        list: The (position, value) versions that can be reverted to, oldest
+        first
+    """
+    stack = []
+    for position, value, undo in changes:
+        if undo:
+            del stack[max(len(stack) - undo, 0):]
+        else:
+            stack.append((position, value))
+    return stack
+
+
+def retained_positions(times, keep_last=None, keep_since=None,
+                       keep_every=None):
+    """Picks the states that history compaction should keep.
+
+    Every state in the retention window (the last ``keep_last`` states, and
+    all states committed at or after ``keep_since``) is kept.  Before the
+    window, only the first state, and checkpoints chosen by ``keep_every``,
+    are kept.  That can either be an integer, to keep every nth state, or a
+    :py:class:`~datetime.timedelta`, to keep the last state in each period of
+    that length.
+
+    Parameters:
+        times (list[float]): The commit time of each state, oldest first
+
+    Returns:
+        set[int]: The positions of the states to keep
+    """
+    window = len(times) - 1
+    if keep_last is not None:
+        window = min(window, max(len(times) - keep_last, 0))
+    if keep_since is not None:
+        if isinstance(keep_since, datetime.datetime):
+            keep_since = keep_since.timestamp()
+        for i, time in enumerate(times):
+            if time >= keep_since:
+                window = min(window, i)
+                break
+
+    keep = set(range(window, len(times)))
+    keep.add(0)
+    if isinstance(keep_every, datetime.timedelta):
+        period = keep_every.total_seconds()
+        last_in_period = {}
+        for i in range(window):
+            last_in_period[times[i] // period] = i
+        keep.update(last_in_period.values())
+    elif keep_every:
+        keep.update(range(0, window, keep_every))
+    return keep
+
+
+def _parse_undos(message):
+    undos = {}
+    for line in message.splitlines():
+        if line.startswith(UNDO_TRAILER):
+            name, _, count = line[len(UNDO_TRAILER):].rpartition(' ')
+            undos[name] = int(count)
+    return undos
+
+
+class ChangePoints:
+
+    def __init__(self, repo, path=None):
+        self._repo = repo
+        self._path = path
+        self._processed = []  # commit ids whose changes have been recorded
+        self._offsets = []  # where the line of each commit starts in the file
+        self._points = {}  # name -> [(position, blob id or None, undo)]
+        self._file_size = None
+
+    @classmethod
+    def for_repo(cls, repo):
+        if repo.path is None:
+            return cls(repo)
+        return cls(repo, os.path.join(repo.path, CHANGES_FILE))
+
+    def update(self, sequence):
+        """Records the changes made by any new commits in the sequence."""
+        self._reload_if_changed()
+        common = min(len(self._processed), len(sequence))
+        while common and self._processed[common - 1] != sequence[common - 1]:
+            common -= 1
+
+        if common < len(self._processed):
+            self._forget_from(common)
+
+        lines = []
+        try:
+            for position in range(common, len(sequence)):
+                lines.append(self._record(position, sequence))
+        finally:
+            self._append(lines)
+
+    def changes(self, name):
+        """All (position, blob id, undo count) changes made to ``name``."""
+        return list(self._points.get(name, ()))
+
+    def versions(self, name):
+        """The (position, blob id) versions of ``name`` that can be reverted
+        to, oldest first, with any undone versions removed."""
+        return undo_stack(self._points.get(name, ()))
+
+    def _forget_from(self, position):
+        if self._path is not None:
+            self._truncate(self._offsets[position])
+        del self._processed[position:]
+        del self._offsets[position:]
+        for name in list(self._points):
+            points = [p for p in self._points[name] if p[0] < position]
+            if points:
+                self._points[name] = points
+            else:
+                del self._points[name]
+
+    def _add(self, commit_id, changes):
+        position = len(self._processed)
+        for name, blob_id, undo in changes:
+            point = (position, blob_id, undo)
+            self._points.setdefault(name, []).append(point)
+        self._processed.append(commit_id)
+
+    def _record(self, position, sequence):
+        """Records the changes of the commit at ``position``, returning the
+        line they are stored as."""
+        commit = self._repo[sequence[position]]
+        changed = {}
+
+        tree = commit.tree
+        layout = layout_of(tree)
+        if position == 0:
+            changed.update(layout.entries(tree))
+        else:
+            parent = self._repo[sequence[position - 1]]
+            for name, _, blob_id in diff_trees(parent.tree, tree):
+                changed[name] = blob_id
+
+        undos = _parse_undos(commit.message)
+        for name in undos:
+            if name not in changed:  # reverted to an identical blob
+                if layout.contains(tree, name):
+                    changed[name] = layout.entry(tree, name).id
+                else:
+                    changed[name] = None
+
+        changes = [(name, blob_id, undos.get(name, 0))
+                   for name, blob_id in changed.items()]
+        self._add(commit.id, changes)
+
+        stored = [[name, None if blob_id is None else str(blob_id), undo]
+                  for name, blob_id, undo in changes]
+        return json.dumps([str(commit.id), stored]) + '\n'
+
+    def _reload_if_changed(self):
+        if self._path is None:
+            return
+
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            size = 0
+
+        if size == self._file_size:
+            return
+
+        self._processed = []
+        self._offsets = []
+        self._points = {}
+        offset = 0
+        if size:
+            with open(self._path, 'rb') as file:
+                data = file.read()
+            for line in data.splitlines(keepends=True):
+                try:
+                    commit_id, changes = _parse_line(line)
+                except (ValueError, TypeError):
+                    break  # partly written, or damaged
+                self._offsets.append(offset)
+                self._add(commit_id, changes)
+                offset += len(line)
+
+        self._file_size = size
+        if offset != size:
+            self._truncate(offset)
+
+    def _truncate(self, size):
+        self._file_size = size
+        with open(self._path, 'ab') as file:
+            file.truncate(size)
+
+    def _append(self, lines):
+        if self._path is None or not lines:
+            return
+
+        offset = self._file_size or 0
+        for line in lines:
+            self._offsets.append(offset)
+            offset += len(line.encode('utf-8'))
+        with open(self._path, 'ab') as file:
+            file.write(''.join(lines).encode('utf-8'))
+        self._file_size = offset
+
+
+def _parse_line(line):
+    if not line.endswith(b'\n'):
+        raise ValueError("Incomplete line")
+    commit_id, stored = json.loads(line.decode('utf-8'))
+    changes = [(name, None if blob_id is None else pg2.Oid(hex=blob_id),
+                int(undo))
+               for name, blob_id, undo in stored]
+    return pg2.Oid(hex=commit_id), changes
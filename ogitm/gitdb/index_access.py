@@ -0,0 +1,239 @@
+"""Index access for search functions
+
+Search functions used to be given the whole value index of a key, as a dict
+of json-encoded values to document ids, and the set of every document id,
+so the only thing they could do was test every value.  A search function
+that declares what it needs (see :py:meth:`.SearchFunction.add`) is given an
+:py:class:`IndexAccessor` instead, which can answer these questions without
+decoding every value:
+
+``lookup``
+    the documents with exactly one value (:py:meth:`~IndexAccessor.lookup`),
+    or with any value at all (:py:meth:`~IndexAccessor.present`)
+``prefix``
+    the documents with a string value that starts with a prefix
+    (:py:meth:`~IndexAccessor.prefix`)
+``range``
+    the documents with a number or string value between two bounds
+    (:py:meth:`~IndexAccessor.range`)
+``scan``
+    every (value, ids) pair, one by one (:py:meth:`~IndexAccessor.values`)
+
+These are also the costs that the query planner uses to order the terms of
+a search, from cheapest to most expensive, so that searches can stop as
+soon as no documents are left.
+
+Prefix and range searches use the numbers and strings of the index in
+sorted order.  These are sorted once for each version of an index, and kept
+in the table's blob cache.
+"""
+
+import bisect
+import json
+import math
+import numbers
+
+from .text_index import TextIndex
+from .predicates import PredicateSets
+
+
+__all__ = ['CAPABILITIES', 'IndexAccessor', 'SortedValues']
+
+# in order of cost, cheapest first
+CAPABILITIES = ('lookup', 'prefix', 'range', 'scan')
+
+
+def _group(value):
+    """Which sorted list a value belongs in, if it can be sorted."""
+    if isinstance(value, str):
+        return 'strings'
+    elif isinstance(value, numbers.Real) and not (
+            isinstance(value, float) and math.isnan(value)):
+        return 'numbers'
+    return None
+
+
+class SortedValues:
+    """The numbers and strings in a value index, in sorted order.
+
+    Numbers (including booleans, which compare as 0 and 1) and strings can be
+    ordered against other values of the same kind, and against nothing else,
+    so a range search only ever needs to look at one of the two lists.
+    Every other value is kept in ``others``.
+    """
+
+    def __init__(self, index):
+        groups = {'numbers': [], 'strings': []}
+        self.others = []
+        for value_key in index:
+            value = json.loads(value_key)
+            group = _group(value)
+            if group is None:
+                self.others.append((value, value_key))
+            else:
+                groups[group].append((value, value_key))
+
+        self.values = {}
+        self.keys = {}
+        for group, pairs in groups.items():
+            pairs.sort(key=lambda pair: pair[0])
+            self.values[group] = [value for value, _ in pairs]
+            self.keys[group] = [value_key for _, value_key in pairs]
+
+    def between(self, group, low=None, high=None, low_inclusive=True,
+                high_inclusive=True):
+        """The value index keys of the values of a group between two bounds.
+        """
+        values = self.values[group]
+        start, end = 0, len(values)
+        if low is not None:
+            if low_inclusive:
+                start = bisect.bisect_left(values, low)
+            else:
+                start = bisect.bisect_right(values, low)
+        if high is not None:
+            if high_inclusive:
+                end = bisect.bisect_right(values, high)
+            else:
+                end = bisect.bisect_left(values, high)
+        return self.keys[group][start:end]
+
+
+class IndexAccessor:
+    """Read access to the indexes of one key.
+
+    Parameters:
+        key (str): The key
+        index (dict): The value index of the key
+        reader: The table or snapshot the key belongs to.  Without one, the
+            key has no text index or predicate sets, and the only documents
+            known of are the ones in the index.
+    """
+
+    def __init__(self, key, index, reader=None):
+        self.key = key
+        self.index = index
+        self._reader = reader
+        self._sorted = None
+
+    def ids(self, value_keys):
+        """The documents with any of the given value index keys."""
+        ids = set()
+        for value_key in value_keys:
+            ids.update(self.index.get(value_key, ()))
+        return ids
+
+    def lookup(self, value):
+        """The documents where the key has exactly this value (as json)."""
+        return set(self.index.get(json.dumps(value), ()))
+
+    def present(self):
+        """The documents that have the key."""
+        return self.ids(self.index)
+
+    def all_ids(self):
+        """Every document in the table."""
+        if self._reader is None:
+            return self.present()
+        return self._reader._all_ids()
+
+    def values(self):
+        """Every (value, ids) pair in the index, decoding each value."""
+        for value_key, ids in self.index.items():
+            yield json.loads(value_key), ids
+
+    def sorted_values(self):
+        """The :py:class:`SortedValues` of the index."""
+        if self._sorted is None:
+            if self._reader is None:
+                self._sorted = SortedValues(self.index)
+            else:
+                self._sorted = self._reader._sorted_values(self.key,
+                                                           self.index)
+        return self._sorted
+
+    def range(self, low=None, high=None, low_inclusive=True,
+              high_inclusive=True):
+        """The documents with a value between two bounds.
+
+        Either bound can be None, for no bound.  Values are compared the way
+        Python compares them, so numbers only fall between numbers, and
+        strings between strings.
+
+        Returns:
+            set: The matching ids, or None if the bounds can't be used for a
+            range (if neither is given, if they aren't numbers or strings, or
+            if they are different kinds of value)
+        """
+        groups = {_group(bound) for bound in (low, high) if bound is not None}
+        if len(groups) != 1 or None in groups:
+            return None
+
+        value_keys = self.sorted_values().between(
+            groups.pop(), low, high, low_inclusive, high_inclusive)
+        return self.ids(value_keys)
+
+    def prefix(self, prefix):
+        """The documents with a string value that starts with ``prefix``."""
+        return self.ids(self.prefix_keys(prefix))
+
+    def prefix_keys(self, prefix):
+        """The value index keys of the strings that start with ``prefix``.
+        """
+        keys = self.text_keys('startswith', prefix)
+        if keys is not None:
+            return keys
+
+        strings = self.sorted_values().values['strings']
+        keys = self.sorted_values().keys['strings']
+        position = bisect.bisect_left(strings, prefix)
+        end = position
+        while end < len(strings) and strings[end].startswith(prefix):
+            end += 1
+        return keys[position:end]
+
+    def string_keys(self):
+        """The value index keys of every string value."""
+        # only the json of a string starts with a quote
+        return [value_key for value_key in self.index
+                if value_key.startswith('"')]
+
+    def _stored(self, kind):
+        if self._reader is None:
+            return None
+        return self._reader._index_item(kind, self.key)
+
+    def text_keys(self, op, arg):
+        """The value index keys that match a search of the key's text index.
+
+        Returns:
+            list: The keys, or None if the key has no text index, or it can't
+            answer this search
+        """
+        text = self._stored('text')
+        if text is None:
+            return None
+        return TextIndex(text).matching_keys(op, arg)
+
+    def text_search(self, op, arg):
+        """Searches the key's text index (see :py:mod:`.text_index`).
+
+        Returns:
+            set: The matching ids, or None if the key has no text index, or
+            it can't answer this search
+        """
+        keys = self.text_keys(op, arg)
+        if keys is None:
+            return None
+        return self.ids(keys)
+
+    def predicate_search(self, op, arg):
+        """Searches the key's predicate sets (see :py:mod:`.predicates`).
+
+        Returns:
+            set: The matching ids, or None if the key has no predicate sets
+        """
+        props = self._stored('props')
+        if props is None:
+            return None
+        return PredicateSets(props).search(op, arg, self.index)
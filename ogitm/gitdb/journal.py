@@ -0,0 +1,438 @@
+"""A write-ahead journal in front of a storage backend
+
+Every save on a :py:class:`~.treewrapper.TreeWrapper` writes a tree holding
+every item in the table, and a commit, so the rate of saves is limited by the
+cost of building git objects.  A :py:class:`JournaledBackend` saves by
+appending one small record to a journal file instead, and flushing it to disk
+with ``fsync``.  The changes in every journaled save are also kept in a
+memtable, which serves reads until the journal is folded: all of the saves in
+it are applied to the wrapped backend as a single commit, and the journal is
+emptied.
+
+Folding happens once ``fold_every`` saves have been journaled, whenever a
+state marker or anything else that depends on the commit history is needed,
+or on a background :py:class:`JournalThread`.  As a result, each commit can
+hold the changes of many saves, and state markers refer to those batches.
+
+Saves and folds can come from different threads: a fold takes the memtable
+and the saves in it out of the way first, so that saves made while it writes
+the commit go into a new memtable, and are kept in the journal when the
+folded records are dropped from it.  Until the commit is made, reads still
+see the folded changes.
+
+When a journaled backend is opened, any records left in its journal (for
+example, by a process that crashed before folding) are replayed and folded
+straight away.  Records are only ever sets, deletes and clears, so replaying
+a record that was already folded is harmless, and a torn record at the end of
+the file (from a crash part way through a write) is ignored.  Items that
+aren't valid UTF-8 (written by binary codecs) are journaled as base64.
+"""
+
+import base64
+import json
+import os
+import threading
+
+from .backends import StorageBackend, as_bytes
+from .maintenance import MaintenanceThread
+
+
+__all__ = ['JOURNAL_FILE', 'JournaledBackend', 'JournalThread']
+
+JOURNAL_FILE = 'ogitm-journal'
+
+
+class JournaledBackend(StorageBackend):
+    """Journals the saves made to another storage backend.
+
+    Parameters:
+        backend (StorageBackend): The backend to fold saves into
+        path (str): The path of the journal file
+        fold_every (int): The number of journaled saves that triggers a fold
+    """
+
+    def __init__(self, backend, path, fold_every=1000):
+        self._backend = backend
+        self._path = path
+        self.fold_every = fold_every
+
+        self._memtable = {}  # name -> text or bytes, or None if deleted
+        self._memtable_cleared = False
+        self._messages = []
+        # the memtable being folded, which reads see until it is committed
+        self._folding = {}
+        self._folding_cleared = False
+        self._working = {}
+        self._working_cleared = False
+        # set while the wrapped backend has unsaved changes of its own, when
+        # saves have to go to it directly
+        self._direct = False
+        self._journal_size = 0  # bytes of records in the journal file
+
+        # _lock guards the layers above and the journal file, and _fold_lock
+        # is held by anything that writes to the wrapped backend
+        self._lock = threading.RLock()
+        self._fold_lock = threading.RLock()
+
+        self._replay()
+        self.fold()
+
+    @classmethod
+    def for_backend(cls, backend, fold_every=1000):
+        """Journals a backend, keeping the journal beside its repository.
+
+        Raises:
+            ValueError: if the backend isn't stored on disk
+        """
+        if backend.repo is None or backend.repo.path is None:
+            raise ValueError("Only backends on disk can be journaled")
+        path = os.path.join(backend.repo.path, JOURNAL_FILE)
+        return cls(backend, path, fold_every)
+
+    @property
+    def backend(self):
+        """The backend that saves are folded into."""
+        return self._backend
+
+    @property
+    def repo(self):
+        return self._backend.repo
+
+    @property
+    def pending(self):
+        """The number of saves that haven't been folded yet."""
+        return len(self._messages)
+
+    def _replay(self):
+        try:
+            with open(self._path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return
+
+        self._journal_size = len(data)
+        lines = data.split(b'\n')
+
+        # the last line is either empty, or a record that was never finished
+        for line in lines[:-1]:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+
+            items = record['items']
+            for name, data in record.get('binary', {}).items():
+                items[name] = base64.b64decode(data)
+            self._apply(record['msg'], record['clear'], items)
+
+    def _apply(self, msg, clear, items):
+        if clear:
+            self._memtable = {}
+            self._memtable_cleared = True
+        self._memtable.update(items)
+        self._messages.append(msg)
+
+    def _layers(self):
+        """Every layer of unfolded changes, most recent first."""
+        return [(self._working, self._working_cleared),
+                (self._memtable, self._memtable_cleared),
+                (self._folding, self._folding_cleared)]
+
+    def _lookup(self, name, read_bytes=False):
+        with self._lock:
+            for layer, cleared in self._layers():
+                if name in layer:
+                    return layer[name]
+                elif cleared:
+                    return None
+
+        if not read_bytes:
+            return self._backend.get(name)
+        try:
+            return self._backend.get_bytes(name)
+        except KeyError:
+            return None
+
+    def __getitem__(self, name):
+        text = self._lookup(name)
+        if text is None:
+            raise KeyError('{name} not in current tree'.format(name=name))
+        return text
+
+    def get_bytes(self, name):
+        data = self._lookup(name, read_bytes=True)
+        if data is None:
+            raise KeyError('{name} not in current tree'.format(name=name))
+        return as_bytes(data)
+
+    def __setitem__(self, name, text):
+        with self._lock:
+            self._working[name] = text
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self:
+                raise KeyError('{name} not in current tree'.format(name=name))
+            self._working[name] = None
+
+    def __contains__(self, name):
+        with self._lock:
+            for layer, cleared in self._layers():
+                if name in layer:
+                    return layer[name] is not None
+                elif cleared:
+                    return False
+            return name in self._backend
+
+    def items_list(self):
+        with self._lock:
+            layers = self._layers()[::-1]
+            names = set()
+            if not any(cleared for _, cleared in layers):
+                names.update(self._backend.items_list())
+            for layer, cleared in layers:
+                if cleared:
+                    names.clear()
+                for name, text in layer.items():
+                    if text is None:
+                        names.discard(name)
+                    else:
+                        names.add(name)
+            return list(names)
+
+    def clear(self):
+        with self._lock:
+            self._working = {}
+            self._working_cleared = True
+
+    def blob_id(self, name):
+        with self._lock:
+            for layer, cleared in self._layers():
+                if name in layer:
+                    if layer[name] is None:
+                        break
+                    # like a dict backend, items that haven't been committed
+                    # are identified by their value
+                    return layer[name]
+                elif cleared:
+                    break
+            else:
+                return self._backend.blob_id(name)
+        raise KeyError('{name} not in current tree'.format(name=name))
+
+    def read_blob(self, blob_id):
+        return self._backend.read_blob(blob_id)
+
+    def read_blob_bytes(self, blob_id):
+        return self._backend.read_blob_bytes(blob_id)
+
+    def save(self, msg=''):
+        # only set and cleared by the thread making changes, and the locks
+        # are always taken in this order
+        if self._direct:
+            with self._fold_lock, self._lock:
+                self._push_working()
+                self._backend.save(msg)
+                self._direct = False
+            return
+
+        with self._lock:
+            self._journal_save(msg)
+            fold = len(self._messages) >= self.fold_every
+        if fold:
+            self.fold()
+
+    def _journal_save(self, msg):
+        record = {'msg': msg, 'clear': self._working_cleared,
+                  'items': {}, 'binary': {}}
+        for name, data in self._working.items():
+            if isinstance(data, bytes):
+                try:
+                    data = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    data = base64.b64encode(data).decode('ascii')
+                    record['binary'][name] = data
+                    continue
+            record['items'][name] = data
+
+        line = json.dumps(record).encode('utf-8') + b'\n'
+        with open(self._path, 'ab') as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        self._journal_size += len(line)
+
+        self._apply(msg, self._working_cleared, self._working)
+        self._working = {}
+        self._working_cleared = False
+
+    def _write_through(self, items, cleared):
+        if cleared:
+            self._backend.clear()
+        for name, text in items.items():
+            if text is not None:
+                self._backend[name] = text
+            elif name in self._backend:
+                del self._backend[name]
+
+    def _push_working(self):
+        with self._fold_lock, self._lock:
+            self._write_through(self._working, self._working_cleared)
+            self._working = {}
+            self._working_cleared = False
+
+    def fold(self):
+        """Commits every journaled save to the wrapped backend at once."""
+        with self._fold_lock:
+            with self._lock:
+                # the wrapped backend's own unsaved changes aren't folded
+                if not self._messages or self._direct:
+                    return
+
+                self._folding = self._memtable
+                self._folding_cleared = self._memtable_cleared
+                messages = self._messages
+                folded_size = self._journal_size
+                self._memtable = {}
+                self._memtable_cleared = False
+                self._messages = []
+
+            try:
+                self._write_through(self._folding, self._folding_cleared)
+                msg = 'Fold {n} journaled saves'.format(n=len(messages))
+                named = [m for m in messages if m]
+                if named:
+                    msg += '\n\n' + '\n'.join(named)
+                self._backend.save(msg)
+            except BaseException:
+                with self._lock:
+                    self._unfold(messages)
+                raise
+
+            with self._lock:
+                self._folding = {}
+                self._folding_cleared = False
+                self._drop_journal(folded_size)
+
+    def _unfold(self, messages):
+        """Puts the changes of a fold that failed back in the memtable."""
+        self._backend.rollback()
+        if not self._memtable_cleared:
+            folded = dict(self._folding)
+            folded.update(self._memtable)
+            self._memtable = folded
+            self._memtable_cleared = self._folding_cleared
+        self._messages = messages + self._messages
+        self._folding = {}
+        self._folding_cleared = False
+
+    def _drop_journal(self, size):
+        """Removes the first ``size`` bytes of records from the journal,
+        keeping any saved since."""
+        remaining = b''
+        if self._journal_size > size:
+            with open(self._path, 'rb') as file:
+                file.seek(size)
+                remaining = file.read()
+
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(remaining)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._path)
+        self._journal_size = len(remaining)
+
+    def rollback(self):
+        if self._direct:
+            with self._fold_lock, self._lock:
+                self._backend.rollback()
+                self._direct = False
+
+        with self._lock:
+            self._working = {}
+            self._working_cleared = False
+
+    def save_state(self):
+        self.fold()
+        return self._backend.save_state()
+
+    def revert_to_state(self, state):
+        with self._fold_lock:
+            self.fold()
+            self._backend.revert_to_state(state)
+
+    def states(self, count=None):
+        self.fold()
+        return self._backend.states(count)
+
+    def resolve_state(self, as_of):
+        self.fold()
+        return self._backend.resolve_state(as_of)
+
+    def view(self, state=None):
+        self.fold()
+        return self._backend.view(state)
+
+    def revert_steps(self, steps, doc=None):
+        with self._fold_lock:
+            self.fold()
+            if doc is None:
+                return self._backend.revert_steps(steps)
+
+            # the wrapped backend stages per-item reverts itself, so
+            # everything up to the next save has to go to it directly
+            with self._lock:
+                self._push_working()
+                self._direct = True
+                return self._backend.revert_steps(steps, doc)
+
+    def reverted_version(self, steps, doc):
+        self.fold()
+        return self._backend.reverted_version(steps, doc)
+
+    def history(self, name):
+        self.fold()
+        return self._backend.history(name)
+
+    def diff(self, since, until=None):
+        self.fold()
+        return self._backend.diff(since, until)
+
+    def compact(self, keep_last=None, keep_since=None, keep_every=None):
+        if self._working or self._working_cleared or self._direct:
+            raise ValueError("Cannot compact history with unsaved changes")
+        with self._fold_lock:
+            self.fold()
+            return self._backend.compact(keep_last, keep_since, keep_every)
+
+    def migrate_layout(self, layout):
+        if self._working or self._working_cleared or self._direct:
+            raise ValueError("Cannot migrate a tree with unsaved changes")
+        with self._fold_lock:
+            self.fold()
+            return self._backend.migrate_layout(layout)
+
+    def retired_states(self):
+        return self._backend.retired_states()
+
+    def object_stats(self):
+        return self._backend.object_stats()
+
+    def maintain(self, prune_grace):
+        with self._fold_lock:
+            self.fold()
+            return self._backend.maintain(prune_grace)
+
+
+class JournalThread(MaintenanceThread):
+    """A daemon thread that folds a table's journals every ``interval``
+    seconds, by calling :py:meth:`.Table.fold_journal`."""
+
+    def __init__(self, table, interval=1.0):
+        super().__init__(table, interval)
+        self.name = 'ogitm-journal-' + table.name
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.table.fold_journal()
@@ -7,17 +7,63 @@ implements the dictionary interface).  All methods are delegated to the
 wrapped mapping once json-conversion has been performed, so if the wrapped
 mapping doesn't have certain methods, this class will raise an error if those
 methods are called on it.
+
+If the wrapped mapping can tell which blob an item is stored in (by providing
+a ``blob_id`` method), a :py:class:`BlobCache` can be passed in to keep the
+decoded values of blobs that have already been read.  Blobs never change once
+they are written, so cached values never need to be invalidated.
+
+Values are json-encoded by default, but any of the codecs in
+:py:mod:`~.gitdb.codecs` can be used instead.  If the wrapped mapping can
+read items as bytes (by providing ``get_bytes`` and ``read_blob_bytes``
+methods), values are decoded straight from those bytes.
 """
 
 
-import json
+from collections import OrderedDict
 from ..compat import MutableMapping
+from .codecs import get_codec, DEFAULT_CODEC
+
+
+class BlobCache:
+    """A least-recently-used cache of decoded blobs, keyed by blob id."""
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._store = OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, blob_id):
+        return blob_id in self._store
+
+    def get(self, blob_id, default=None):
+        try:
+            value = self._store.pop(blob_id)
+        except KeyError:
+            return default
+
+        self._store[blob_id] = value
+        return value
+
+    def put(self, blob_id, value):
+        self._store.pop(blob_id, None)
+        self._store[blob_id] = value
+        while len(self._store) > self.max_size:
+            self._store.popitem(last=False)
+
+    def clear(self):
+        self._store.clear()
 
 
 class JsonDictWrapper(MutableMapping):
 
-    def __init__(self, d):
+    def __init__(self, d, cache=None, codec=DEFAULT_CODEC):
         self._d = d
+        self._cache = cache
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self._read = getattr(d, 'get_bytes', d.__getitem__)
 
     def unwrap(self):
         return self._d
@@ -26,10 +72,39 @@ class JsonDictWrapper(MutableMapping):
         return len(self._d)
 
     def __getitem__(self, item):
-        return json.loads(self._d[item])
+        if self._cache is None:
+            return self.codec.decode(self._read(item))
+
+        blob_id = self._d.blob_id(item)
+        value = self._cache.get(blob_id, self)
+        if value is self:  # sentinel, as None is a valid json value
+            value = self.codec.decode(self._read(item))
+            self._cache.put(blob_id, value)
+        return value
+
+    def _read_blob(self, blob_id):
+        if hasattr(self._d, 'read_blob_bytes'):
+            return self._d.read_blob_bytes(blob_id)
+        return self._d.read_blob(blob_id)
+
+    def load_blob(self, blob_id, cache=None):
+        """Decodes a blob by id, using the wrapped mapping's ``read_blob``."""
+        cache = self._cache if cache is None else cache
+        if cache is None:
+            return self.codec.decode(self._read_blob(blob_id))
+
+        value = cache.get(blob_id, self)
+        if value is self:
+            value = self.codec.decode(self._read_blob(blob_id))
+            cache.put(blob_id, value)
+        return value
+
+    def __contains__(self, item):
+        # asks the wrapped mapping, rather than reading and decoding the item
+        return item in self._d
 
     def __setitem__(self, item, val):
-        self._d[item] = json.dumps(val)
+        self._d[item] = self.codec.encode(val)
 
     def __delitem__(self, item):
         del self._d[item]
@@ -0,0 +1,242 @@
+"""How items are arranged in git trees
+
+The ``flat`` layout keeps every item in the root tree, so every save writes a
+new root tree holding an entry for every item in the table: a one item change
+to a table of a million items rewrites a tree of a million entries.
+
+The ``fanout`` layout spreads items over two levels of subtrees, picked by
+the first four hex digits of the SHA-1 of the item's name, so that ``doc-1``
+is stored at ``fe/5d/doc-1``.  A save then only rewrites the trees on the
+paths of the items that changed, each of which stays small.
+
+A tree in the fanout layout carries a :py:data:`LAYOUT_MARKER` entry in its
+root, so the layout of any commit can be told from its tree alone, and old
+states can still be read after a table has been migrated to a new layout.
+Item names never contain ``/``, so layouts only differ in how names map to
+paths.
+"""
+
+import hashlib
+
+import pygit2 as pg2
+
+
+__all__ = ['LAYOUT_MARKER', 'LAYOUTS', 'FlatLayout', 'FanoutLayout',
+           'layout_of', 'diff_trees']
+
+LAYOUT_MARKER = '.ogitm-layout'
+
+
+class FlatLayout:
+    """Every item is an entry of the root tree."""
+
+    name = 'flat'
+
+    def entry(self, tree, name):
+        """The tree entry of an item, raising KeyError if it is missing."""
+        return tree[name]
+
+    def contains(self, tree, name):
+        return name in tree
+
+    def entries(self, tree):
+        """Every (name, blob id) item in a tree."""
+        return [(entry.name, entry.id) for entry in tree]
+
+    def builder(self, repo, tree=None):
+        """A :py:class:`FlatBuilder` starting from the given tree."""
+        return FlatBuilder(repo, tree)
+
+
+class FanoutLayout(FlatLayout):
+    """Every item is stored two subtrees down from the root tree."""
+
+    name = 'fanout'
+
+    @staticmethod
+    def directories(name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return digest[:2], digest[2:4]
+
+    def path(self, name):
+        return '/'.join(self.directories(name) + (name,))
+
+    def entry(self, tree, name):
+        return tree[self.path(name)]
+
+    def contains(self, tree, name):
+        return self.path(name) in tree
+
+    def entries(self, tree):
+        found = []
+        for top in tree:
+            if top.filemode != pg2.GIT_FILEMODE_TREE:
+                continue
+            for middle in tree[top.name].peel(pg2.Tree):
+                for entry in tree[top.name + '/' + middle.name].peel(pg2.Tree):
+                    found.append((entry.name, entry.id))
+        return found
+
+    def builder(self, repo, tree=None):
+        return FanoutBuilder(repo, tree)
+
+
+LAYOUTS = {layout.name: layout for layout in (FlatLayout(), FanoutLayout())}
+
+
+def layout_of(tree):
+    """The layout that a tree (which may be None) is stored in."""
+    if tree is not None and LAYOUT_MARKER in tree:
+        return LAYOUTS['fanout']
+    return LAYOUTS['flat']
+
+
+def diff_trees(old_tree, new_tree):
+    """Every (name, old blob id, new blob id) change between two trees.
+
+    Added items have an old blob id of None, and deleted items have a new
+    blob id of None.  The trees don't need to share a layout.
+    """
+    # an item that moved between layouts is deleted at one path, and added
+    # at another, so deletions are gathered before additions
+    deltas = list(old_tree.diff_to_tree(new_tree).deltas)
+    changes = {}
+    for delta in deltas:
+        if delta.status != pg2.GIT_DELTA_ADDED:
+            name = delta.old_file.path.rpartition('/')[2]
+            changes[name] = [delta.old_file.id, None]
+    for delta in deltas:
+        if delta.status != pg2.GIT_DELTA_DELETED:
+            name = delta.new_file.path.rpartition('/')[2]
+            changes.setdefault(name, [None, None])[1] = delta.new_file.id
+
+    for name, (old_id, new_id) in sorted(changes.items()):
+        if name != LAYOUT_MARKER and old_id != new_id:
+            yield name, old_id, new_id
+
+
+class FlatBuilder:
+    """A working copy of a flat tree.
+
+    This wraps a :py:class:`pygit2.TreeBuilder`, and also keeps track of the
+    names of the items in it, which a tree builder can't list.
+    """
+
+    def __init__(self, repo, tree=None):
+        if tree is None:
+            self._builder = repo.TreeBuilder()
+            self._names = set()
+        else:
+            self._builder = repo.TreeBuilder(tree)
+            self._names = {entry.name for entry in tree}
+
+    def insert(self, name, blob_id, filemode):
+        self._builder.insert(name, blob_id, filemode)
+        self._names.add(name)
+
+    def remove(self, name):
+        self._builder.remove(name)
+        self._names.discard(name)
+
+    def get(self, name):
+        return self._builder.get(name)
+
+    def clear(self):
+        self._builder.clear()
+        self._names.clear()
+
+    def names(self):
+        return list(self._names)
+
+    def write(self):
+        return self._builder.write()
+
+
+class FanoutBuilder:
+    """A working copy of a fanout tree.
+
+    Only the leaf trees that items are written to are copied into tree
+    builders, and only those, and the trees above them, are rewritten by
+    :py:meth:`write`.
+    """
+
+    def __init__(self, repo, tree=None):
+        self._repo = repo
+        self._tree = tree
+        self._leaves = {}  # (top, middle) -> (TreeBuilder, set of names)
+
+    def _subtree(self, path):
+        if self._tree is None or path not in self._tree:
+            return None
+        return self._tree[path].peel(pg2.Tree)
+
+    def _leaf(self, name):
+        dirs = FanoutLayout.directories(name)
+        if dirs not in self._leaves:
+            tree = self._subtree('/'.join(dirs))
+            if tree is None:
+                self._leaves[dirs] = (self._repo.TreeBuilder(), set())
+            else:
+                names = {entry.name for entry in tree}
+                self._leaves[dirs] = (self._repo.TreeBuilder(tree), names)
+        return self._leaves[dirs]
+
+    def insert(self, name, blob_id, filemode):
+        builder, names = self._leaf(name)
+        builder.insert(name, blob_id, filemode)
+        names.add(name)
+
+    def remove(self, name):
+        builder, names = self._leaf(name)
+        builder.remove(name)
+        names.discard(name)
+
+    def get(self, name):
+        dirs = FanoutLayout.directories(name)
+        if dirs in self._leaves:
+            return self._leaves[dirs][0].get(name)
+
+        path = '/'.join(dirs + (name,))
+        if self._tree is None or path not in self._tree:
+            return None
+        return self._tree[path]
+
+    def clear(self):
+        self._tree = None
+        self._leaves.clear()
+
+    def names(self):
+        found = []
+        if self._tree is not None:
+            for name, _ in LAYOUTS['fanout'].entries(self._tree):
+                if FanoutLayout.directories(name) not in self._leaves:
+                    found.append(name)
+        for _, names in self._leaves.values():
+            found.extend(names)
+        return found
+
+    def _rewrite(self, base, changes):
+        builder = self._repo.TreeBuilder(base) if base is not None \
+            else self._repo.TreeBuilder()
+        for name, tree_id in changes.items():
+            if tree_id is not None:
+                builder.insert(name, tree_id, pg2.GIT_FILEMODE_TREE)
+            elif builder.get(name) is not None:
+                builder.remove(name)
+        return builder
+
+    def write(self):
+        middles = {}
+        for (top, middle), (builder, names) in self._leaves.items():
+            leaf_id = builder.write() if names else None
+            middles.setdefault(top, {})[middle] = leaf_id
+
+        tops = {}
+        for top, changes in middles.items():
+            builder = self._rewrite(self._subtree(top), changes)
+            tops[top] = builder.write() if len(builder) else None
+
+        root = self._rewrite(self._tree, tops)
+        marker = self._repo.create_blob(b'fanout\n')
+        root.insert(LAYOUT_MARKER, marker, pg2.GIT_FILEMODE_BLOB)
+        return root.write()
@@ -0,0 +1,197 @@
+"""Object store maintenance
+
+Every blob, tree and commit written by :py:class:`~.treewrapper.TreeWrapper`
+is stored by libgit2 as a loose object: one small compressed file each.  Over
+time, this leaves a repository holding huge numbers of tiny files.
+
+:py:func:`maintain` packs all reachable objects into a single packfile (with
+its index), removes the loose copies and any older packs, and prunes loose
+objects that no commit refers to, such as the blobs written during a
+transaction that was rolled back.  Every commit is treated as reachable, so
+saved states that the branch has been reverted past keep working, except for
+the commits retired by history compaction.  Loose
+objects younger than the prune grace period are never pruned, as they may
+belong to a transaction that hasn't been committed yet.
+
+:py:class:`MaintenanceThread` runs maintenance on a table in the background
+whenever its loose objects pass the table's thresholds.
+"""
+
+import os
+import time
+import threading
+
+import pygit2 as pg2
+
+from ..compat import GIT_OBJECT_COMMIT
+
+
+__all__ = ['DEFAULT_PRUNE_GRACE', 'loose_objects', 'object_stats', 'maintain',
+           'MaintenanceThread']
+
+DEFAULT_PRUNE_GRACE = 60 * 60  # an hour, in seconds
+
+
+def _objects_dir(repo):
+    if repo.path is None:
+        return None
+    return os.path.join(repo.path, 'objects')
+
+
+def loose_objects(repo):
+    """Finds every loose object in a repository.
+
+    Returns:
+        dict[Oid: str]: The path of each loose object, by object id
+    """
+    objects_dir = _objects_dir(repo)
+    found = {}
+    if objects_dir is None or not os.path.isdir(objects_dir):
+        return found
+
+    for prefix in os.listdir(objects_dir):
+        subdir = os.path.join(objects_dir, prefix)
+        if len(prefix) != 2 or not os.path.isdir(subdir):
+            continue
+        for rest in os.listdir(subdir):
+            if len(rest) == 38:
+                found[pg2.Oid(hex=prefix + rest)] = os.path.join(subdir, rest)
+    return found
+
+
+def _packs(repo):
+    objects_dir = _objects_dir(repo)
+    if objects_dir is None:
+        return []
+
+    pack_dir = os.path.join(objects_dir, 'pack')
+    if not os.path.isdir(pack_dir):
+        return []
+    return [os.path.join(pack_dir, name) for name in os.listdir(pack_dir)
+            if name.endswith('.pack')]
+
+
+def object_stats(repo):
+    """Counts the loose objects and packs in a repository.
+
+    Returns:
+        dict: ``loose_objects``, ``loose_size`` (in bytes), and ``packs``
+    """
+    paths = loose_objects(repo).values()
+    return {
+        'loose_objects': len(paths),
+        'loose_size': sum(os.path.getsize(p) for p in paths),
+        'packs': len(_packs(repo)),
+    }
+
+
+def _object_type(repo, oid):
+    try:
+        read_header = repo.odb.read_header
+    except AttributeError:  # pygit2 before 1.20 can only read whole objects
+        return repo[oid].type
+    return read_header(oid)[0]
+
+
+def _reachable(repo, retired=()):
+    commits = [oid for oid in repo if oid not in retired and
+               _object_type(repo, oid) == GIT_OBJECT_COMMIT]
+    reachable = set(commits)
+    trees = [repo[oid].tree_id for oid in commits]
+
+    while trees:
+        oid = trees.pop()
+        if oid in reachable:
+            continue
+        reachable.add(oid)
+
+        for entry in repo[oid]:
+            if entry.filemode == pg2.GIT_FILEMODE_TREE:
+                trees.append(entry.id)
+            else:
+                reachable.add(entry.id)
+
+    return reachable
+
+
+def maintain(repo, prune_grace=DEFAULT_PRUNE_GRACE, retired=()):
+    """Packs and prunes the objects in a repository.
+
+    Parameters:
+        repo (pygit2.Repository): The repository to maintain
+        prune_grace (float): Unreachable loose objects modified less than
+            this many seconds ago are kept
+        retired (set[Oid]): Commits that should not be treated as reachable,
+            such as those replaced by history compaction
+
+    Returns:
+        dict: The :py:func:`object_stats` from ``before`` and ``after``
+        maintenance, as well as the number of objects ``packed`` and
+        ``pruned``
+    """
+    before = object_stats(repo)
+    if _objects_dir(repo) is None:
+        return {'before': before, 'after': before, 'packed': 0, 'pruned': 0}
+
+    old_packs = _packs(repo)
+    loose = loose_objects(repo)
+    reachable = _reachable(repo, retired)
+
+    packed = 0
+    if reachable:
+        builder = pg2.PackBuilder(repo)
+        for oid in reachable:
+            builder.add(oid)
+        builder.write()
+        packed = builder.written_objects_count
+
+    new_packs = set(_packs(repo)) - set(old_packs)
+    if packed and new_packs:
+        for pack in old_packs:
+            if pack in new_packs:  # nothing changed since the last repack
+                continue
+            for path in (pack, pack[:-len('.pack')] + '.idx'):
+                try:
+                    os.remove(path)
+                except OSError:  # pragma: no cover
+                    pass
+
+    pruned = 0
+    cutoff = time.time() - prune_grace
+    for oid, path in loose.items():
+        try:
+            if oid not in reachable:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                pruned += 1
+            os.remove(path)
+        except OSError:  # pragma: no cover
+            continue
+
+    return {'before': before, 'after': object_stats(repo),
+            'packed': packed, 'pruned': pruned}
+
+
+class MaintenanceThread(threading.Thread):
+    """A daemon thread that keeps a table's repositories maintained.
+
+    Every ``interval`` seconds, the thread calls
+    :py:meth:`.Table.maintain_if_needed` on its table.  Call
+    :py:meth:`~.MaintenanceThread.stop` to shut it down.
+    """
+
+    def __init__(self, table, interval=60.0):
+        super().__init__(name='ogitm-maintenance-' + table.name)
+        self.daemon = True
+        self.table = table
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.table.maintain_if_needed()
+
+    def stop(self):
+        """Stops the thread, and waits for it to finish."""
+        self._stopped.set()
+        self.join()
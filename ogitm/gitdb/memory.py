@@ -0,0 +1,75 @@
+"""In-memory repositories
+
+A database on disk writes every blob, tree and commit as a file, which is
+wasted work for tables that don't need to outlive the process, such as
+scratch tables and test fixtures.  :py:func:`memory_repository` creates a
+repository whose objects are kept in a dictionary instead, through a
+pure-Python object database backend.
+
+These repositories have no path, and so no reference database either: the
+:py:class:`~.treewrapper.TreeWrapper` wrapping one keeps track of its own
+head commit.  Everything stored in them is lost when they are garbage
+collected.
+"""
+
+import pygit2 as pg2
+
+
+__all__ = ['MemoryBackend', 'memory_repository']
+
+
+class MemoryBackend(pg2.OdbBackend):
+    """An object database backend that keeps every object in a dict.
+
+    Objects are looked up by their full id; abbreviated ids are not
+    supported.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._objects = {}
+
+    def __iter__(self):
+        return iter(list(self._objects))
+
+    def __len__(self):
+        return len(self._objects)
+
+    def read_cb(self, oid):
+        return self._objects[oid]
+
+    def read_prefix_cb(self, oid):
+        obj_type, data = self._objects[oid]
+        return obj_type, data, oid
+
+    def read_header_cb(self, oid):
+        obj_type, data = self._objects[oid]
+        return obj_type, len(data)
+
+    def exists_cb(self, oid):
+        return oid in self._objects
+
+    def exists_prefix_cb(self, oid):
+        if oid not in self._objects:
+            raise KeyError(oid)
+        return oid
+
+    def write_cb(self, oid, data, obj_type):
+        self._objects[oid] = (obj_type, data)
+
+    def refresh_cb(self):
+        pass
+
+
+def memory_repository():
+    """Creates an empty repository that is stored entirely in memory.
+
+    Returns:
+        pygit2.Repository: A repository with no path
+    """
+    odb = pg2.Odb()
+    odb.add_backend(MemoryBackend(), 1)
+
+    repo = pg2.Repository()
+    repo.set_odb(odb)
+    return repo
@@ -0,0 +1,173 @@
+"""Literal text in regular expressions
+
+The ``regex`` search operator would otherwise have to run a pattern against
+every distinct value of a key.  Most patterns contain some plain text that
+every match has to contain, though, and often start with it as well, so
+this module picks that text out of a pattern:
+
+* the *prefix*, which every matching value starts with, when the pattern is
+  anchored to the start of the value (with ``^`` or ``\\A``);
+* the *literals*, runs of plain text that every matching value contains.
+
+The values with the prefix can then be looked up in the sorted values of
+the index (or in a text index), and values without every literal can be
+skipped without decoding them, and without running the pattern.
+
+The parsing is deliberately conservative: anything that isn't plain text
+(classes, groups, escapes, and any character followed by a quantifier that
+makes it optional) ends a run of text, and patterns that can't be reasoned
+about this way (ones with alternatives at the top level, case-insensitive or
+verbose patterns, or ones using escapes that stand for other characters)
+have no literals at all.  That only means more values are tested.
+"""
+
+import functools
+import re
+
+
+__all__ = ['Pattern', 'compile_pattern', 'literal_text']
+
+_CLASS_ESCAPES = set('dDwWsSbBAZ')
+_QUANTIFIER = re.compile(r'\{\d*(,\d*)?\}')
+_PATTERN_TYPE = type(_QUANTIFIER)
+
+
+def _skip_class(pattern, i):
+    """The position after the character class starting at ``i``."""
+    i += 1
+    if pattern[i:i + 1] == '^':
+        i += 1
+    if pattern[i:i + 1] == ']':
+        i += 1
+    while i < len(pattern) and pattern[i] != ']':
+        i += 2 if pattern[i] == '\\' else 1
+    return i + 1
+
+
+def _skip_group(pattern, i):
+    """The position after the group starting at ``i``."""
+    depth = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 2
+            continue
+        elif char == '[':
+            i = _skip_class(pattern, i)
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def literal_text(pattern):
+    """The text that every match of a pattern starts with, and contains.
+
+    Parameters:
+        pattern (str): A regular expression
+
+    Returns:
+        (str, list[str]): The prefix of every match (which is empty unless
+        the pattern is anchored), and runs of text in every match
+    """
+    anchored = pattern.startswith(('^', '\\A'))
+    i = 1 if pattern.startswith('^') else 2 if anchored else 0
+    # every run but the last has ended, so the first is only the prefix if
+    # nothing came before it
+    runs = [[]]
+
+    def end_run():
+        runs.append([])
+
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped.isalnum():
+                if escaped not in _CLASS_ESCAPES:
+                    return '', []  # a character code, or a back reference
+                end_run()
+            else:
+                runs[-1].append(escaped)
+            i += 2
+            continue
+        elif char == '|':
+            return '', []
+        elif char == '[':
+            end_run()
+            i = _skip_class(pattern, i)
+            continue
+        elif char == '(':
+            end_run()
+            i = _skip_group(pattern, i)
+            continue
+        elif char in '*?' or _QUANTIFIER.match(pattern, i):
+            # the character before is optional, or may be repeated
+            if runs[-1]:
+                runs[-1].pop()
+            end_run()
+            if char == '{':
+                i = _QUANTIFIER.match(pattern, i).end()
+                continue
+        elif char == '+':
+            # the character before is there, but may be repeated
+            end_run()
+        elif char in '.^$':
+            end_run()
+        else:
+            runs[-1].append(char)
+        i += 1
+
+    texts = [''.join(run) for run in runs]
+    prefix = texts[0] if anchored else ''
+    return prefix, [text for text in texts if text]
+
+
+class Pattern:
+    """A compiled regular expression, and the text in its matches.
+
+    Attributes:
+        regex: The compiled expression
+        prefix (str): The text every match starts with, or an empty string
+        literals (list[str]): Text that every match contains
+    """
+
+    def __init__(self, pattern):
+        if isinstance(pattern, str):
+            self.regex = re.compile(pattern)
+        elif isinstance(pattern, _PATTERN_TYPE) and \
+                isinstance(pattern.pattern, str):
+            self.regex = pattern
+        else:
+            raise ValueError("regex patterns must be strings")
+
+        flags = self.regex.flags
+        if flags & (re.IGNORECASE | re.VERBOSE):
+            self.prefix, self.literals = '', []
+        else:
+            self.prefix, self.literals = literal_text(self.regex.pattern)
+            if flags & re.MULTILINE:  # ^ can match after any newline
+                self.prefix = ''
+
+
+def compile_pattern(pattern):
+    """Returns the :py:class:`Pattern` of a regular expression, compiling
+    and parsing each expression only once.
+
+    Raises:
+        ValueError: if the pattern isn't a string, or a compiled string
+            pattern
+    """
+    if not isinstance(pattern, (str, _PATTERN_TYPE)):
+        raise ValueError("regex patterns must be strings")
+    return _compile(pattern)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern):
+    return Pattern(pattern)
@@ -0,0 +1,116 @@
+"""Precomputed string predicates
+
+The ``is*`` search operators (``{'code': {'isdigit': True}}``) call a string
+method on every distinct value of a key.  Those results never change, so a
+key's predicate sets, created with :py:meth:`.Table.create_predicate_index`,
+work them out once, when a string first becomes a value of the key, and
+store them beside the key's value index, as ``props-<key>``.  This maps the
+value index key of each string to a bitmask of the predicates that are true
+for it (bit ``i`` standing for ``PREDICATES[i]``), and strings that no
+predicate is true for are left out.  The strings a predicate is false for are
+then the other strings in the value index, whose keys can be picked out
+without decoding them, as they are the only json that starts with a quote.
+
+Keys without predicate sets test every value instead.
+"""
+
+import json
+
+
+__all__ = ['PREDICATES', 'PredicateSets']
+
+PREDICATES = ('isalnum', 'isalpha', 'isdecimal', 'isdigit', 'isidentifier',
+              'islower', 'isnumeric', 'isprintable', 'isspace', 'istitle',
+              'isupper')
+
+
+def _is_string_key(value_key):
+    return value_key.startswith('"')
+
+
+def _mask(value):
+    mask = 0
+    for bit, op in enumerate(PREDICATES):
+        if getattr(value, op)():
+            mask |= 1 << bit
+    return mask
+
+
+class PredicateSets:
+    """The predicate sets of one key.
+
+    Parameters:
+        data (dict): Stored predicate sets, as returned by :py:meth:`dump`
+    """
+
+    def __init__(self, data=None):
+        self.masks = data or {}
+        self._copied = False
+
+    @classmethod
+    def build(cls, index):
+        """Creates the predicate sets of every string in a value index."""
+        sets = cls()
+        for value_key in index:
+            if _is_string_key(value_key):
+                sets.add(value_key, json.loads(value_key))
+        return sets
+
+    def dump(self):
+        return self.masks
+
+    def _copy(self):
+        # stored sets may be shared with a cache
+        if not self._copied:
+            self.masks = dict(self.masks)
+            self._copied = True
+
+    def add(self, value_key, value):
+        """Adds a value that is new to the value index.
+
+        Returns:
+            bool: Whether the predicate sets changed
+        """
+        mask = _mask(value) if isinstance(value, str) else 0
+        if mask:
+            self._copy()
+            self.masks[value_key] = mask
+        return bool(mask)
+
+    def remove(self, value_key, value):
+        """Removes a value that is no longer in the value index.
+
+        Returns:
+            bool: Whether the predicate sets changed
+        """
+        if value_key not in self.masks:
+            return False
+        self._copy()
+        del self.masks[value_key]
+        return True
+
+    def search(self, op, arg, index):
+        """The ids of the documents that match ``{op: arg}``.
+
+        Parameters:
+            index (dict): The value index of the same key
+        """
+        bit = 1 << PREDICATES.index(op)
+        keys = set()
+        # compared like the predicate's result, so 1 and 0 match as well
+        for result in (True, False):
+            if result != arg:
+                continue
+            elif result:
+                keys.update(value_key
+                            for value_key, mask in self.masks.items()
+                            if mask & bit)
+            else:
+                keys.update(value_key for value_key in index
+                            if _is_string_key(value_key) and
+                            not self.masks.get(value_key, 0) & bit)
+
+        ids = set()
+        for value_key in keys:
+            ids.update(index.get(value_key, ()))
+        return ids
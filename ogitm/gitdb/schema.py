@@ -0,0 +1,274 @@
+"""Compact, schema-bound encoding for documents
+
+Documents in a model's table all have the same fields, but the codecs in
+:py:mod:`~.gitdb.codecs` store every field name in every document, and JSON
+stores every number as text.  A :py:class:`Schema` lists the fields of a
+table's documents, so a :py:class:`SchemaCodec` can leave the names out:
+
+* every field gets an id, which it keeps for as long as the table exists;
+* each encoded document starts with a small header, with the schema version
+  it was encoded with, and one tag byte per field in that version;
+* integers, floats and booleans are stored as fixed-width binary (booleans
+  only take up their tag), and strings as length-prefixed UTF-8;
+* values of fields with a list of choices are stored as the ordinal of the
+  value in that list.
+
+Anything else (a value of any other type, or a document with a field that
+isn't in the schema) is stored with the table's own codec, so every value
+round-trips exactly.  Every blob also carries the version it was written
+with, and versions are never changed once they're recorded, so adding fields
+to a schema (which adds a version) keeps every old document readable.
+
+The schema of a table is stored in its metadata, and is set by
+:py:meth:`.Table.bind_schema` (which models do when they are declared with
+``compact=True``).
+"""
+
+import json
+import struct
+
+from .backends import as_bytes
+
+
+__all__ = ['MAGIC', 'Schema', 'SchemaCodec']
+
+# no JSON or marshal encoding starts with this, and no MessagePack encoding
+# of more than one byte does either
+MAGIC = b'\xffS'
+
+_HEADER = struct.Struct('<2sH')
+_MAX_CHOICES = 0xFFFF
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+(_ABSENT, _NULL, _FALSE, _TRUE, _INT, _FLOAT, _STR, _CHOICE,
+ _OTHER) = range(9)
+
+# the struct format of the fixed-width part of each tag
+_FORMATS = {_INT: 'q', _FLOAT: 'd', _STR: 'I', _CHOICE: 'H', _OTHER: 'I'}
+_CONSTANTS = {_NULL: None, _FALSE: False, _TRUE: True}
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class Schema:
+    """Every version of the fields in a table's documents.
+
+    Each version is a list of (field id, name, choices) fields, where choices
+    is a list of values, or None.
+
+    Parameters:
+        versions (list): The versions of the schema, oldest first
+    """
+
+    def __init__(self, versions=()):
+        self.versions = [[(i, name, choices) for i, name, choices in version]
+                         for version in versions]
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(json.loads(text)['versions'])
+
+    def to_json(self):
+        return json.dumps({'versions': self.versions})
+
+    @property
+    def latest(self):
+        """The number of the newest version, or None if there isn't one."""
+        return len(self.versions) - 1 if self.versions else None
+
+    def _field_ids(self):
+        ids = {}
+        for version in self.versions:
+            for field_id, name, _ in version:
+                ids[name] = field_id
+        return ids
+
+    def add_version(self, fields):
+        """Adds a version with the given fields, unless it's the latest one.
+
+        Fields keep the id they had in earlier versions, and new fields get
+        new ids.  Choices that can't be stored in a schema (ones that aren't
+        all strings, numbers, booleans or None) are left out, and values of
+        that field are encoded without ordinals.
+
+        Parameters:
+            fields (list[(str, list)]): The name of every field, and its
+                choices, or None if it has none
+
+        Returns:
+            bool: Whether a new version was added
+        """
+        ids = self._field_ids()
+        next_id = max(ids.values(), default=-1) + 1
+        version = []
+        for name, choices in fields:
+            if choices is not None:
+                choices = list(choices)
+                if len(choices) > _MAX_CHOICES or \
+                        not all(isinstance(c, _SCALARS) for c in choices):
+                    choices = None
+            if name not in ids:
+                ids[name] = next_id
+                next_id += 1
+            version.append((ids[name], name, choices))
+
+        version.sort(key=lambda field: field[0])
+        if self.versions and self._same(self.versions[-1], version):
+            return False
+
+        self.versions.append(version)
+        return True
+
+    @staticmethod
+    def _same(old, new):
+        # choices are often sets, which iterate in no particular order
+        if [f[:2] for f in old] != [f[:2] for f in new]:
+            return False
+        for (_, _, old_choices), (_, _, new_choices) in zip(old, new):
+            if (old_choices is None) != (new_choices is None):
+                return False
+            elif old_choices is not None:
+                old_typed = [_typed(choice) for choice in old_choices]
+                if len(old_choices) != len(new_choices) or not all(
+                        _typed(choice) in old_typed for choice in new_choices):
+                    return False
+        return True
+
+
+def _typed(value):
+    # 1, 1.0 and True are equal, but must not share an ordinal
+    return type(value), value
+
+
+class _Plan:
+    """How to decode the documents of one version with one set of tags."""
+
+    __slots__ = ('fixed', 'steps')
+
+    def __init__(self, version, tags):
+        formats = ['<']
+        self.steps = []
+        for (_, name, choices), tag in zip(version, tags):
+            if tag == _ABSENT:
+                continue
+            formats.append(_FORMATS.get(tag, ''))
+            self.steps.append((name, tag, choices))
+        self.fixed = struct.Struct(''.join(formats))
+
+
+class SchemaCodec:
+    """Encodes documents that fit a :py:class:`Schema` without field names.
+
+    Parameters:
+        schema (Schema): The schema of the table
+        fallback: The codec of everything that doesn't fit the schema
+        reload (callable): Returns the table's schema as currently stored,
+            for when a document uses a version that isn't known yet
+    """
+
+    name = 'schema'
+    available = True
+
+    def __init__(self, schema, fallback, reload=None):
+        self.fallback = fallback
+        self._reload = reload
+        self._plans = {}
+        self._use(schema)
+
+    def _use(self, schema):
+        self.schema = schema
+        version = schema.versions[schema.latest]
+        self._fields = [(name, self._ordinals(choices))
+                        for _, name, choices in version]
+        self._names = {name for _, name, _ in version}
+
+    @staticmethod
+    def _ordinals(choices):
+        if choices is None:
+            return None
+        ordinals = {}
+        for ordinal, choice in enumerate(choices):
+            ordinals.setdefault(_typed(choice), ordinal)
+        return ordinals
+
+    def encode(self, value):
+        if not isinstance(value, dict) or not value.keys() <= self._names:
+            return self.fallback.encode(value)
+
+        tags = bytearray()
+        fixed = []
+        variable = []
+        for name, ordinals in self._fields:
+            if name not in value:
+                tags.append(_ABSENT)
+                continue
+
+            item = value[name]
+            kind = type(item)
+            if item is None:
+                tags.append(_NULL)
+            elif ordinals is not None and kind in _SCALARS and \
+                    (kind, item) in ordinals:
+                tags.append(_CHOICE)
+                fixed.append(ordinals[kind, item])
+            elif kind is bool:
+                tags.append(_TRUE if item else _FALSE)
+            elif kind is int and _INT_MIN <= item <= _INT_MAX:
+                tags.append(_INT)
+                fixed.append(item)
+            elif kind is float:
+                tags.append(_FLOAT)
+                fixed.append(item)
+            else:
+                if kind is str:
+                    tags.append(_STR)
+                    data = item.encode('utf-8')
+                else:
+                    tags.append(_OTHER)
+                    data = as_bytes(self.fallback.encode(item))
+                fixed.append(len(data))
+                variable.append(data)
+
+        version = self.schema.latest
+        plan = self._plan(version, bytes(tags))
+        return b''.join([_HEADER.pack(MAGIC, version), tags,
+                         plan.fixed.pack(*fixed)] + variable)
+
+    def _plan(self, version, tags):
+        try:
+            return self._plans[version, tags]
+        except KeyError:
+            plan = _Plan(self.schema.versions[version], tags)
+            self._plans[version, tags] = plan
+            return plan
+
+    def decode(self, data):
+        if isinstance(data, str) or data[:2] != MAGIC:
+            return self.fallback.decode(data)
+
+        _, version = _HEADER.unpack_from(data)
+        if version >= len(self.schema.versions) and self._reload is not None:
+            self._use(self._reload())
+        fields = len(self.schema.versions[version])
+
+        start = _HEADER.size
+        plan = self._plan(version, bytes(data[start:start + fields]))
+        offset = start + fields
+        values = iter(plan.fixed.unpack_from(data, offset))
+        offset += plan.fixed.size
+
+        document = {}
+        for name, tag, choices in plan.steps:
+            if tag in _CONSTANTS:
+                document[name] = _CONSTANTS[tag]
+            elif tag == _INT or tag == _FLOAT:
+                document[name] = next(values)
+            elif tag == _CHOICE:
+                document[name] = choices[next(values)]
+            else:
+                end = offset + next(values)
+                if tag == _STR:
+                    document[name] = str(data[offset:end], 'utf-8')
+                else:
+                    document[name] = self.fallback.decode(data[offset:end])
+                offset = end
+        return document
@@ -1,4 +1,9 @@
 import json
+import operator
+
+from .index_access import CAPABILITIES
+from .patterns import compile_pattern
+from .predicates import PREDICATES
 
 
 __all__ = ['SearchFunction']
@@ -25,16 +30,20 @@ class SearchFunction:
     """
 
     funcs = {}
+    capabilities = {}
 
     @classmethod
-    def add(cls, *funcnames):
+    def add(cls, *funcnames, needs=None):
         """Add a function to the current list of functions.
 
-        The function should have the following signature:
+        A function can declare the index access it ``needs``, as one of the
+        capabilities in :py:data:`.index_access.CAPABILITIES` (``'lookup'``,
+        ``'prefix'``, ``'range'`` or ``'scan'``).  Searches run their
+        cheapest terms first, and stop once no documents are left, so this
+        should be the most expensive kind of access the function makes.
+        These functions should have the following signature:
 
-        :param any key: The key for which a value should be found.  This is
-            usually not important - the function is also passed the index that
-            pertains to this particular key.
+        :param any key: The key for which a value should be found.
 
         :param str operator: The operator/name that this function has been
             called under.  Sometimes it is simpler if different operators all
@@ -45,21 +54,45 @@ class SearchFunction:
 
         :param any argument: The argument passed to this particular operator.
 
+        :param index: The indexes of the key being searched against.
+        :type index: :py:class:`~.index_access.IndexAccessor`
+
+        :param dict query: Every operator and argument given for this key.
+
+        Functions that don't declare what they need are treated as scans, and
+        have the following signature instead:
+
+        :param any key: As above.
+
+        :param str operator: As above.
+
+        :param any argument: As above.
+
         :param index: The index related to the key being searched against.
             This is basically a dict mapping every value that has been assigned
             to this key to a list of the ids of the documents where this
             key-value mapping exists.
         :type index: dict[any: list[id]]
 
+        :param dict query: As above.
+
         :param set[id] all: The set of all ids that are currently stored.
             This is useful in the case where you want to search for, say,
             non-existance of a key, in which case the set of ids that should
             be returned is the set of all ids that aren't in the index that
             the function has been passed.
+
+        Either way, the function returns the set of ids that match.
+
+        :raises ValueError: if ``needs`` isn't a known capability
         """
+        if needs is not None and needs not in CAPABILITIES:
+            raise ValueError("Unknown index capability " + str(needs))
+
         def _add(func):
             for name in funcnames:
                 cls.funcs[name] = func
+                cls.capabilities[name] = needs
             return func
         return _add
 
@@ -71,83 +104,160 @@ class SearchFunction:
             m = "Unrecognised search term: {term}"
             raise KeyError(m.format(term=funcname))
 
+    @classmethod
+    def needs(cls, funcname):
+        """The capability a function declared, or None if it didn't."""
+        cls.get(funcname)
+        return cls.capabilities[funcname]
 
-@SearchFunction.add('exists')
-def exists(key, op, arg, index, query, al):
-    resp = []
-    for ids in index.values():
-        resp.extend(ids)
+    @classmethod
+    def cost(cls, funcname):
+        """The position of a function's capability in order of cost."""
+        return CAPABILITIES.index(cls.needs(funcname) or 'scan')
+
+
+def _scan(index, test):
+    """The ids of every value that passes a test, skipping values that the
+    test can't be applied to."""
+    resp = set()
+    for value, ids in index.values():
+        try:
+            if test(value):
+                resp.update(ids)
+        except (ValueError, TypeError, AttributeError):
+            continue
+    return resp
 
+
+@SearchFunction.add('exists', needs='lookup')
+def exists(key, op, arg, index, query):
     if arg:
-        return set(resp)
+        return index.present()
     else:
-        return al - set(resp)
+        return index.all_ids() - index.present()
 
 
-@SearchFunction.add('eq', '==', 'equal')
-@SearchFunction.add('gte', '>=', 'greater-than-equal')
-@SearchFunction.add('lte', '<=', 'less-than-equal')
-@SearchFunction.add('lt', '<', 'less-than')
-@SearchFunction.add('gt', '>', 'greater-than')
-def comparison(key, op, arg, index, query, all):
-    resp = []
-    for value in index:
-        try:
-            svalue = json.loads(value)
-
-            if op in {"gt", '>', 'greater-than'}:
-                if svalue > arg:
-                    resp.extend(index[value])
-            elif op in {"lt", '<', 'less-than'}:
-                if svalue < arg:
-                    resp.extend(index[value])
-            elif op in {'gte', '>=', 'greater-than-equal'}:
-                if svalue >= arg:
-                    resp.extend(index[value])
-            elif op in {'lte', '<=', 'less-than-equal'}:
-                if svalue <= arg:
-                    resp.extend(index[value])
-            elif op in {'eq', '==', 'equal'}:
-                if svalue == arg:
-                    resp.extend(index[value])
-            else:
-                assert False, "Unrecognised op for comparison function: " + op
-
-        except (ValueError, TypeError):
-            continue
+_COMPARISONS = {
+    'eq': operator.eq, '==': operator.eq, 'equal': operator.eq,
+    'gte': operator.ge, '>=': operator.ge, 'greater-than-equal': operator.ge,
+    'lte': operator.le, '<=': operator.le, 'less-than-equal': operator.le,
+    'lt': operator.lt, '<': operator.lt, 'less-than': operator.lt,
+    'gt': operator.gt, '>': operator.gt, 'greater-than': operator.gt,
+}
+
+# whether the argument is the low and high bound of the range, and whether
+# those bounds are inclusive
+_BOUNDS = {
+    operator.eq: (True, True, True, True),
+    operator.ge: (True, False, True, True),
+    operator.le: (False, True, True, True),
+    operator.lt: (False, True, True, False),
+    operator.gt: (True, False, False, True),
+}
+
 
-    return set(resp)
+@SearchFunction.add(*_COMPARISONS, needs='range')
+def comparison(key, op, arg, index, query):
+    test = _COMPARISONS[op]
+    has_low, has_high, low_inclusive, high_inclusive = _BOUNDS[test]
+    resp = index.range(arg if has_low else None, arg if has_high else None,
+                       low_inclusive, high_inclusive)
+    if resp is None:  # not a number or a string
+        resp = _scan(index, lambda value: test(value, arg))
+    return resp
+
+
+def _values(op, arg):
+    if not isinstance(arg, (list, tuple, set, frozenset)):
+        m = "The argument of {op} must be a list of values"
+        raise ValueError(m.format(op=op))
+    return arg
+
+
+@SearchFunction.add('in', needs='lookup')
+def in_(key, op, arg, index, query):
+    resp = set()
+    for value in _values(op, arg):
+        resp |= index.lookup(value)
+    return resp
+
+
+@SearchFunction.add('nin', needs='lookup')
+def not_in(key, op, arg, index, query):
+    return index.all_ids() - in_(key, op, arg, index, query)
+
+
+@SearchFunction.add('ne', '!=', 'not-equal', needs='lookup')
+def not_equal(key, op, arg, index, query):
+    return index.all_ids() - index.lookup(arg)
+
+
+@SearchFunction.add('between', needs='range')
+def between(key, op, arg, index, query):
+    try:
+        low, high = arg
+    except (TypeError, ValueError):
+        m = "The argument of between must be a (low, high) pair"
+        raise ValueError(m)
+
+    if low is None and high is None:
+        return index.present()
+
+    resp = index.range(low, high)
+    if resp is None:  # not numbers or strings
+        resp = _scan(index, lambda value: (low is None or low <= value) and
+                     (high is None or value <= high))
+    return resp
+
+
+@SearchFunction.add('startswith', needs='prefix')
+def startswith(key, op, arg, index, query):
+    if isinstance(arg, str):
+        return index.prefix(arg)
+    return _scan(index, lambda value: value.startswith(arg))
 
 
 # TODO: expand this to other string operators?
-@SearchFunction.add('startswith')
-@SearchFunction.add('endswith')
-@SearchFunction.add('contains')
-@SearchFunction.add('isalnum')
-@SearchFunction.add('isalpha')
-@SearchFunction.add('isdecimal')
-@SearchFunction.add('isdigit')
-@SearchFunction.add('isidentifier')
-@SearchFunction.add('islower')
-@SearchFunction.add('isnumeric')
-@SearchFunction.add('isprintable')
-@SearchFunction.add('isspace')
-@SearchFunction.add('istitle')
-@SearchFunction.add('isupper')
-def startswith(key, op, arg, index, query, all):
-    resp = []
-    for value in index:
-        val = json.loads(value)
-        try:
-            if op == 'contains':
-                if arg in val:
-                    resp.extend(index[value])
-            elif op.startswith('is'):
-                if getattr(val, op)() == arg:
-                    resp.extend(index[value])
-            elif getattr(val, op)(arg):
-                resp.extend(index[value])
-        except (ValueError, TypeError, AttributeError):
+@SearchFunction.add('endswith', needs='scan')
+@SearchFunction.add('contains', needs='scan')
+def text_search(key, op, arg, index, query):
+    resp = index.text_search(op, arg)
+    if resp is not None:
+        return resp
+    elif op == 'contains':
+        return _scan(index, lambda value: arg in value)
+    else:
+        return _scan(index, lambda value: value.endswith(arg))
+
+
+@SearchFunction.add('regex', needs='scan')
+def regex(key, op, arg, index, query):
+    pattern = compile_pattern(arg)
+    if pattern.prefix:
+        keys = index.prefix_keys(pattern.prefix)
+    else:
+        keys = None
+        if pattern.literals:
+            keys = index.text_keys('contains', max(pattern.literals, key=len))
+        if keys is None:
+            keys = index.string_keys()
+
+    # a string's json contains the json of every substring of it, so values
+    # without the literal text can be skipped before they're decoded
+    literals = [json.dumps(text)[1:-1] for text in pattern.literals]
+    resp = set()
+    for value_key in keys:
+        if not value_key.startswith('"') or \
+                not all(text in value_key for text in literals):
             continue
+        elif pattern.regex.search(json.loads(value_key)):
+            resp.update(index.index.get(value_key, ()))
+    return resp
+
 
-    return set(resp)
+@SearchFunction.add(*PREDICATES, needs='scan')
+def predicate(key, op, arg, index, query):
+    resp = index.predicate_search(op, arg)
+    if resp is not None:
+        return resp
+    return _scan(index, lambda value: getattr(value, op)() == arg)
@@ -0,0 +1,221 @@
+"""An append-only index of the commits on a branch
+
+Git only stores links from a commit to its parents, so finding the commit
+``n`` steps back from the head means walking ``n`` commits.  The
+:py:class:`CommitSequence` keeps the first-parent chain of the branch as a flat
+array of commit ids instead, ordered from the root commit to the head, so that
+any position can be looked up directly.
+
+The array is stored next to the repository as a file of fixed-width records,
+one raw commit id per record.  It holds no information that isn't in the
+repository itself, so if it is missing, stale, or was written by another
+instance, it is brought back in line with the branch head by walking back
+from the head until a known commit is found.
+"""
+
+import os
+
+import pygit2 as pg2
+
+
+__all__ = ['CommitSequence', 'StateReplacements']
+
+SEQUENCE_FILE = 'ogitm-sequence'
+RECORD_SIZE = 20
+
+
+class CommitSequence:
+
+    def __init__(self, repo, path=None):
+        self._repo = repo
+        self._path = path
+        self._oids = []
+        self._positions = {}
+        self._file_size = None
+
+    @classmethod
+    def for_repo(cls, repo):
+        if repo.path is None:
+            return cls(repo)
+        return cls(repo, os.path.join(repo.path, SEQUENCE_FILE))
+
+    def __len__(self):
+        return len(self._oids)
+
+    def __getitem__(self, position):
+        return self._oids[position]
+
+    def __contains__(self, oid):
+        return oid in self._positions
+
+    def position(self, oid):
+        return self._positions[oid]
+
+    def back(self, steps):
+        """The commit ``steps`` commits behind the head (clamped to root)."""
+        return self._oids[max(len(self._oids) - 1 - steps, 0)]
+
+    def sync(self, head):
+        """Brings the sequence in line with the given head commit."""
+        self._reload_if_changed()
+        if self._oids and self._oids[-1] == head:
+            return
+
+        if head in self._positions:
+            self._truncate(self._positions[head] + 1)
+            return
+
+        missing = []
+        for cmt in self._first_parents(head):
+            if cmt.id in self._positions:
+                self._truncate(self._positions[cmt.id] + 1)
+                break
+            missing.append(cmt.id)
+        else:
+            self._truncate(0)
+
+        self._extend(reversed(missing))
+
+    def rebuild(self, head):
+        """Discards the stored sequence and rebuilds it from history."""
+        self._truncate(0)
+        self._extend(reversed([c.id for c in self._first_parents(head)]))
+
+    def _first_parents(self, head):
+        cmt = self._repo[head]
+        while True:
+            yield cmt
+            if not cmt.parents:
+                break
+            cmt = self._repo[cmt.parent_ids[0]]
+
+    def _reload_if_changed(self):
+        if self._path is None:
+            return
+
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            size = 0
+
+        if size == self._file_size:
+            return
+
+        self._oids = []
+        if size:
+            with open(self._path, 'rb') as file:
+                data = file.read()
+            for i in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+                self._oids.append(pg2.Oid(raw=data[i:i + RECORD_SIZE]))
+
+        self._positions = {oid: i for i, oid in enumerate(self._oids)}
+        self._file_size = len(self._oids) * RECORD_SIZE
+
+    def _truncate(self, length):
+        # only rewinding (reverts and compaction) drops records, so ordinary
+        # saves don't touch the file here
+        if length >= len(self._oids) and \
+                self._file_size == length * RECORD_SIZE:
+            return
+
+        for oid in self._oids[length:]:
+            del self._positions[oid]
+        del self._oids[length:]
+
+        if self._path is not None:
+            self._file_size = length * RECORD_SIZE
+            with open(self._path, 'ab') as file:
+                file.truncate(self._file_size)
+
+    def _extend(self, oids):
+        start = len(self._oids)
+        for oid in oids:
+            self._positions[oid] = len(self._oids)
+            self._oids.append(oid)
+
+        if self._path is not None and len(self._oids) > start:
+            with open(self._path, 'ab') as file:
+                file.write(b''.join(o.raw for o in self._oids[start:]))
+            self._file_size = len(self._oids) * RECORD_SIZE
+
+
+REPLACEMENTS_FILE = 'ogitm-replacements'
+_NO_COMMIT = b'\0' * RECORD_SIZE
+
+
+class StateReplacements:
+    """A record of the commits replaced when history was rewritten.
+
+    Rewriting history (see :py:meth:`.TreeWrapper.compact`) gives every
+    commit that is kept a new id, and drops the rest.  State markers handed
+    out before the rewrite still refer to the old ids, so each old id is
+    recorded along with the id that replaced it, or with no id if it was
+    dropped.  Like the :py:class:`CommitSequence`, this is stored next to the
+    repository, as pairs of fixed-width records.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._replaced = {}
+        self._file_size = 0
+
+    @classmethod
+    def for_repo(cls, repo):
+        if repo.path is None:
+            return cls()
+        return cls(os.path.join(repo.path, REPLACEMENTS_FILE))
+
+    def _load(self):
+        # records are only ever added, so a change in size means a change
+        if self._path is None or not os.path.exists(self._path):
+            return self._replaced
+        elif os.path.getsize(self._path) == self._file_size:
+            return self._replaced
+
+        with open(self._path, 'rb') as file:
+            data = file.read()
+
+        self._replaced = {}
+        size = 2 * RECORD_SIZE
+        for i in range(0, len(data) - size + 1, size):
+            old = pg2.Oid(raw=data[i:i + RECORD_SIZE])
+            new = data[i + RECORD_SIZE:i + size]
+            new = None if new == _NO_COMMIT else pg2.Oid(raw=new)
+            self._replaced[old] = new
+        self._file_size = len(data)
+        return self._replaced
+
+    def __contains__(self, oid):
+        return oid in self._load()
+
+    def retired(self):
+        """Every commit id that has been replaced or dropped."""
+        return set(self._load())
+
+    def resolve(self, oid):
+        """The current id of a commit.
+
+        Raises:
+            ValueError: if the commit was dropped
+        """
+        replaced = self._load()
+        while oid in replaced:
+            oid = replaced[oid]
+            if oid is None:
+                raise ValueError("State was removed by history compaction")
+        return oid
+
+    def add(self, mapping):
+        """Records that each old commit id maps to a new id (or None)."""
+        replaced = self._load()
+        for old, new in replaced.items():
+            if new in mapping:
+                replaced[old] = mapping[new]
+        replaced.update(mapping)
+
+        if self._path is not None:
+            with open(self._path, 'wb') as file:
+                for old, new in replaced.items():
+                    file.write(old.raw)
+                    file.write(_NO_COMMIT if new is None else new.raw)
+            self._file_size = os.path.getsize(self._path)
@@ -0,0 +1,191 @@
+"""Text indexes for substring, prefix and suffix searches
+
+The value index of a key (``index-<key>``) maps each distinct value to the
+documents that have it, so the ``contains``, ``startswith`` and ``endswith``
+operators have to decode and test every distinct value on every search.  A
+text index, created with :py:meth:`.Table.create_text_index`, is stored
+beside the value index (as ``text-<key>``), and holds:
+
+* every distinct string value, in a list whose positions are used as the
+  ids of the strings;
+* the trigrams of those strings, each mapped to the ids of the strings that
+  contain it, so that a string is only stored once, however many trigrams
+  it has;
+* every distinct string, sorted, so the strings with a given prefix are one
+  contiguous range, found by bisection;
+* every distinct string reversed, and sorted, so the same goes for suffixes;
+* the distinct values that are lists or dicts, which ``contains`` also
+  matches, and which are still tested one by one.
+
+Searches then only test the strings that share every trigram with the
+argument, or none at all, for prefixes and suffixes.  Only distinct values
+are held, so the text index only changes when a value is first added to, or
+last removed from, the value index.
+"""
+
+import bisect
+import json
+
+
+__all__ = ['TEXT_OPERATORS', 'TextIndex', 'trigrams']
+
+TEXT_OPERATORS = {'contains', 'startswith', 'endswith'}
+
+
+def trigrams(text):
+    """Every distinct substring of three characters in a string."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _remove_sorted(values, value):
+    position = bisect.bisect_left(values, value)
+    if position < len(values) and values[position] == value:
+        del values[position]
+
+
+def _prefixed(values, prefix):
+    position = bisect.bisect_left(values, prefix)
+    while position < len(values) and values[position].startswith(prefix):
+        yield values[position]
+        position += 1
+
+
+class TextIndex:
+    """The text index of one key.
+
+    Parameters:
+        data (dict): A stored text index, as returned by :py:meth:`dump`
+    """
+
+    def __init__(self, data=None):
+        # searches only read the stored index, which may be shared with a
+        # cache, so it is only copied before the first change
+        data = data or {}
+        self.strings = data.get('strings', [])
+        self.grams = data.get('grams', {})
+        self.prefixes = data.get('prefixes', [])
+        self.suffixes = data.get('suffixes', [])
+        self.containers = data.get('containers', [])
+        self._copied = False
+
+    def _copy(self):
+        if not self._copied:
+            self.strings = list(self.strings)
+            # ids of removed strings are left empty, and reused
+            self._ids = {text: string_id
+                         for string_id, text in enumerate(self.strings)
+                         if text is not None}
+            self._free = [string_id
+                          for string_id, text in enumerate(self.strings)
+                          if text is None]
+            self.grams = {gram: set(ids) for gram, ids in self.grams.items()}
+            self.prefixes = list(self.prefixes)
+            self.suffixes = list(self.suffixes)
+            self.containers = set(self.containers)
+            self._copied = True
+
+    @classmethod
+    def build(cls, index):
+        """Creates the text index of every value in a value index."""
+        text_index = cls()
+        for value_key in index:
+            text_index.add(value_key, json.loads(value_key))
+        return text_index
+
+    def dump(self):
+        return {'strings': self.strings,
+                'grams': {gram: sorted(ids)
+                          for gram, ids in self.grams.items()},
+                'prefixes': self.prefixes,
+                'suffixes': self.suffixes,
+                'containers': sorted(self.containers)}
+
+    def add(self, value_key, value):
+        """Adds a value that is new to the value index."""
+        self._copy()
+        if isinstance(value, (list, dict)):
+            self.containers.add(value_key)
+        elif isinstance(value, str):
+            if self._free:
+                string_id = self._free.pop()
+                self.strings[string_id] = value
+            else:
+                string_id = len(self.strings)
+                self.strings.append(value)
+            self._ids[value] = string_id
+            for gram in trigrams(value):
+                self.grams.setdefault(gram, set()).add(string_id)
+            bisect.insort(self.prefixes, value)
+            bisect.insort(self.suffixes, value[::-1])
+
+    def remove(self, value_key, value):
+        """Removes a value that is no longer in the value index."""
+        self._copy()
+        if isinstance(value, (list, dict)):
+            self.containers.discard(value_key)
+        elif isinstance(value, str):
+            string_id = self._ids.pop(value, None)
+            if string_id is not None:
+                self.strings[string_id] = None
+                self._free.append(string_id)
+                for gram in trigrams(value):
+                    ids = self.grams.get(gram, set())
+                    ids.discard(string_id)
+                    if not ids:
+                        self.grams.pop(gram, None)
+            _remove_sorted(self.prefixes, value)
+            _remove_sorted(self.suffixes, value[::-1])
+
+    def matching_keys(self, op, arg):
+        """The value index key of every distinct value that matches
+        ``{op: arg}``.
+
+        Returns:
+            list: The matching keys, or None if the text index can't answer
+            the search (in which case every value should be tested)
+        """
+        if op == 'startswith' and isinstance(arg, str):
+            texts = _prefixed(self.prefixes, arg)
+        elif op == 'endswith' and isinstance(arg, str):
+            texts = (text[::-1]
+                     for text in _prefixed(self.suffixes, arg[::-1]))
+        elif op != 'contains':
+            return None
+        elif not isinstance(arg, str):
+            texts = ()
+        elif len(arg) < 3:  # too short to have trigrams
+            texts = (text for text in self.prefixes if arg in text)
+        else:
+            candidates = set.intersection(
+                *(set(self.grams.get(gram, ())) for gram in trigrams(arg)))
+            texts = (self.strings[string_id] for string_id in candidates)
+            texts = (text for text in texts if arg in text)
+
+        keys = [json.dumps(text) for text in texts]
+        if op == 'contains':
+            for value_key in self.containers:
+                try:
+                    if arg in json.loads(value_key):
+                        keys.append(value_key)
+                except TypeError:
+                    continue
+        return keys
+
+    def search(self, op, arg, index):
+        """The ids of the documents that match ``{op: arg}``.
+
+        Parameters:
+            index (dict): The value index of the same key
+
+        Returns:
+            set: The matching ids, or None if the text index can't answer
+            the search
+        """
+        keys = self.matching_keys(op, arg)
+        if keys is None:
+            return None
+
+        ids = set()
+        for value_key in keys:
+            ids.update(index.get(value_key, ()))
+        return ids
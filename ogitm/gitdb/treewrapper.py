@@ -1,58 +1,97 @@
+import datetime
+
 import pygit2 as pg2
 
+from .backends import StorageBackend
+from .sequence import CommitSequence, StateReplacements
+from . import maintenance
+from .history import ChangePoints, undo_trailer, retained_positions
+from .layout import LAYOUTS, layout_of, diff_trees
 
-_SIGNATURE = pg2.Signature('OGitM', '-')
 
+class TreeWrapper(StorageBackend):
 
-class TreeWrapper:
+    def __init__(self, repo, layout='flat'):
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown layout " + str(layout))
 
-    def __init__(self, repo):
         self._repo = repo
+        # only used for new repositories, as existing trees know their layout
+        self._new_layout = LAYOUTS[layout]
+        # repositories without a path (see memory.py) have no references, so
+        # their head is tracked here instead
+        self._in_memory = repo.path is None
+        self._memory_head = None
         self._working_tree = None
         self._last_saved_tree = None
-        self._working_contents = set()
+        self._sequence = CommitSequence.for_repo(repo)
+        self._replacements = StateReplacements.for_repo(repo)
+        self._changes = ChangePoints.for_repo(repo)
+        self._pending_undos = {}
         self.save("Initial State")  # Initial state should be empty
 
+    @property
+    def repo(self):
+        return self._repo
+
     def __setitem__(self, name, text):
         if self._working_tree is None:
             self._new_working_tree()
 
         blob_id = self._repo.create_blob(text)
         self._working_tree.insert(name, blob_id, pg2.GIT_FILEMODE_BLOB)
-        self._working_contents.add(name)
+
+    def _set_blob(self, name, blob_id):
+        if self._working_tree is None:
+            self._new_working_tree()
+
+        self._working_tree.insert(name, blob_id, pg2.GIT_FILEMODE_BLOB)
+
+    def read_blob(self, blob_id):
+        return self._repo[blob_id].data.decode('utf-8')
+
+    def read_blob_bytes(self, blob_id):
+        return memoryview(self._repo[blob_id])
 
     def __getitem__(self, name):
+        return self._blob(name).data.decode('utf-8')
+
+    def get_bytes(self, name):
+        return memoryview(self._blob(name))
+
+    def _blob(self, name):
+        return self._repo[self.blob_id(name)]
+
+    def blob_id(self, name):
         if self._working_tree is not None:
-            return self._get_from_working_copy(name)
+            return self._id_in_working_copy(name)
         else:
-            return self._get_from_head(name)
+            return self._id_in_head(name)
 
-    def _get_from_working_copy(self, name):
+    def _id_in_working_copy(self, name):
         entry = self._working_tree.get(name)
         if entry is None:
             raise KeyError('{name} not in current tree'.format(name=name))
-        return self._repo[entry.id].data.decode('utf-8')
+        return entry.id
 
-    def _get_from_head(self, name):
+    def _id_in_head(self, name):
         curr_tree = self._get_tree()
         if curr_tree is None:
             assert False, "Tree was not correctly initialised somewhere."
 
-        entry = curr_tree[name]
-        return self._repo[entry.id].data.decode('utf-8')
+        return layout_of(curr_tree).entry(curr_tree, name).id
 
     def __delitem__(self, name):
         if self._working_tree is None:
             self._new_working_tree()
 
         self._working_tree.remove(name)
-        self._working_contents.discard(name)
 
     def __contains__(self, name):
         if self._working_tree is None:
             tree = self._get_tree()
             if tree is not None:
-                return name in tree
+                return layout_of(tree).contains(tree, name)
             else:
                 assert False, "Tree was not correctly initialised somewhere."
         else:
@@ -64,80 +103,325 @@ class TreeWrapper:
             if tree is None:
                 assert False, "Tree was not correctly initialised somewhere."
             else:
-                return [entry.name for entry in tree]
+                return [name for name, _ in layout_of(tree).entries(tree)]
         else:
-            return [i for i in self._working_contents]
-
-    def get(self, name, default=None):
-        try:
-            return self[name]
-        except KeyError:
-            return default
+            return self._working_tree.names()
 
     def clear(self):
         if self._working_tree is None:
             self._new_working_tree()
 
         self._working_tree.clear()
-        self._working_contents.clear()
 
     def save(self, msg=''):
         if self._working_tree is None:
             self._new_working_tree()
 
+        if self._pending_undos:
+            trailers = [undo_trailer(name, count)
+                        for name, count in sorted(self._pending_undos.items())]
+            msg = '\n\n'.join([msg] + ['\n'.join(trailers)])
+
+        # a new signature for each commit, as it carries the commit's time
+        signature = pg2.Signature('OGitM', '-')
         tid = self._working_tree.write()
-        self._repo.create_commit(
-            'refs/heads/master', _SIGNATURE, _SIGNATURE,
-            '', tid, self._get_parents())
+        cid = self._repo.create_commit(
+            None if self._in_memory else 'refs/heads/master',
+            signature, signature, msg, tid, self._get_parents())
+        if self._in_memory:
+            self._memory_head = cid
+        self._sequence.sync(cid)
         self._working_tree = None
         self._last_saved_tree = None
-        self._working_contents.clear()
+        self._pending_undos.clear()
 
     def rollback(self):
         self._working_tree = None
         self._last_saved_tree = None
-        self._working_contents.clear()
+        self._pending_undos.clear()
 
-    def _get_parents(self):
-        if self._repo.is_empty:
-            return []
+    def _head(self):
+        if self._in_memory:
+            return self._memory_head
+        elif self._repo.is_empty:
+            return None
+        else:
+            return self._repo.head.target
+
+    def _move_head(self, state):
+        if self._in_memory:
+            self._memory_head = state
         else:
-            return [self._repo.head.target]
+            self._repo.reset(state, pg2.GIT_RESET_SOFT)
+        self._sequence.sync(state)
+
+    def _get_parents(self):
+        head = self._head()
+        return [] if head is None else [head]
 
     def _new_working_tree(self):
         self._last_saved_tree = self._get_tree()
         if self._last_saved_tree is None:
-            self._working_tree = self._repo.TreeBuilder()
-            self._working_contents.clear()
+            layout = self._new_layout
         else:
-            self._working_tree = self._repo.TreeBuilder(self._last_saved_tree)
-            self._working_contents = {entry.name for entry in self._get_tree()}
+            layout = layout_of(self._last_saved_tree)
+        self._working_tree = layout.builder(self._repo, self._last_saved_tree)
 
     def _get_tree(self):
-        if self._repo.is_empty:
+        head = self._head()
+        if head is None:
             return None
         elif self._working_tree is None:
-            return self._repo[self._repo.head.target].tree
+            return self._repo[head].tree
         else:
             return self._last_saved_tree
 
     def save_state(self):
-        return self._repo[self._repo.head.target].oid
+        return self._repo[self._head()].id
+
+    def sequence(self):
+        """The up-to-date sequence of commits leading to the current state."""
+        self._sequence.sync(self._head())
+        return self._sequence
+
+    def states(self, count=None):
+        """The last ``count`` states, most recent first."""
+        seq = self.sequence()
+        start = 0 if count is None else max(len(seq) - count, 0)
+        return [seq[i] for i in range(len(seq) - 1, start - 1, -1)]
+
+    def resolve_state(self, as_of):
+        """Turns a state, a number of steps back, or a time into a state."""
+        if isinstance(as_of, datetime.datetime):
+            return self._state_at_time(as_of)
+
+        elif isinstance(as_of, int) and not isinstance(as_of, bool):
+            if as_of < 0:
+                raise ValueError("Cannot step back a negative number of steps")
+            return self.sequence().back(as_of)
+
+        else:
+            return self._current_state(as_of)
+
+    def _current_state(self, state):
+        if isinstance(state, str):
+            try:
+                state = pg2.Oid(hex=state)
+            except ValueError:
+                raise ValueError("Unknown state {s}".format(s=state))
+        return self._replacements.resolve(state)
+
+    def _state_at_time(self, when):
+        # commit times only increase along the sequence, so bisect it
+        timestamp = when.timestamp()
+        seq = self.sequence()
+        lo, hi = 0, len(seq)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._repo[seq[mid]].commit_time <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == 0:
+            raise ValueError("No state exists at {t}".format(t=when))
+        return seq[lo - 1]
+
+    def view(self, state=None):
+        if state is None:
+            state = self.save_state()
+        return TreeView(self._repo, self._current_state(state))
 
     def revert_to_state(self, state, doc=None):
-        self._repo.reset(state, pg2.GIT_RESET_SOFT)
+        self._move_head(self._current_state(state))
+
+    def retired_states(self):
+        return self._replacements.retired()
+
+    def object_stats(self):
+        return maintenance.object_stats(self._repo)
+
+    def maintain(self, prune_grace=maintenance.DEFAULT_PRUNE_GRACE):
+        return maintenance.maintain(self._repo, prune_grace,
+                                    retired=self.retired_states())
+
+    def compact(self, keep_last=None, keep_since=None, keep_every=None):
+        """Rewrites old history into fewer commits.
+
+        The states to keep are chosen by
+        :py:func:`~.history.retained_positions`.  Kept states keep their
+        trees, messages and times, so the current tree is unchanged, but they
+        get new commit ids.  The old ids are recorded, so that markers for
+        kept states keep working.
+
+        Returns:
+            dict[Oid: Oid]: The new id of every rewritten state, with None
+            for the states that were dropped
+        """
+        if self._working_tree is not None:
+            raise ValueError("Cannot compact history with unsaved changes")
+
+        seq = self.sequence()
+        commits = [self._repo[seq[i]] for i in range(len(seq))]
+        keep = retained_positions([c.commit_time for c in commits],
+                                  keep_last, keep_since, keep_every)
+        if len(keep) == len(commits):
+            return {}
+
+        mapping = {}
+        parents = []
+        for i, cmt in enumerate(commits):
+            if i not in keep:
+                mapping[cmt.id] = None
+                continue
+
+            new_id = self._repo.create_commit(
+                None, cmt.author, cmt.committer, cmt.message,
+                cmt.tree_id, parents)
+            if new_id != cmt.id:  # unchanged up to the first dropped state
+                mapping[cmt.id] = new_id
+            parents = [new_id]
+
+        self._replacements.add(mapping)
+        self._sequence.rebuild(parents[0])
+        self._move_head(parents[0])
+        return mapping
+
+    @property
+    def layout(self):
+        """The name of the layout of the current tree."""
+        return layout_of(self._get_tree()).name
+
+    def migrate_layout(self, layout):
+        """Rewrites the current tree into a different layout.
+
+        The rewritten tree is saved as a new state.  Earlier states keep
+        their old layout, and can still be read.
+
+        Returns:
+            bool: Whether the layout changed
+        """
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown layout " + str(layout))
+        elif self._working_tree is not None:
+            raise ValueError("Cannot migrate a tree with unsaved changes")
+        elif self.layout == layout:
+            return False
+
+        tree = self._get_tree()
+        builder = LAYOUTS[layout].builder(self._repo)
+        for name, blob_id in layout_of(tree).entries(tree):
+            builder.insert(name, blob_id, pg2.GIT_FILEMODE_BLOB)
+
+        self._working_tree = builder
+        self._last_saved_tree = tree
+        self.save("Migrate to {l} layout".format(l=layout))
+        return True
 
     def revert_steps(self, steps, doc=None):
         if doc is not None:
             return self._revert_steps_doc(steps, doc)
 
-        last = self._repo[self._repo.head.target]
-        for i, cmt in enumerate(self._repo.walk(last.id, pg2.GIT_SORT_TIME)):
-            if i == steps:
-                self._repo.reset(cmt.oid, pg2.GIT_RESET_SOFT)
-                break
-        else:
-            self._repo.reset(cmt.oid, pg2.GIT_RESET_SOFT)
+        self.revert_to_state(self.sequence().back(steps))
+        return steps
+
+    def history(self, name):
+        """Every (state, blob id) version of ``name``, most recent first.
+
+        Versions where the item was deleted have a blob id of None.
+        """
+        seq = self.sequence()
+        self._changes.update(seq)
+        for position, blob_id, _ in reversed(self._changes.changes(name)):
+            yield seq[position], blob_id
+
+    def diff(self, since, until=None):
+        """Every (name, old blob id, new blob id) change between two states.
+
+        Added items have an old blob id of None, and deleted items have a new
+        blob id of None.
+        """
+        return diff_trees(self.view(since)._tree, self.view(until)._tree)
+
+    def _undoable(self, doc):
+        """The versions of ``doc`` that it can still be reverted to."""
+        self._changes.update(self.sequence())
+        pending = self._pending_undos.get(doc, 0)
+        versions = self._changes.versions(doc)
+        return versions[:max(len(versions) - pending, 0)]
+
+    def reverted_version(self, steps, doc):
+        versions = self._undoable(doc)
+        if 0 < steps < len(versions):
+            return versions[-1 - steps][1]
+        return None
 
     def _revert_steps_doc(self, steps, doc):
-        pass
+        if steps <= 0:
+            return
+
+        pending = self._pending_undos.get(doc, 0)
+        versions = self._undoable(doc)
+        undo = min(steps, len(versions))
+        if not undo:
+            return 0
+
+        if undo < len(versions):
+            self._set_blob(doc, versions[-1 - undo][1])
+        elif doc in self:
+            del self[doc]
+
+        self._pending_undos[doc] = pending + undo
+        return undo
+
+
+class TreeView:
+    """A read-only view of the tree stored at a particular commit.
+
+    Unlike :py:class:`TreeWrapper`, this never moves with the branch head, so
+    it can be read from while other writers commit to the same repository.
+    """
+
+    def __init__(self, repo, state):
+        self._repo = repo
+        try:
+            commit = repo[state]
+        except (KeyError, ValueError, TypeError):
+            raise ValueError("Unknown state {s}".format(s=state))
+
+        if not isinstance(commit, pg2.Commit):
+            raise ValueError("State {s} is not a commit".format(s=state))
+
+        self.state = commit.id
+        self._tree = commit.tree
+        self._layout = layout_of(self._tree)
+
+    def __getitem__(self, name):
+        return self._repo[self.blob_id(name)].data.decode('utf-8')
+
+    def get_bytes(self, name):
+        return memoryview(self._repo[self.blob_id(name)])
+
+    def __contains__(self, name):
+        return self._layout.contains(self._tree, name)
+
+    def __len__(self):
+        return len(self.items_list())
+
+    def __iter__(self):
+        return iter(self.items_list())
+
+    def blob_id(self, name):
+        try:
+            return self._layout.entry(self._tree, name).id
+        except KeyError:
+            raise KeyError('{name} not in tree'.format(name=name))
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def items_list(self):
+        return [name for name, _ in self._layout.entries(self._tree)]
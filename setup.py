@@ -81,15 +81,17 @@ setup(
         'License :: OSI Approved :: MIT License',
 
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
 
         'Topic :: Database'
     ],
 
     keywords='git database',
     packages=['ogitm'],
+    python_requires='>=3.7',  # as pygit2 1.7 needs
     install_requires=list(open('requirements.txt')),
     extras_require={
         'dev': list(open('dev-requirements.txt')),
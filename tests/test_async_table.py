@@ -0,0 +1,121 @@
+import asyncio
+import threading
+
+from ogitm import gitdb
+import pytest
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+class TestAsyncTable:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        return gitdb.GitDB(str(tmpdir)).table('async')
+
+    def test_insert_and_get(self, table):
+        atable = table.as_async()
+        assert atable is table.as_async()
+
+        async def go():
+            doc_id = await atable.insert({'one': 'two'})
+            return doc_id, await atable.get(doc_id)
+
+        doc_id, doc = run(go())
+        assert doc == {'one': 'two'}
+        assert table.get(doc_id) == {'one': 'two'}
+
+    def test_concurrent_writes_share_commit(self, table):
+        atable = table.as_async()
+        before = table.save_state()
+
+        async def go():
+            return await asyncio.gather(
+                *[atable.insert({'n': i}) for i in range(10)])
+
+        ids = run(go())
+        assert len(set(ids)) == 10
+        assert len(table.find({'n': {'exists': True}})) == 10
+
+        head = table.data_repo[table.save_state()]
+        assert head.parents[0].id == before
+
+    def test_failed_write_does_not_affect_batch(self, table):
+        atable = table.as_async()
+
+        async def go():
+            return await asyncio.gather(
+                atable.insert({'a': 1}),
+                atable.update(-1, {'a': 2}),
+                return_exceptions=True)
+
+        doc_id, error = run(go())
+        assert isinstance(error, ValueError)
+        assert table.get(doc_id) == {'a': 1}
+
+    def test_upsert(self, table):
+        atable = table.as_async()
+
+        async def go():
+            first = await atable.upsert({'a': 1}, {'b': 1})
+            return first, await atable.upsert({'a': 1}, {'b': 2})
+
+        assert run(go()) == (0, 0)
+        assert table.get(0) == {'a': 1, 'b': 2}
+
+    def test_find(self, table):
+        table.insert({'a': 1})
+        table.insert({'a': 2})
+        atable = table.as_async()
+
+        assert run(atable.find_ids({'a': 2})) == [1]
+        assert run(atable.find_items({'a': {'exists': True}})) == \
+            [{'a': 1}, {'a': 2}]
+        assert run(atable.find_one({'a': 3})) is None
+
+    def test_reads_see_open_transaction(self, table):
+        atable = table.as_async()
+        old_id = table.insert({'a': 1})
+
+        with table.transaction():
+            new_id = table.insert({'a': 2})
+            assert run(atable.get(new_id)) == {'a': 2}
+            assert run(atable.find_ids({'a': 2})) == [new_id]
+            assert run(atable.find_ids({'a': 2}, as_of=0)) == []
+        assert run(atable.get(old_id)) == {'a': 1}
+
+    def test_writes_do_not_join_open_transaction(self, table):
+        atable = table.as_async()
+        table.begin_transaction()
+        with pytest.raises(ValueError):
+            run(atable.insert({'a': 1}))
+        table.rollback()
+
+        doc_id = run(atable.insert({'a': 2}))
+        assert table.get(doc_id) == {'a': 2}
+
+    def test_direct_writes_during_batches(self, table):
+        atable = table.as_async()
+        direct_ids = []
+
+        def write_directly():
+            for i in range(100):
+                direct_ids.append(table.insert({'direct': i}))
+
+        async def go():
+            ids = []
+            for i in range(20):
+                ids += await asyncio.gather(
+                    *[atable.insert({'batch': i}) for _ in range(5)])
+            return ids
+
+        thread = threading.Thread(target=write_directly)
+        thread.start()
+        batch_ids = run(go())
+        thread.join()
+
+        ids = batch_ids + direct_ids
+        assert len(set(ids)) == 200
+        assert all(table.get(doc_id) is not None for doc_id in ids)
@@ -0,0 +1,157 @@
+import datetime
+import time
+
+from ogitm.gitdb import backends, journal, memory, treewrapper
+import pygit2
+import pytest
+
+
+class TestStorageBackends:
+
+    @pytest.fixture(params=['disk', 'memory', 'dict', 'journal', 'fanout'])
+    def backend(self, request, tmpdir):
+        if request.param == 'dict':
+            return backends.DictBackend()
+        elif request.param == 'memory':
+            return treewrapper.TreeWrapper(memory.memory_repository())
+        git = pygit2.init_repository(str(tmpdir), bare=True)
+        if request.param == 'fanout':
+            return treewrapper.TreeWrapper(git, layout='fanout')
+        tree = treewrapper.TreeWrapper(git)
+        if request.param == 'journal':
+            return journal.JournaledBackend.for_backend(tree)
+        return tree
+
+    def test_is_backend(self, backend):
+        assert isinstance(backend, backends.StorageBackend)
+        with pytest.raises(TypeError):
+            backends.StorageBackend()
+
+    def test_items(self, backend):
+        backend['one'] = 'two'
+        assert backend['one'] == 'two'
+        assert 'one' in backend
+        backend.save()
+
+        del backend['one']
+        assert 'one' not in backend
+        assert backend.get('one') is None
+        with pytest.raises(KeyError):
+            backend['one']
+
+        backend.rollback()
+        assert backend['one'] == 'two'
+        assert backend.items_list() == ['one']
+
+        backend.clear()
+        assert backend.items_list() == []
+
+    def test_states(self, backend):
+        first = backend.save_state()
+        backend['item'] = 'one'
+        backend.save()
+        second = backend.save_state()
+        backend['item'] = 'two'
+        backend.save()
+
+        assert backend.states() == [backend.save_state(), second, first]
+        assert backend.states(1) == [backend.save_state()]
+        assert backend.resolve_state(1) == second
+        assert backend.resolve_state(100) == first
+        assert backend.resolve_state(datetime.datetime.max) == \
+            backend.save_state()
+
+        assert backend.view(second)['item'] == 'one'
+        assert backend.view(second).state == second
+        assert 'item' not in backend.view(first)
+        assert list(backend.diff(first, second)) == \
+            [('item', None, backend.view(second).blob_id('item'))]
+
+        backend.revert_to_state(second)
+        assert backend['item'] == 'one'
+        backend.revert_steps(1)
+        assert 'item' not in backend
+
+    def test_item_history(self, backend):
+        # journaled saves are only separate states if folded separately
+        backend['item'] = 'one'
+        backend.save()
+        backend.fold()
+        backend['item'] = 'two'
+        backend['other'] = 'three'
+        backend.save()
+        backend.fold()
+
+        assert backend.revert_steps(1, doc='item') == 1
+        backend.save()
+        assert backend['item'] == 'one'
+        assert backend['other'] == 'three'
+        assert [backend.read_blob(b) for s, b in backend.history('item')] == \
+            ['one', 'two', 'one']
+        assert backend.revert_steps(5, doc='item') == 1
+        assert 'item' not in backend
+
+    def test_compact(self, backend):
+        states = []
+        for i in range(5):
+            backend['item'] = str(i)
+            backend.save()
+            states.append(backend.save_state())
+
+        mapping = backend.compact(keep_last=2)
+        assert len([s for s in mapping.values() if s is None]) == 3
+        assert len(backend.states()) == 3
+        assert backend['item'] == '4'
+        assert backend.view(states[3])['item'] == '3'
+        with pytest.raises(ValueError):
+            backend.view(states[1])
+
+
+def next_second():
+    """Sleeps until just after the next whole second (which is as precise
+    as git commit times are), and returns the time then."""
+    time.sleep(1.01 - time.time() % 1)
+    return datetime.datetime.now()
+
+
+class TestCommitTimes:
+
+    @pytest.fixture(params=['disk', 'memory'])
+    def backend(self, request, tmpdir):
+        if request.param == 'memory':
+            return treewrapper.TreeWrapper(memory.memory_repository())
+        git = pygit2.init_repository(str(tmpdir), bare=True)
+        return treewrapper.TreeWrapper(git)
+
+    def save(self, backend, value):
+        backend['item'] = value
+        backend.save()
+        return backend.save_state()
+
+    def test_states_at_times(self, backend):
+        first = self.save(backend, 'one')
+        between = next_second()
+        next_second()
+        second = self.save(backend, 'two')
+
+        assert backend.resolve_state(between) == first
+        assert backend.view(backend.resolve_state(between))['item'] == \
+            'one'
+        assert backend.resolve_state(datetime.datetime.now()) == second
+
+    def test_compact_by_time(self, backend):
+        states = [self.save(backend, 'one'), self.save(backend, 'two')]
+        between = next_second()
+        next_second()
+        states += [self.save(backend, 'three'), self.save(backend, 'four')]
+
+        # the last state of each second is kept before the window
+        mapping = backend.compact(keep_every=datetime.timedelta(seconds=1))
+        assert mapping[states[0]] is None
+        assert backend.view(states[1])['item'] == 'two'
+
+        backend.compact(keep_since=between)
+        with pytest.raises(ValueError):
+            backend.view(states[1])
+        assert backend.view(states[2])['item'] == 'three'
+        assert backend['item'] == 'four'
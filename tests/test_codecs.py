@@ -0,0 +1,97 @@
+import os
+
+from ogitm import gitdb
+from ogitm.gitdb import codecs, journal
+import pytest
+
+
+class TestCodecs:
+
+    @pytest.fixture(params=codecs.available_codecs())
+    def codec(self, request):
+        return codecs.get_codec(request.param)
+
+    def test_round_trip(self, codec):
+        value = {'a': [1, 2.5, None, True], 'b': {'c': 'dé'}}
+        data = codec.encode(value)
+        assert codec.decode(data) == value
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        assert codec.decode(data) == value
+        assert codec.decode(memoryview(data)) == value
+
+    def test_json_formats_agree(self):
+        value = {'a': [1, 'two', None]}
+        fast = codecs.get_codec('fastjson').encode(value)
+        assert codecs.get_codec('json').decode(fast) == value
+
+    def test_unknown_codecs(self):
+        assert 'json' in codecs.available_codecs()
+        with pytest.raises(ValueError):
+            codecs.get_codec('pickle')
+        if not codecs.CODECS['msgpack'].available:
+            with pytest.raises(ValueError):
+                codecs.get_codec('msgpack')
+
+
+class TestTableCodecs:
+
+    @pytest.fixture(params=['disk', 'dict', 'journal'])
+    def storage(self, request):
+        return request.param
+
+    def open_table(self, tmpdir, storage, codec=None):
+        if storage == 'dict':
+            return gitdb.Table('coded', storage='dict', codec=codec)
+        return gitdb.Table('coded', str(tmpdir), journal=storage == 'journal',
+                           codec=codec)
+
+    def test_documents(self, tmpdir, storage):
+        table = self.open_table(tmpdir, storage, 'marshal')
+        assert table.codec == 'marshal'
+
+        doc = table.insert({'name': 'bob', 'age': 12})
+        state = table.save_state()
+        table.update(doc, {'name': 'bob', 'age': 13})
+        assert table.get(doc) == {'name': 'bob', 'age': 13}
+        assert table.find_ids({'age': {'gt': 12}}) == [doc]
+        assert table.get(doc, as_of=state) == {'name': 'bob', 'age': 12}
+        assert [d['age'] for _, d in table.history(doc)] == [13, 12]
+
+    def test_codec_is_recorded(self, tmpdir):
+        table = self.open_table(tmpdir, 'disk', 'marshal')
+        table.insert({'a': 1})
+        assert table.meta_tree['meta-codec'] == 'marshal'
+
+        reopened = self.open_table(tmpdir, 'disk', 'json')
+        assert reopened.codec == 'marshal'
+        assert reopened.get(0) == {'a': 1}
+
+    def test_existing_tables_are_json(self, tmpdir):
+        table = self.open_table(tmpdir, 'disk')
+        table.insert({'a': 1})
+        del table.meta_tree['meta-codec']
+        table.meta_tree.save()
+
+        reopened = self.open_table(tmpdir, 'disk', 'marshal')
+        assert reopened.codec == 'json'
+        assert reopened.get(0) == {'a': 1}
+
+    def test_unavailable_codec(self, tmpdir):
+        with pytest.raises(ValueError):
+            self.open_table(tmpdir, 'disk', 'pickle')
+
+    def test_journal_replays_binary_items(self, tmpdir):
+        table = self.open_table(tmpdir, 'journal', 'marshal')
+        table.insert({'a': 1})
+        path = os.path.join(table.data_repo.path, journal.JOURNAL_FILE)
+        assert os.path.getsize(path) > 0
+
+        reopened = self.open_table(tmpdir, 'journal')
+        assert reopened.get(0) == {'a': 1}
+
+    def test_gitdb(self, tmpdir):
+        db = gitdb.GitDB(str(tmpdir), codec='fastjson')
+        db.table('t').insert({'a': 1})
+        assert db.table('t').codec == 'fastjson'
+        assert gitdb.GitDB(str(tmpdir)).table('t').get(0) == {'a': 1}
@@ -1,3 +1,5 @@
+import datetime
+
 from ogitm import gitdb
 import pytest
 
@@ -32,6 +34,22 @@ class TestGitDB:
         with pytest.raises(ValueError):
             gdb.update(-1, {'one': 'three'})  # -1 shouldn't exist
 
+    def test_delete(self, gdb):
+        doc_id = gdb.insert({'one': 'two'})
+        other_id = gdb.insert({'one': 'two'})
+        gdb.delete(doc_id)
+
+        with pytest.raises(ValueError):
+            gdb.get(doc_id)
+        assert gdb.find_ids({'one': 'two'}) == [other_id]
+        assert gdb.data_tree['index-one'] == {'"two"': [other_id]}
+
+        gdb.delete(other_id)
+        assert gdb.data_tree['index-one'] == {}
+
+        with pytest.raises(ValueError):
+            gdb.delete(doc_id)
+
     def test_multiple_inserts(self, gdb):
         doc1 = gdb.insert({'one': 'two'})
         doc2 = gdb.insert({'three': 'four'})
@@ -258,7 +276,93 @@ class TestGitDB:
         gdb.revert_to_state(state_two)
         assert len(gdb.find({'test': {'exists': True}})) == 2
 
-    @pytest.mark.xfail
+    def test_list_states(self, gdb):
+        gdb.insert({'test': 1})
+        gdb.insert({'test': 2})
+        states = gdb.list_states()
+        assert states[0] == gdb.save_state()
+        assert gdb.list_states(2) == states[:2]
+
+        gdb.revert_steps(1)
+        assert gdb.list_states() == states[1:]
+
+    def test_changes(self, gdb):
+        start = gdb.save_state()
+        id_1 = gdb.insert({'test': 1})
+        id_2 = gdb.insert({'test': 2})
+        middle = gdb.save_state()
+        gdb.update(id_1, {'test': 3})
+        gdb.revert_steps(1, id_2)
+
+        changes = sorted(gdb.changes(start, middle))
+        assert changes == [('insert', id_1, None, {'test': 1}),
+                           ('insert', id_2, None, {'test': 2})]
+
+        changes = sorted(gdb.changes(middle))
+        assert changes == [('delete', id_2, {'test': 2}, None),
+                           ('update', id_1, {'test': 1}, {'test': 3})]
+
+        assert list(gdb.changes(middle, middle)) == []
+
+    def test_watch(self, gdb):
+        gdb.insert({'test': 1})
+        watcher = gdb.watch(poll_interval=0.01)
+        id_2 = gdb.insert({'test': 2})
+        assert next(watcher) == ('insert', id_2, None, {'test': 2})
+
+        gdb.update(id_2, {'test': 3})
+        assert next(watcher) == ('update', id_2, {'test': 2}, {'test': 3})
+
+    def test_snapshot(self, gdb):
+        id_1 = gdb.insert({'test': 1})
+        state = gdb.save_state()
+        snap = gdb.snapshot()
+        assert snap.state == state
+
+        gdb.update(id_1, {'test': 2})
+        id_2 = gdb.insert({'test': 3})
+
+        assert snap.get(id_1) == {'test': 1}
+        with pytest.raises(ValueError):
+            snap.get(id_2)
+        assert snap.find({'test': {'exists': True}}) == [(id_1, {'test': 1})]
+        assert list(snap) == [(id_1, {'test': 1})]
+
+        # documents handed out are copies of the cached value
+        snap.get(id_1)['test'] = 5
+        assert gdb.snapshot(state).get(id_1) == {'test': 1}
+
+        assert gdb.save_state() != state
+        assert list(gdb.snapshot()) == [(id_1, {'test': 2}),
+                                        (id_2, {'test': 3})]
+
+        with pytest.raises(ValueError):
+            gdb.snapshot('0' * 40)
+
+    def test_as_of(self, gdb):
+        id_1 = gdb.insert({'test': 1})
+        state = gdb.save_state()
+        gdb.update(id_1, {'test': 2})
+        gdb.insert({'test': 3})
+
+        assert gdb.get(id_1, as_of=state) == {'test': 1}
+        assert gdb.get(id_1, as_of=2) == {'test': 1}
+        assert gdb.get(id_1, as_of=0) == {'test': 2}
+        assert gdb.find_ids({'test': 1}, as_of=state) == [id_1]
+        assert gdb.find_items({'test': 1}) == []
+        assert gdb.find_one({'test': 3}, as_of=1) is None
+        assert len(gdb.find({'test': {'exists': True}}, as_of=1000)) == 0
+
+        now = datetime.datetime.now() + datetime.timedelta(seconds=5)
+        assert len(gdb.find({'test': {'exists': True}}, as_of=now)) == 2
+        with pytest.raises(ValueError):
+            gdb.find({}, as_of=datetime.datetime(1970, 1, 2))
+        with pytest.raises(ValueError):
+            gdb.find({}, as_of=-1)
+
+        # querying the past doesn't move the current state
+        assert gdb.get(id_1) == {'test': 2}
+
     def test_revert_steps_document(self, gdb):
         id_1 = gdb.insert({'test': 1})
         id_2 = gdb.insert({'test': 2})
@@ -270,44 +374,202 @@ class TestGitDB:
         assert len(gdb.find({'test': {'exists': True}})) == 1
         assert len(gdb.find({'test': 2})) == 1  # hasn't affected id_2
         assert len(gdb.find({'test': 1})) == 0  # removed id_1
+        with pytest.raises(ValueError):
+            gdb.get(id_1)
 
-        gdb.insert(id_1, {'test': 3})
-        gdb.update(id_1, {'test': 4})
+        id_3 = gdb.insert({'test': 3})
+        gdb.update(id_3, {'test': 4})
 
         gdb.update(id_2, {'test': 5})
         gdb.update(id_2, {'test': 6})
         gdb.update(id_2, {'test': 7})
         gdb.update(id_2, {'test': 8})
 
-        gdb.update(id_1, {'test': 9})
+        gdb.update(id_3, {'test': 9})
 
-        gdb.revert_steps(1, id_1)
-        assert gdb.get(id_1) == {'test': 4}
+        gdb.revert_steps(1, id_3)
+        assert gdb.get(id_3) == {'test': 4}
         assert gdb.get(id_2) == {'test': 8}
 
-        gdb.revert_steps(1, id_1)
-        assert gdb.get(id_1) == {'test': 3}
+        gdb.revert_steps(1, id_3)
+        assert gdb.get(id_3) == {'test': 3}
         assert gdb.get(id_2) == {'test': 8}
+        assert gdb.find_ids({'test': 3}) == [id_3]
+        assert gdb.find_ids({'test': 9}) == []
 
         gdb.revert_steps(3, id_2)
-        assert gdb.get(id_1) == {'test': 3}
+        assert gdb.get(id_3) == {'test': 3}
         assert gdb.get(id_2) == {'test': 5}
 
         gdb.revert_steps(1, id_2)
-        assert gdb.get(id_1) == {'test': 3}
+        assert gdb.get(id_3) == {'test': 3}
         assert gdb.get(id_2) == {'test': 2}
 
         gdb.revert_steps(1, id_2)  # un-create id_2
-        assert gdb.get(id_1) == {'test': 3}
+        assert gdb.get(id_3) == {'test': 3}
         with pytest.raises(ValueError):
             gdb.get(id_2)
+        assert gdb.find_ids({'test': {'exists': True}}) == [id_3]
+
+    def test_revert_steps_document_in_transaction(self, gdb):
+        doc = gdb.insert({'test': 1})
+        for i in range(2, 5):
+            gdb.update(doc, {'test': i})
+
+        with gdb.transaction():
+            gdb.revert_steps(1, doc)
+            gdb.revert_steps(1, doc)
+        assert gdb.get(doc) == {'test': 2}
+
+        gdb.revert_steps(1, doc)
+        assert gdb.get(doc) == {'test': 1}
+
+    def test_history(self, gdb):
+        doc = gdb.insert({'test': 1})
+        first = gdb.save_state()
+        gdb.insert({'other': 1})
+        gdb.update(doc, {'test': 2})
+        gdb.revert_steps(1, doc)
+
+        history = list(gdb.history(doc))
+        assert [d for s, d in history] == \
+            [{'test': 1}, {'test': 2}, {'test': 1}]
+        assert history[0][0] == gdb.save_state()
+        assert history[-1][0] == first
+
+        gdb.revert_steps(3)  # back to before the update
+        assert [d for s, d in gdb.history(doc)] == [{'test': 1}]
+
+        gdb.revert_steps(1, doc)
+        assert [d for s, d in gdb.history(doc)] == [None, {'test': 1}]
+
+    def test_compact_history(self, gdb):
+        first = gdb.save_state()
+        states = []
+        for i in range(10):
+            gdb.insert({'n': i})
+            states.append(gdb.save_state())
+        tree_id = gdb.data_tree.view()._tree.id
+
+        assert gdb.compact_history(keep_last=3, keep_every=4) == 6
+        assert len(gdb.list_states()) == 5
+        assert gdb.data_tree.view()._tree.id == tree_id
+        assert sorted(gdb.find_ids({'n': {'gte': 0}})) == list(range(10))
+
+        # markers for kept states still work, dropped ones don't
+        assert gdb.find_ids({'n': {'gte': 0}}, as_of=first) == []
+        assert gdb.get(3, as_of=states[3]) == {'n': 3}
+        assert gdb.get(8, as_of=states[8]) == {'n': 8}
+        with pytest.raises(ValueError):
+            gdb.get(0, as_of=states[0])
+        with pytest.raises(ValueError):
+            gdb.revert_to_state(states[6])
+
+        gdb.revert_to_state(states[7])
+        assert sorted(gdb.find_ids({'n': {'gte': 0}})) == list(range(8))
+        gdb.revert_to_state(states[9])
+
+        # compacting again composes with the earlier replacements
+        assert gdb.compact_history(keep_last=1) == 3
+        assert gdb.get(9, as_of=states[9]) == {'n': 9}
+        assert gdb.find_ids({'n': {'gte': 0}}, as_of=first) == []
+        with pytest.raises(ValueError):
+            gdb.revert_to_state(states[8])
+
+    def test_compact_history_since(self, gdb):
+        gdb.insert({'n': 1})
+        old = gdb.save_state()
+        gdb.insert({'n': 2})
+        gdb.insert({'n': 3})
+        assert gdb.compact_history(keep_since=datetime.datetime.max) == 2
+        assert gdb.compact_history() == 0
+
+        with pytest.raises(ValueError):
+            gdb.get(1, as_of=old)
+
+    def test_compact_history_in_transaction(self, gdb):
+        gdb.begin_transaction()
+        gdb.insert({'n': 1})
+        with pytest.raises(ValueError):
+            gdb.compact_history(keep_last=1)
+        gdb.commit()
+
+
+class TestInProcessStorage:
+
+    @pytest.fixture(params=['memory', 'dict'])
+    def gdb(self, request):
+        return gitdb.GitDB(storage=request.param)
+
+    def test_instantiation(self, tmpdir):
+        with pytest.raises(ValueError):
+            gitdb.GitDB()
+        with pytest.raises(ValueError):
+            gitdb.GitDB(str(tmpdir), storage='cloud')
+
+        gitdb.GitDB(str(tmpdir), storage='memory')
+        assert tmpdir.listdir() == []
+
+    def test_insert_and_find(self, gdb):
+        doc_id = gdb.insert({'one': 'two'})
+        assert gdb.get(doc_id) == {'one': 'two'}
+        gdb.update(doc_id, {'one': 'three'})
+        assert gdb.find({'one': 'three'}) == [(doc_id, {'one': 'three'})]
+        assert gdb.find({'one': 'two'}) == []
+
+    def test_tables(self, gdb):
+        table = gdb.table('test-table')
+        doc_id = table.insert({'one': 'two'})
+        assert gdb['test-table'] is table
+        assert gdb['test-table'].get(doc_id) == {'one': 'two'}
+        assert table != gitdb.GitDB(storage=gdb.storage).table('test-table')
+
+        gdb.drop('test-table')
+        assert gdb['test-table'].find({'one': 'two'}) == []
+
+    def test_transaction(self, gdb):
+        with gdb.transaction():
+            gdb.insert({'one': 'two'})
+        assert len(gdb.list_states()) == 2
+
+        gdb.begin_transaction()
+        gdb.insert({'three': 'four'})
+        gdb.rollback()
+        assert gdb.find({'three': 'four'}) == []
+
+    def test_revert(self, gdb):
+        doc_id = gdb.insert({'one': 'two'})
+        state = gdb.save_state()
+        gdb.update(doc_id, {'one': 'three'})
+        gdb.insert({'five': 'six'})
+
+        gdb.revert_steps(1)
+        assert gdb.find({'five': 'six'}) == []
+        gdb.revert_to_state(state)
+        assert gdb.get(doc_id) == {'one': 'two'}
+        assert [d for s, d in gdb.history(doc_id)] == [{'one': 'two'}]
+        assert gdb.get(doc_id, as_of=0) == {'one': 'two'}
+
+    def test_snapshot_and_changes(self, gdb):
+        state = gdb.save_state()
+        doc_id = gdb.insert({'one': 'two'})
+        snapshot = gdb.snapshot()
+        gdb.update(doc_id, {'one': 'three'})
+
+        assert snapshot.get(doc_id) == {'one': 'two'}
+        assert snapshot.find_ids({'one': 'two'}) == [doc_id]
+        assert list(gdb.changes(state)) == \
+            [('insert', doc_id, None, {'one': 'three'})]
+
+        assert gdb.compact_history(keep_last=1) == 1
+        assert gdb.maintain()['data']['pruned'] == 0
 
 
 class TestSearchFunctions:
 
-    @pytest.fixture
-    def gdb(self, tmpdir):
-        g = gitdb.GitDB(str(tmpdir))
+    @pytest.fixture(params=['disk', 'memory', 'dict'])
+    def gdb(self, request, tmpdir):
+        g = gitdb.GitDB(str(tmpdir), storage=request.param)
         g.insert({'int': -42})
         g.insert({'int': 1})
         g.insert({'int': 12})
@@ -345,6 +607,57 @@ class TestSearchFunctions:
         assert len(gdb.find_items({'bool': {'eq': False}})) == 1
         assert len(gdb.find_items({'bool': {'gt': 'hello'}})) == 0
 
+    def test_set_operators(self, gdb):
+        assert sorted(gdb.find_ids({'int': {'in': [1, 123, 7]}})) == [1, 3]
+        assert gdb.find_ids({'int': {'in': []}}) == []
+        assert len(gdb.find_ids({'int': {'nin': [1, 123]}})) == 7
+        assert len(gdb.find_ids({'int': {'ne': 1}})) == 8
+        assert len(gdb.find_ids({'str': {'ne': 'hello', 'exists': True}})) \
+            == 2
+
+        with pytest.raises(ValueError):
+            gdb.find({'int': {'in': 1}})
+
+    def test_between(self, gdb):
+        assert sorted(gdb.find_ids({'int': {'between': [0, 12]}})) == [1, 2]
+        assert sorted(gdb.find_ids({'int': {'between': [1, 1]}})) == [1]
+        assert gdb.find_ids({'int': {'between': [12, 0]}}) == []
+        assert len(gdb.find_ids({'str': {'between': ['a', 'h']}})) == 2
+        assert len(gdb.find_ids({'int': {'between': [None, 12]}})) == 3
+        assert gdb.find_ids({'int': {'between': [[1], [2]]}}) == []
+        assert sorted(gdb.find_ids({'int': {'between': [None, None]}})) == \
+            [0, 1, 2, 3]
+        assert len(gdb.find_ids({'str': {'between': (None, None)}})) == 3
+        assert gdb.find_ids({'int': {'between': [None, [2]]}}) == []
+
+        with pytest.raises(ValueError):
+            gdb.find({'int': {'between': 5}})
+
+    def test_boolean_nodes(self, gdb):
+        def ids(where):
+            return sorted(gdb.find_ids(where))
+
+        assert ids({'$or': [{'int': 1}, {'str': 'hello'}]}) == [1, 4]
+        assert ids({'$or': [{'int': 1}, {'int': {'gt': 100}}],
+                    'int': {'lt': 50}}) == [1]
+        assert ids({'$and': [{'int': {'gt': 0}}, {'int': {'lt': 50}}]}) == \
+            [1, 2]
+        assert ids({'$not': {'int': {'exists': True}}, 'bool': True}) == \
+            [7, 8]
+        assert ids({'$not': {'$or': [{'int': {'exists': True}},
+                                     {'str': {'exists': True}}]}}) == [6, 7]
+        assert ids({'$or': [{'int': 1}, {}]}) == list(range(9))
+        assert ids({'$or': []}) == []
+        assert ids({'$not': {}}) == []
+        assert ids({'$and': []}) == list(range(9))
+
+        with pytest.raises(ValueError):
+            gdb.find({'$or': {'int': 1}})
+        with pytest.raises(ValueError):
+            gdb.find({'$not': [{'int': 1}]})
+        with pytest.raises(KeyError):
+            gdb.find({'$or': [{'int': 1}, {'int': {'no such search': 1}}]})
+
     def test_string_funcs(self, gdb):
         assert gdb.find_items({'str': {'endswith': 'ye'}}) == \
             [{'str': 'goodbye'}]
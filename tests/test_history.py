@@ -0,0 +1,113 @@
+import os
+
+from ogitm.gitdb import history, treewrapper
+import pygit2
+import pytest
+
+
+class TestChangePoints:
+
+    @pytest.fixture
+    def gittree(self, tmpdir):
+        git = pygit2.init_repository(str(tmpdir), bare=True)
+        return treewrapper.TreeWrapper(git)
+
+    def test_changes_are_recorded(self, gittree):
+        gittree['a'] = 'one'
+        gittree['b'] = 'one'
+        gittree.save()
+        gittree['a'] = 'two'
+        gittree.save()
+        del gittree['a']
+        gittree.save()
+
+        points = history.ChangePoints(gittree._repo)
+        points.update(gittree.sequence())
+        assert [p[0] for p in points.changes('a')] == [1, 2, 3]
+        assert points.changes('a')[-1][1] is None
+        assert [p[0] for p in points.changes('b')] == [1]
+        assert points.changes('c') == []
+
+    def test_truncated_sequence(self, gittree):
+        points = history.ChangePoints(gittree._repo)
+        gittree['a'] = 'one'
+        gittree.save()
+        gittree['a'] = 'two'
+        gittree.save()
+        points.update(gittree.sequence())
+        assert len(points.changes('a')) == 2
+
+        gittree.revert_steps(1)
+        gittree['a'] = 'three'
+        gittree.save()
+        points.update(gittree.sequence())
+        blobs = [gittree.read_blob(p[1]) for p in points.changes('a')]
+        assert blobs == ['one', 'three']
+
+    def test_undo_versions(self, gittree):
+        points = history.ChangePoints(gittree._repo)
+        for text in ['one', 'two', 'three']:
+            gittree['a'] = text
+            gittree.save()
+
+        assert gittree.revert_steps(2, doc='a') == 2
+        gittree.save('revert a')
+        assert gittree['a'] == 'one'
+        assert gittree.revert_steps(5, doc='a') == 1
+        gittree.save('revert a')
+        assert 'a' not in gittree
+        assert gittree.revert_steps(1, doc='a') == 0
+
+        points.update(gittree.sequence())
+        assert points.versions('a') == []
+        assert [p[2] for p in points.changes('a')] == [0, 0, 0, 2, 1]
+
+    def test_stored_with_repository(self, gittree, monkeypatch):
+        for text in ['one', 'two', 'three']:
+            gittree['a'] = text
+            gittree.save()
+        gittree.revert_steps(1, doc='a')
+        gittree.save('revert a')
+
+        points = history.ChangePoints.for_repo(gittree._repo)
+        points.update(gittree.sequence())
+        expected = points.changes('a')
+
+        def record(position, sequence):
+            raise AssertionError("diffed commit {p}".format(p=position))
+
+        loaded = history.ChangePoints.for_repo(gittree._repo)
+        monkeypatch.setattr(loaded, '_record', record)
+        loaded.update(gittree.sequence())
+        assert loaded.changes('a') == expected
+        assert loaded.versions('a') == points.versions('a')
+
+    def test_stored_points_are_rebuilt(self, gittree):
+        gittree['a'] = 'one'
+        gittree.save()
+        gittree['a'] = 'two'
+        gittree.save()
+        path = os.path.join(gittree._repo.path, history.CHANGES_FILE)
+        points = history.ChangePoints.for_repo(gittree._repo)
+        points.update(gittree.sequence())
+        expected = points.changes('a')
+        size = os.path.getsize(path)
+
+        with open(path, 'r+b') as file:
+            file.truncate(size - 5)
+            file.seek(0, os.SEEK_END)
+            file.write(b'garbage')
+        points = history.ChangePoints.for_repo(gittree._repo)
+        points.update(gittree.sequence())
+        assert points.changes('a') == expected
+        assert os.path.getsize(path) == size
+
+        gittree.revert_steps(1)
+        gittree['a'] = 'three'
+        gittree.save()
+        points.update(gittree.sequence())
+        loaded = history.ChangePoints.for_repo(gittree._repo)
+        loaded.update(gittree.sequence())
+        assert loaded.changes('a') == points.changes('a')
+        blobs = [gittree.read_blob(p[1]) for p in loaded.changes('a')]
+        assert blobs == ['one', 'three']
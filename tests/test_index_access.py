@@ -0,0 +1,141 @@
+import json
+import operator
+
+from ogitm import gitdb
+from ogitm.gitdb import index_access
+from ogitm.gitdb.search_functions import SearchFunction
+import pytest
+
+
+VALUES = [1, 2, 2.5, True, False, 0, -3, 'a', 'ab', 'b', 'B', '', None,
+          [1, 2], {'a': 1}, float('nan'), float('inf'), 10 ** 20]
+
+
+def brute_force(index, test):
+    found = set()
+    for value_key, ids in index.items():
+        try:
+            if test(json.loads(value_key)):
+                found.update(ids)
+        except (TypeError, AttributeError):
+            continue
+    return found
+
+
+class TestIndexAccessor:
+
+    @pytest.fixture
+    def accessor(self):
+        index = {}
+        for i, value in enumerate(VALUES):
+            index.setdefault(json.dumps(value), []).append(i)
+        return index_access.IndexAccessor('key', index)
+
+    @pytest.mark.parametrize('arg', [1, 2, 0, -10, 2.5, True, 'a', 'b', '',
+                                     float('inf'), 10 ** 20])
+    @pytest.mark.parametrize('op', [operator.lt, operator.le, operator.eq,
+                                    operator.ge, operator.gt])
+    def test_range_same_as_comparison(self, accessor, op, arg):
+        bounds = {operator.lt: (None, arg, True, False),
+                  operator.le: (None, arg, True, True),
+                  operator.eq: (arg, arg, True, True),
+                  operator.ge: (arg, None, True, True),
+                  operator.gt: (arg, None, False, True)}
+        expected = brute_force(accessor.index, lambda value: op(value, arg))
+        assert accessor.range(*bounds[op]) == expected
+
+    def test_range_between(self, accessor):
+        assert accessor.range(0, 2) == brute_force(
+            accessor.index, lambda value: 0 <= value <= 2)
+        assert accessor.range('a', 'b', high_inclusive=False) == {7, 8}
+
+    @pytest.mark.parametrize('low, high', [
+        (None, None), (1, 'a'), ([1], None), (None, float('nan'))])
+    def test_unusable_range(self, accessor, low, high):
+        assert accessor.range(low, high) is None
+
+    @pytest.mark.parametrize('prefix', ['', 'a', 'ab', 'abc', 'B', 'c'])
+    def test_prefix(self, accessor, prefix):
+        assert accessor.prefix(prefix) == brute_force(
+            accessor.index, lambda value: value.startswith(prefix))
+
+    def test_lookup(self, accessor):
+        assert accessor.lookup(2) == {1}
+        assert accessor.lookup([1, 2]) == {13}
+        assert accessor.lookup('missing') == set()
+        assert accessor.present() == set(range(len(VALUES)))
+
+
+class TestSearchPlanning:
+
+    @pytest.fixture
+    def table(self):
+        table = gitdb.Table('t', storage='dict')
+        for i in range(20):
+            table.insert({'n': i, 'name': 'item' + str(i), 'even': i % 2 == 0})
+        return table
+
+    @pytest.fixture
+    def calls(self):
+        calls = []
+
+        @SearchFunction.add('test-lookup', needs='lookup')
+        def lookup(key, op, arg, index, query):
+            calls.append(op)
+            return index.lookup(arg)
+
+        @SearchFunction.add('test-scan')
+        def scan(key, op, arg, index, query, all_ids):
+            calls.append(op)
+            return {i for value, ids in index.items()
+                    for i in ids if json.loads(value) == arg}
+
+        yield calls
+        for name in ('test-lookup', 'test-scan'):
+            del SearchFunction.funcs[name]
+            del SearchFunction.capabilities[name]
+
+    def test_unknown_capability(self):
+        with pytest.raises(ValueError):
+            SearchFunction.add('test-bad', needs='teleport')
+
+    def test_cost(self, calls):
+        assert SearchFunction.cost('exists') == 0
+        assert SearchFunction.cost('gt') < SearchFunction.cost('isdigit')
+        assert SearchFunction.cost('test-scan') == \
+            SearchFunction.cost('contains')
+
+    def test_cheapest_first(self, table, calls):
+        where = {'n': {'test-scan': 3}, 'name': {'test-lookup': 'item3'}}
+        assert table.find_ids(where) == [3]
+        assert calls == ['test-lookup', 'test-scan']
+
+    def test_stops_when_empty(self, table, calls):
+        where = {'n': {'test-scan': 3}, 'name': {'test-lookup': 'none'}}
+        assert table.find_ids(where) == []
+        assert calls == ['test-lookup']
+
+    def test_unknown_operator_still_raises(self, table):
+        with pytest.raises(KeyError):
+            table.find({'n': 100, 'name': {'no-such-operator': 1}})
+
+    def test_comparisons(self, table):
+        assert sorted(table.find_ids({'n': {'gte': 5, 'lt': 8}})) == \
+            [5, 6, 7]
+        assert sorted(table.find_ids({'n': {'gt': 17}, 'even': True})) == \
+            [18]
+        assert sorted(table.find_ids({'name': {'startswith': 'item1'}})) == \
+            [1] + list(range(10, 20))
+
+    def test_sorted_values_are_cached(self, tmpdir):
+        table = gitdb.Table('t', str(tmpdir))
+        table.insert({'n': 1})
+        snapshot = table.snapshot()
+        snapshot.find({'n': {'gt': 0}})
+        sorted_values = snapshot._sorted_values(
+            'n', snapshot.data_tree['index-n'])
+        assert table._sorted_values('n', None) is sorted_values
+
+        table.insert({'n': 2})
+        assert table.find_ids({'n': {'gt': 1}}) == [1]
+        assert table._sorted_values('n', None) is not sorted_values
@@ -0,0 +1,385 @@
+from ogitm import gitdb
+import pytest
+
+
+class TestSelectiveIndexing:
+
+    @pytest.fixture(params=['memory', 'dict'])
+    def table(self, request):
+        table = gitdb.Table('t', storage=request.param)
+        table.insert({'name': 'bob', 'notes': 'likes cheese'})
+        table.insert({'name': 'bill', 'notes': 'hates cheese'})
+        table.insert({'name': 'ben'})
+        return table
+
+    def test_dropping_index(self, table):
+        table.create_predicate_index('notes')
+        assert table.is_indexed('notes')
+        table.drop_index('notes')
+        assert not table.is_indexed('notes')
+        assert 'index-notes' not in table.data_tree
+        assert 'props-notes' not in table.data_tree
+
+        table.insert({'name': 'bert', 'notes': 'likes bread'})
+        assert 'index-notes' not in table.data_tree
+        assert table.find_ids({'name': 'bert'}) == [3]
+
+    @pytest.mark.parametrize('where, expected', [
+        ({'notes': 'likes cheese'}, [0]),
+        ({'notes': {'contains': 'cheese'}}, [0, 1]),
+        ({'notes': {'exists': False}}, [2]),
+        ({'notes': {'startswith': 'hates'}, 'name': 'bill'}, [1]),
+        ({'notes': {'isalpha': False}}, [0, 1]),
+        ({'$or': [{'notes': {'regex': '^l'}}, {'name': 'ben'}]}, [0, 2]),
+    ])
+    def test_searching_unindexed(self, table, where, expected):
+        table.drop_index('notes')
+        assert sorted(table.find_ids(where)) == expected
+
+    def test_updates_to_unindexed(self, table):
+        table.drop_index('notes')
+        table.update(0, {'name': 'bob', 'notes': 'likes bread'})
+        assert table.find_ids({'notes': {'contains': 'bread'}}) == [0]
+        assert table.find_ids({'notes': 'likes cheese'}) == []
+
+    def test_recreating_index(self, table):
+        table.drop_index('notes')
+        table.update(0, {'name': 'bob', 'notes': 'likes bread'})
+        table.create_index('notes')
+        assert table.is_indexed('notes')
+        assert table.data_tree['index-notes'] == {
+            '"likes bread"': [0], '"hates cheese"': [1]}
+        assert 'props-notes' not in table.data_tree
+
+        table.insert({'notes': 'likes bread'})
+        assert table.find_ids({'notes': 'likes bread'}) == [0, 3]
+
+    def test_snapshots(self, table):
+        before = table.snapshot()
+        table.drop_index('notes')
+        after = table.snapshot()
+        table.insert({'notes': 'likes cheese'})
+
+        assert before.find_ids({'notes': 'likes cheese'}) == [0]
+        assert sorted(after.find_ids({'notes': 'likes cheese'})) == [0]
+        assert sorted(table.find_ids({'notes': 'likes cheese'})) == [0, 3]
+
+    def test_no_changes_in_transactions(self, table):
+        table.begin_transaction()
+        with pytest.raises(ValueError):
+            table.drop_index('notes')
+        with pytest.raises(ValueError):
+            table.create_index('notes')
+        table.rollback()
+
+    def test_no_text_index_without_index(self, table):
+        table.drop_index('notes')
+        with pytest.raises(ValueError):
+            table.create_text_index('notes')
+
+
+class TestCompositeIndexes:
+
+    @pytest.fixture
+    def table(self):
+        table = gitdb.Table('t', storage='dict')
+        for i in range(12):
+            table.insert({'tenant': 'acme' if i % 3 else 'initech',
+                          'status': 'open' if i % 2 else 'closed',
+                          'priority': i % 4})
+        table.insert({'tenant': 'acme'})
+        table.create_index(('tenant', 'status', 'priority'))
+        return table
+
+    def expected(self, table, where):
+        return sorted(i for i, doc in table
+                      if all(doc.get(key, self) == value
+                             for key, value in where.items()))
+
+    def test_built_from_documents(self, table):
+        assert table.is_indexed(('tenant', 'status', 'priority'))
+        assert not table.is_indexed(('tenant', 'status'))
+        name = 'composite-["tenant", "status", "priority"]'
+        assert table.data_tree[name]['"initech"']['"closed"'] == {
+            '0': [0], '2': [6]}
+
+    @pytest.mark.parametrize('where', [
+        {'tenant': 'acme', 'status': 'open'},
+        {'tenant': 'acme', 'status': 'open', 'priority': 1},
+        {'tenant': 'initech', 'status': 'closed', 'priority': 1},
+        {'tenant': 'acme', 'priority': 3},
+        {'status': 'open', 'priority': 3},
+        {'tenant': 'nobody', 'status': 'open'},
+    ])
+    def test_same_as_scan(self, table, where):
+        assert sorted(table.find_ids(where)) == self.expected(table, where)
+
+    def test_used_by_planner(self, table):
+        where = {'tenant': 'acme', 'status': 'open', 'priority': 1}
+        where, search = table._composite_terms(where)
+        assert where == {}
+        assert search.args == (['tenant', 'status', 'priority'],
+                               ['acme', 'open', 1])
+
+        where = {'tenant': 'acme', 'priority': 1, 'status': {'exists': True}}
+        assert table._composite_terms(where) == (where, None)
+
+    def test_maintained(self, table):
+        where = {'tenant': 'acme', 'status': 'open'}
+        table.insert({'tenant': 'acme', 'status': 'open', 'priority': 9})
+        table.update(1, {'tenant': 'initech', 'status': 'open',
+                         'priority': 1})
+        table.delete(5)
+        table.update(12, {'tenant': 'acme', 'status': 'open',
+                          'priority': 0})
+        assert sorted(table.find_ids(where)) == self.expected(table, where)
+
+        for d_id, _ in list(table):
+            table.delete(d_id)
+        name = 'composite-["tenant", "status", "priority"]'
+        assert table.data_tree[name] == {}
+
+    @pytest.mark.parametrize('where', [
+        {'tenant': 'acme', 'status': 'open'},
+        {'tenant': 'acme', 'status': 'closed', 'priority': 0},
+        {'tenant': 'acme', 'priority': 2},
+    ])
+    def test_missing_trailing_keys(self, table, where):
+        table.insert({'tenant': 'acme', 'status': 'open'})
+        table.update(12, {'tenant': 'acme', 'status': 'closed'})
+        assert sorted(table.find_ids(where)) == self.expected(table, where)
+        assert sorted(table.find_ids(where)) != []
+
+        table.delete(13)
+        table.update(12, {'tenant': 'acme'})
+        assert sorted(table.find_ids(where)) == self.expected(table, where)
+
+    def test_dropping(self, table):
+        keys = ('tenant', 'status', 'priority')
+        table.drop_index(keys)
+        assert not table.is_indexed(keys)
+        assert 'composite-list' not in table.data_tree
+        assert table.is_indexed('tenant')
+        where = {'tenant': 'acme', 'status': 'open'}
+        assert sorted(table.find_ids(where)) == self.expected(table, where)
+
+    def test_repeated_keys(self, table):
+        with pytest.raises(ValueError):
+            table.create_index(('tenant', 'tenant'))
+
+
+class TestUniqueIndexes:
+
+    @pytest.fixture(params=['memory', 'dict'])
+    def table(self, request):
+        table = gitdb.Table('t', storage=request.param)
+        table.insert({'email': 'bob@example.com', 'name': 'bob'})
+        table.insert({'email': 'bill@example.com', 'name': 'bill'})
+        table.create_index('email', unique=True)
+        return table
+
+    def test_inserts(self, table):
+        assert table.is_unique('email')
+        assert not table.is_unique('name')
+        with pytest.raises(ValueError):
+            table.insert({'email': 'bob@example.com'})
+        assert len(table.find_ids({'email': 'bob@example.com'})) == 1
+
+        table.insert({'email': 'ben@example.com', 'name': 'bob'})
+        table.insert({'name': 'no email'})
+
+    def test_updates(self, table):
+        table.update(0, {'email': 'bob@example.com', 'name': 'robert'})
+        with pytest.raises(ValueError):
+            table.update(1, {'email': 'bob@example.com'})
+        assert table.get(1)['email'] == 'bill@example.com'
+
+        table.update(0, {'email': 'robert@example.com'})
+        table.insert({'email': 'bob@example.com'})
+
+    def test_deletes(self, table):
+        table.delete(0)
+        table.insert({'email': 'bob@example.com'})
+
+    def test_reverts(self, table):
+        table.update(0, {'email': 'robert@example.com'})
+        table.insert({'email': 'bob@example.com'})
+        with pytest.raises(ValueError):
+            table.revert_steps(1, doc_id=0)
+        assert table.get(0) == {'email': 'robert@example.com'}
+        assert table.find_ids({'email': 'bob@example.com'}) == [2]
+
+        table.delete(2)
+        table.revert_steps(1, doc_id=0)
+        assert table.get(0)['email'] == 'bob@example.com'
+        with pytest.raises(ValueError):
+            table.insert({'email': 'bob@example.com'})
+
+    def test_transactions(self, table):
+        table.begin_transaction()
+        table.insert({'email': 'ben@example.com'})
+        with pytest.raises(ValueError):
+            table.insert({'email': 'ben@example.com'})
+        table.rollback()
+        table.insert({'email': 'ben@example.com'})
+
+    def test_existing_duplicates(self, table):
+        table.insert({'name': 'bob'})
+        with pytest.raises(ValueError):
+            table.create_index('name', unique=True)
+        assert not table.is_unique('name')
+        assert not [name for name in table.data_tree.items_list()
+                    if name.startswith('unique-name')]
+
+    def test_unindexed_keys(self, table):
+        table.drop_index('email')
+        assert not table.is_unique('email')
+        assert not [name for name in table.data_tree.items_list()
+                    if name.startswith('claim-')]
+        table.insert({'email': 'bob@example.com'})
+
+        with pytest.raises(ValueError):
+            table.create_index('email', unique=True)
+        assert not table.is_indexed('email')
+
+    def test_no_unique_composites(self, table):
+        with pytest.raises(ValueError):
+            table.create_index(('email', 'name'), unique=True)
+
+
+class TestUpsert:
+
+    @pytest.fixture(params=['memory', 'dict'])
+    def table(self, request):
+        table = gitdb.Table('t', storage=request.param)
+        table.insert({'email': 'bob@example.com', 'tenant': 'acme',
+                      'name': 'bob'})
+        table.insert({'email': 'bill@example.com', 'tenant': 'acme',
+                      'name': 'bill'})
+        table.create_index('email', unique=True)
+        table.create_index(('tenant', 'name'))
+        return table
+
+    def test_updates_match(self, table):
+        d_id = table.upsert({'email': 'bob@example.com'}, {'name': 'robert'})
+        assert d_id == 0
+        assert table.get(0) == {'email': 'bob@example.com', 'name': 'robert'}
+        assert table.find_ids({'name': 'bob'}) == []
+
+    def test_inserts_without_match(self, table):
+        d_id = table.upsert({'email': 'ben@example.com'}, {'name': 'ben'})
+        assert d_id == 2
+        assert table.get(2) == {'email': 'ben@example.com', 'name': 'ben'}
+        assert table.upsert({'email': 'ben@example.com'}, {'name': 'ben'}) \
+            == 2
+
+    def test_one_commit(self):
+        table = gitdb.Table('t', storage='memory')
+        table.create_index('email', unique=True)
+        before = table.save_state()
+        d_id = table.upsert({'email': 'ben@example.com'}, {'n': 1})
+        head = table.data_repo[table.save_state()]
+        assert head.message == 'upsert doc-{id}'.format(id=d_id)
+        assert head.parents[0].id == before
+
+    def test_composite_match(self, table):
+        where = {'tenant': 'acme', 'name': 'bill'}
+        assert table.upsert(where, {'email': 'william@example.com'}) == 1
+        assert table.get(1)['email'] == 'william@example.com'
+        assert table.upsert(where, {'tenant': 'initech'}) == 1
+        assert table.upsert(where, {}) == 2
+
+    def test_unique_key_and_other_terms(self, table):
+        where = {'email': 'bob@example.com', 'name': 'bill'}
+        with pytest.raises(ValueError):
+            table.upsert(where, {})
+        assert table.upsert({'email': 'bob@example.com', 'name': 'bob'},
+                            {'tenant': 'initech'}) == 0
+
+    def test_several_matches(self, table):
+        with pytest.raises(ValueError):
+            table.upsert({'tenant': 'acme'}, {})
+        assert len(table.find_ids({'tenant': 'acme'})) == 2
+
+    def test_transactions(self, table):
+        table.begin_transaction()
+        d_id = table.upsert({'email': 'ben@example.com'}, {})
+        assert table.upsert({'email': 'ben@example.com'}, {'n': 1}) == d_id
+        table.rollback()
+        assert table.find_ids({'email': 'ben@example.com'}) == []
+
+
+class TestProjection:
+
+    @pytest.fixture(params=['memory', 'dict'])
+    def table(self, request):
+        table = gitdb.Table('t', storage=request.param)
+        table.insert({'name': 'bob', 'age': 30, 'tags': ['a', 'b']})
+        table.insert({'name': 'bill', 'age': 40, 'notes': 'likes cheese'})
+        table.insert({'name': 'ben', 'tags': {'x': 1}})
+        return table
+
+    @pytest.fixture
+    def no_reads(self, table, monkeypatch):
+        def read(doc_id):
+            raise AssertionError("read doc-{id}".format(id=doc_id))
+        monkeypatch.setattr(table, '_document', read)
+
+    def expected(self, table, where, fields):
+        return sorted((i, {key: doc[key] for key in fields if key in doc})
+                      for i, doc in table.find(where))
+
+    @pytest.mark.parametrize('where, fields', [
+        ({}, ['name']),
+        ({'age': {'gt': 35}}, ['name', 'age']),
+        ({'name': {'startswith': 'b'}}, ['age', 'tags']),
+        ({'name': 'nobody'}, ['name']),
+        ({}, []),
+    ])
+    def test_same_as_documents(self, table, where, fields):
+        expected = self.expected(table, where, fields)
+        table.drop_index('notes')
+        assert sorted(table.find(where, fields=fields)) == expected
+        table.drop_index('tags')
+        assert sorted(table.find(where, fields=fields)) == expected
+
+    def test_covered_without_reading(self, table, no_reads):
+        assert sorted(table.find({'age': {'exists': True}},
+                                 fields=['name', 'age'])) == \
+            [(0, {'age': 30, 'name': 'bob'}), (1, {'age': 40, 'name': 'bill'})]
+        assert table.get_fields([2, 0], ['tags']) == [
+            {'tags': {'x': 1}}, {'tags': ['a', 'b']}]
+
+    def test_unindexed_fields_read(self, table, no_reads):
+        table.drop_index('notes')
+        with pytest.raises(AssertionError):
+            table.find({'name': 'bill'}, fields=['name', 'notes'])
+
+    def test_after_writes(self, table):
+        assert table.get_fields([0], ['age']) == [{'age': 30}]
+        table.update(0, {'name': 'bob', 'age': 31})
+        table.delete(1)
+        assert table.find({}, fields=['age']) == [(0, {'age': 31}),
+                                                  (2, {})]
+
+        table.begin_transaction()
+        table.insert({'age': 50})
+        assert table.get_fields([3], ['age']) == [{'age': 50}]
+        table.rollback()
+        with pytest.raises(ValueError):
+            table.get_fields([3], ['age'])
+
+    def test_missing_documents(self, table):
+        with pytest.raises(ValueError):
+            table.get_fields([0, 7], ['name'])
+
+    def test_past_states(self, tmpdir):
+        table = gitdb.Table('t', str(tmpdir))
+        table.insert({'name': 'bob'})
+        state = table.save_state()
+        table.update(0, {'name': 'robert'})
+        assert table.find({}, as_of=state, fields=['name']) == \
+            [(0, {'name': 'bob'})]
+        assert table.get_fields([0], ['name'], as_of=state) == \
+            [{'name': 'bob'}]
+        assert table.get_fields([0], ['name']) == [{'name': 'robert'}]
@@ -0,0 +1,130 @@
+import os
+import time
+
+from ogitm import gitdb
+from ogitm.gitdb import journal
+import pytest
+
+
+class TestJournal:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        return gitdb.Table('journaled', str(tmpdir), journal=True)
+
+    def journal_size(self, table):
+        path = os.path.join(table.data_repo.path, journal.JOURNAL_FILE)
+        return os.path.getsize(path)
+
+    def test_saves_are_journaled(self, table):
+        commits = len(table.data_tree.backend.states())
+        doc = table.insert({'a': 1})
+        table.update(doc, {'a': 2})
+        table.insert({'a': 3})
+
+        assert table.get(doc) == {'a': 2}
+        assert sorted(table.find_ids({'a': {'gte': 2}})) == [0, 1]
+        assert self.journal_size(table) > 0
+        assert table.data_tree.pending == 3
+        assert len(table.data_tree.backend.states()) == commits
+
+        table.fold_journal()
+        assert self.journal_size(table) == 0
+        assert table.data_tree.pending == 0
+        assert len(table.data_tree.backend.states()) == commits + 1
+        assert table.get(doc) == {'a': 2}
+
+    def test_state_markers_fold(self, table):
+        doc = table.insert({'a': 1})
+        state = table.save_state()
+        assert table.data_tree.pending == 0
+
+        table.update(doc, {'a': 2})
+        table.revert_to_state(state)
+        assert table.get(doc) == {'a': 1}
+
+    def test_replay_after_crash(self, tmpdir):
+        table = gitdb.Table('journaled', str(tmpdir), journal=True)
+        doc = table.insert({'a': 1})
+        table.insert({'a': 2})
+
+        # the table is abandoned without folding, part way through a write
+        with open(os.path.join(table.data_repo.path, journal.JOURNAL_FILE),
+                  'ab') as file:
+            file.write(b'{"msg": "torn", "clear"')
+
+        reopened = gitdb.Table('journaled', str(tmpdir), journal=True)
+        assert self.journal_size(reopened) == 0
+        assert reopened.get(doc) == {'a': 1}
+        assert len(reopened.find({'a': {'exists': True}})) == 2
+        assert reopened.insert({'a': 3}) == 2
+
+    def test_fold_every(self, table):
+        table.data_tree.unwrap().fold_every = 5
+        for i in range(12):
+            table.insert({'a': i})
+        assert table.data_tree.pending == 2
+
+    def test_rollback(self, table):
+        doc = table.insert({'a': 1})
+        table.begin_transaction()
+        table.update(doc, {'a': 2})
+        table.rollback()
+        assert table.get(doc) == {'a': 1}
+
+        table.fold_journal()
+        assert table.get(doc) == {'a': 1}
+
+    def test_background_folding(self, table):
+        table.insert({'a': 1})
+        thread = table.auto_fold(interval=0.01)
+        for _ in range(500):
+            if not table.data_tree.pending:
+                break
+            time.sleep(0.01)
+
+        table.stop_folding()
+        assert not thread.is_alive()
+        assert table.data_tree.pending == 0
+
+    def test_folding_while_saving(self, tmpdir):
+        table = gitdb.Table('journaled', str(tmpdir), journal=True)
+        thread = table.auto_fold(interval=0.001)
+        ids = [table.insert({'a': i}) for i in range(300)]
+        table.stop_folding()
+        assert thread.is_alive() is False
+        assert len(set(ids)) == 300
+
+        reopened = gitdb.Table('journaled', str(tmpdir), journal=True)
+        assert [reopened.get(i) for i in ids] == [{'a': i} for i in range(300)]
+        assert len(reopened.find({'a': {'exists': True}})) == 300
+
+    def test_saves_during_fold_stay_journaled(self, table, monkeypatch):
+        backend = table.data_tree.unwrap()
+        table.insert({'a': 1})
+        save = backend.backend.save
+
+        def save_then_insert(msg=''):
+            # another thread saving while the fold is being committed
+            monkeypatch.setattr(backend.backend, 'save', save)
+            table.insert({'a': 2})
+            save(msg)
+        monkeypatch.setattr(backend.backend, 'save', save_then_insert)
+
+        backend.fold()
+        assert backend.pending == 1
+        assert self.journal_size(table) > 0
+        assert table.find_ids({'a': 2}) == [1]
+
+        table.fold_journal()
+        assert self.journal_size(table) == 0
+        assert sorted(table.find_ids({'a': {'exists': True}})) == [0, 1]
+
+    def test_gitdb(self, tmpdir):
+        db = gitdb.GitDB(str(tmpdir), journal=True)
+        assert db.table('t') is db.table('t')
+        db.table('t').insert({'a': 1})
+        assert db.table('t').find_ids({'a': 1}) == [0]
+
+        with pytest.raises(ValueError):
+            gitdb.GitDB(storage='memory', journal=True)
@@ -1,4 +1,4 @@
-from ogitm.gitdb.json_wrapper import JsonDictWrapper
+from ogitm.gitdb.json_wrapper import JsonDictWrapper, BlobCache
 
 
 class TestTreeWrapper:
@@ -21,3 +21,28 @@ class TestTreeWrapper:
         wrapped['hello'] = 'goodbye'
         for i in wrapped:
             assert i in d
+
+    def test_blob_cache(self):
+
+        class BlobDict(dict):
+            reads = 0
+
+            def __getitem__(self, item):
+                self.reads += 1
+                return super().__getitem__(item)
+
+            def blob_id(self, item):
+                return 'blob-' + super().__getitem__(item)
+
+        d = BlobDict(hello='1', goodbye='null')
+        cache = BlobCache(max_size=1)
+        wrapped = JsonDictWrapper(d, cache=cache)
+
+        assert wrapped['hello'] == 1
+        assert wrapped['hello'] == 1
+        assert d.reads == 1
+        assert wrapped['goodbye'] is None
+        assert wrapped['goodbye'] is None
+        assert d.reads == 2
+        assert len(cache) == 1
+        assert 'blob-1' not in cache
@@ -0,0 +1,122 @@
+from ogitm import gitdb
+from ogitm.gitdb import layout, treewrapper
+import pygit2
+import pytest
+
+
+class TestFanoutLayout:
+
+    @pytest.fixture
+    def tree(self, tmpdir):
+        repo = pygit2.init_repository(str(tmpdir), bare=True)
+        return treewrapper.TreeWrapper(repo, layout='fanout')
+
+    def test_paths(self):
+        fanout = layout.LAYOUTS['fanout']
+        top, middle = fanout.directories('doc-1')
+        assert len(top) == len(middle) == 2
+        assert fanout.path('doc-1') == top + '/' + middle + '/doc-1'
+
+    def test_items_are_nested(self, tree):
+        tree['doc-1'] = 'one'
+        tree['doc-2'] = 'two'
+        tree.save()
+
+        root = tree.view()._tree
+        assert layout.LAYOUT_MARKER in root
+        assert 'doc-1' not in root
+        assert layout.LAYOUTS['fanout'].path('doc-1') in root
+        assert tree.layout == 'fanout'
+        assert sorted(tree.items_list()) == ['doc-1', 'doc-2']
+        assert tree['doc-2'] == 'two'
+
+    def test_save_only_rewrites_changed_paths(self, tree):
+        for i in range(50):
+            tree['doc-' + str(i)] = str(i)
+        tree.save()
+        before = tree.view()._tree
+
+        tree['doc-0'] = 'changed'
+        tree.save()
+        after = tree.view()._tree
+
+        fanout = layout.LAYOUTS['fanout']
+        changed = {entry.name for entry in after
+                   if before[entry.name].id != entry.id}
+        assert changed == {fanout.directories('doc-0')[0]}
+        assert list(tree.diff(tree.resolve_state(1))) == \
+            [('doc-0', before[fanout.path('doc-0')].id,
+              after[fanout.path('doc-0')].id)]
+
+    def test_deletion_removes_empty_subtrees(self, tree):
+        tree['doc-1'] = 'one'
+        tree.save()
+        del tree['doc-1']
+        assert 'doc-1' not in tree
+        assert tree.items_list() == []
+        tree.save()
+
+        assert [entry.name for entry in tree.view()._tree] == \
+            [layout.LAYOUT_MARKER]
+
+    def test_clear(self, tree):
+        tree['doc-1'] = 'one'
+        tree.save()
+        tree.clear()
+        tree['doc-2'] = 'two'
+        assert tree.items_list() == ['doc-2']
+        tree.save()
+        assert tree.items_list() == ['doc-2']
+
+    def test_unknown_layout(self, tmpdir):
+        repo = pygit2.init_repository(str(tmpdir), bare=True)
+        with pytest.raises(ValueError):
+            treewrapper.TreeWrapper(repo, layout='spiral')
+
+
+class TestLayoutMigration:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        return gitdb.Table('migrated', str(tmpdir))
+
+    def test_migrate(self, table):
+        for i in range(10):
+            table.insert({'a': i})
+        old_state = table.save_state()
+        assert table.data_tree.layout == 'flat'
+
+        assert table.migrate_layout('fanout')
+        assert table.data_tree.layout == 'fanout'
+        assert not table.migrate_layout('fanout')
+
+        assert table.get(3) == {'a': 3}
+        assert sorted(table.find_ids({'a': {'lt': 5}})) == list(range(5))
+        assert list(table.data_tree.diff(old_state)) == []
+
+        table.update(3, {'a': 30})
+        assert [doc for _, doc in table.history(3)] == [{'a': 30}, {'a': 3}]
+        assert table.get(3, as_of=old_state) == {'a': 3}
+
+        table.revert_to_state(old_state)
+        assert table.data_tree.layout == 'flat'
+        assert table.get(3) == {'a': 3}
+
+    def test_migrate_in_transaction(self, table):
+        table.begin_transaction()
+        with pytest.raises(ValueError):
+            table.migrate_layout('fanout')
+        table.rollback()
+
+    def test_gitdb(self, tmpdir):
+        db = gitdb.GitDB(str(tmpdir))
+        db.table('one').insert({'a': 1})
+        db.table('two').insert({'a': 2})
+        assert {'one', 'two'} <= set(db.migrate_layout('fanout'))
+        assert db.table('one').data_tree.layout == 'fanout'
+        assert db.table('two').get(0) == {'a': 2}
+
+        db.table('three').insert({'a': 3})
+        assert db.table('three').data_tree.layout == 'fanout'
+        assert gitdb.GitDB(str(tmpdir), layout='flat').migrate_layout(
+            'fanout') == []
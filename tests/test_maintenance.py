@@ -0,0 +1,119 @@
+import os
+import time
+
+from ogitm import gitdb
+from ogitm.gitdb import maintenance, treewrapper
+import pygit2
+import pytest
+
+
+class TestMaintenance:
+
+    @pytest.fixture
+    def repo(self, tmpdir):
+        return pygit2.init_repository(str(tmpdir), bare=True)
+
+    def test_packs_loose_objects(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        for i in range(5):
+            tree['item-{i}'.format(i=i)] = str(i)
+            tree.save()
+        states = tree.states()
+
+        stats = maintenance.maintain(repo)
+        assert stats['before']['loose_objects'] > 0
+        assert stats['after']['loose_objects'] == 0
+        assert stats['after']['packs'] == 1
+        assert stats['pruned'] == 0
+
+        for state in states:
+            assert len(tree.view(state).items_list()) <= 5
+        assert tree['item-4'] == '4'
+
+        tree['item-5'] = '5'
+        tree.save()
+        stats = maintenance.maintain(repo)
+        assert stats['after'] == {'loose_objects': 0, 'loose_size': 0,
+                                  'packs': 1}
+
+    def test_prunes_unreachable(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['kept'] = 'kept'
+        tree.save()
+        tree['dropped'] = 'rolled back'
+        tree.rollback()
+
+        stats = maintenance.maintain(repo)
+        assert stats['pruned'] == 0
+        assert stats['after']['loose_objects'] == 1
+
+        old = time.time() - 2 * maintenance.DEFAULT_PRUNE_GRACE
+        for path in maintenance.loose_objects(repo).values():
+            os.utime(path, (old, old))
+
+        stats = maintenance.maintain(repo)
+        assert stats['pruned'] == 1
+        assert stats['after']['loose_objects'] == 0
+        assert tree['kept'] == 'kept'
+
+    def test_reverted_states_survive(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['a'] = 'one'
+        tree.save()
+        state = tree.save_state()
+        tree.revert_steps(1)
+
+        maintenance.maintain(repo, prune_grace=0)
+        tree.revert_to_state(state)
+        assert tree['a'] == 'one'
+
+
+class TestTableMaintenance:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        return gitdb.GitDB(str(tmpdir)).table('maintained')
+
+    def test_maintain(self, table):
+        doc = table.insert({'a': 1})
+        stats = table.maintain()
+        assert stats['data']['after']['loose_objects'] == 0
+        assert stats['meta']['after']['loose_objects'] == 0
+        assert table.get(doc) == {'a': 1}
+
+    def test_maintain_after_compaction(self, table):
+        for i in range(5):
+            table.update(table.insert({'a': i}), {'a': -i})
+        table.compact_history(keep_last=1)
+        stats = table.maintain(prune_grace=0)
+        assert stats['data']['pruned'] > 0
+        assert len(table.list_states()) == 2
+        assert len(table.find({'a': {'exists': True}})) == 5
+
+    def test_automatic_maintenance(self, table):
+        assert not table.needs_maintenance()
+        table.auto_maintain(max_loose_objects=20, check_every=5)
+        for i in range(10):
+            table.insert({'a': i})
+
+        loose = maintenance.object_stats(table.data_repo)['loose_objects']
+        assert loose <= 20
+        assert maintenance.object_stats(table.data_repo)['packs'] == 1
+        assert len(table.find({'a': {'exists': True}})) == 10
+
+    def test_background_maintenance(self, table):
+        for i in range(5):
+            table.insert({'a': i})
+
+        thread = table.auto_maintain(max_loose_objects=0, check_every=None,
+                                     background=True, interval=0.01)
+        assert thread.is_alive()
+        for _ in range(500):
+            if maintenance.object_stats(table.data_repo)['packs']:
+                break
+            time.sleep(0.01)
+
+        table.stop_maintenance()
+        assert not thread.is_alive()
+        assert maintenance.object_stats(table.data_repo)['packs'] == 1
+        assert len(table.find({'a': {'exists': True}})) == 5
@@ -1,3 +1,5 @@
+import asyncio
+
 import ogitm
 import pytest
 
@@ -236,6 +238,23 @@ class TestOGitM:
         assert TestModel.find(name={'eq': 'Bettie'}) == \
             TestModel.find(name='Bettie')
 
+    def test_finding_boolean_searches(self, simple_model):
+        db, TestModel = simple_model
+        tm1 = TestModel(age=25, name="Bettie")
+        tm2 = TestModel(age=19, name="Brian")
+        TestModel(age=19, name="Bettie")
+
+        either = {'$or': [{'age': 25}, {'name': 'Brian'}]}
+        assert TestModel.find(**either).all() == [tm1, tm2]
+        assert TestModel.find(**{'$not': {'age': 19}}).all() == [tm1]
+        assert TestModel.find(age=19).find(**{'$not': {'name': 'Bettie'}}) \
+            .all() == [tm2]
+
+        with pytest.raises(TypeError):
+            TestModel.find(**{'$or': [{'not_an_attribute': 1}]})
+        with pytest.raises(TypeError):
+            TestModel.find(**{'$not': {'not_an_attribute': 1}})
+
     def test_different_tables(self, simple_model):
         db, TestModel = simple_model
         TestModel(age=25, name="Bettie")
@@ -269,3 +288,129 @@ class TestOGitM:
             age = ogitm.fields.Integer(nullable=False)
 
         assert TestModel.find(age=25).first().name == "Bettie"
+
+    def test_async_operations(self, simple_model):
+        db, TestModel = simple_model
+        tm = TestModel(age=25, name="Bettie")
+
+        async def go():
+            tm.age = 26
+            await tm.asave()
+            return await TestModel.afind(age=26)
+
+        result = asyncio.new_event_loop().run_until_complete(go())
+        assert result.all() == [tm]
+        assert TestModel.find(age=25).first() is None
+
+    def test_finding_as_of(self, simple_model):
+        db, TestModel = simple_model
+        tm = TestModel(age=25, name="Bettie")
+        state = TestModel.get_table().save_state()
+        tm.age = 26
+        tm.save()
+
+        result = TestModel.find(age=25, as_of=state)
+        assert len(result) == 1
+        assert result.first().age == 25
+        assert len(result.find(name="Bettie")) == 1
+        assert TestModel.find(age=25).first() is None
+        assert TestModel(model_id=tm.id, as_of=state).age == 25
+
+        with pytest.raises(TypeError):
+            class ReservedField(ogitm.Model, db=db):
+                as_of = ogitm.fields.Integer()
+
+    def test_unindexed_fields(self, tmpdir):
+        db = ogitm.gitdb.GitDB(str(tmpdir), storage='memory')
+
+        class Post(ogitm.Model, db=db):
+            title = ogitm.fields.String()
+            body = ogitm.fields.String(index=False)
+
+        post = Post(title="Hello", body="A long post about cheese")
+        table = Post.get_table()
+        assert not table.is_indexed('body')
+        assert 'index-body' not in table.data_tree
+        assert Post.find(body={'contains': 'cheese'}).first() == post
+
+        class Post(ogitm.Model, db=db):
+            title = ogitm.fields.String()
+            body = ogitm.fields.String()
+
+        assert Post.get_table().is_indexed('body')
+        assert Post.find(body={'contains': 'cheese'}).ids == [post.id]
+
+    def test_unique_fields(self, tmpdir):
+        db = ogitm.gitdb.GitDB(str(tmpdir), storage='memory')
+
+        class User(ogitm.Model, db=db):
+            email = ogitm.fields.String(unique=True)
+
+        User(email="bob@example.com")
+        with pytest.raises(ValueError):
+            User(email="bob@example.com")
+        assert len(User.find(email="bob@example.com")) == 1
+
+        with pytest.raises(TypeError):
+            ogitm.fields.String(unique=True, index=False)
+
+    def test_upserting(self, tmpdir):
+        db = ogitm.gitdb.GitDB(str(tmpdir), storage='memory')
+
+        class User(ogitm.Model, db=db):
+            email = ogitm.fields.String(unique=True)
+            name = ogitm.fields.String(nullable=True)
+
+        bob = User.upsert({'email': 'bob@example.com'}, name='bob')
+        assert bob.email == 'bob@example.com'
+        robert = User.upsert({'email': 'bob@example.com'}, name='robert')
+        assert robert.id == bob.id
+        assert User.find(email='bob@example.com').first().name == 'robert'
+
+        with pytest.raises(TypeError):
+            User.upsert({'age': 3})
+        with pytest.raises(ValueError):
+            User.upsert({'email': 'bill@example.com'}, name=3)
+        assert len(User.find(email={'exists': True})) == 1
+
+    def test_returnset_values(self, tmpdir):
+        db = ogitm.gitdb.GitDB(str(tmpdir), storage='memory')
+
+        class Pet(ogitm.Model, db=db):
+            name = ogitm.fields.String()
+            age = ogitm.fields.Integer()
+            notes = ogitm.fields.String(index=False, nullable=True)
+
+        Pet(name="Rex", age=3)
+        Pet(name="Tibbles", age=5, notes="grumpy")
+        pets = Pet.find(age={'gt': 0})
+        assert pets.values('name') == [{'name': "Rex"}, {'name': "Tibbles"}]
+        assert pets.values()[1] == {'name': "Tibbles", 'age': 5,
+                                    'notes': "grumpy"}
+
+        with pytest.raises(TypeError):
+            pets.values('colour')
+
+    def test_compact_models(self, tmpdir):
+        db = ogitm.gitdb.GitDB(str(tmpdir))
+
+        class Pet(ogitm.Model, db=db, compact=True):
+            name = ogitm.fields.String()
+            age = ogitm.fields.Integer()
+            kind = ogitm.fields.Choice({'cat', 'dog'})
+
+        rex = Pet(name="Rex", age=3, kind="dog")
+        table = Pet.get_table()
+        stored = table.data_tree.unwrap().get_bytes('doc-{i}'.format(i=rex.id))
+        assert bytes(stored[:2]) == ogitm.gitdb.schema.MAGIC
+        assert Pet.find(kind="dog").first() == rex
+
+        class Pet(ogitm.Model, db=db, compact=True):
+            name = ogitm.fields.String()
+            age = ogitm.fields.Integer()
+            kind = ogitm.fields.Choice({'cat', 'dog', 'fish'})
+            weight = ogitm.fields.Float()
+
+        assert Pet.get_table().data_tree.codec.schema.latest == 1
+        assert Pet(model_id=rex.id).name == "Rex"
+        assert Pet(model_id=rex.id).weight is None
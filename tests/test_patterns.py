@@ -0,0 +1,82 @@
+import re
+
+from ogitm import gitdb
+from ogitm.gitdb import patterns
+import pytest
+
+
+NAMES = ['bob', 'bobby', 'rob', 'robert', 'alberto', 'al', 'a.b', 'a-b',
+         'Bob', 'bob\nrob', 'ünïcode', '"quoted"', 'back\\slash', '']
+
+
+class TestLiteralText:
+
+    @pytest.mark.parametrize('pattern, prefix, literals', [
+        ('^abc', 'abc', ['abc']),
+        ('abc', '', ['abc']),
+        (r'\Afoo', 'foo', ['foo']),
+        ('^ab*c', 'a', ['a', 'c']),
+        ('^ab+cd', 'ab', ['ab', 'cd']),
+        ('^ab?', 'a', ['a']),
+        ('foo.*bar', '', ['foo', 'bar']),
+        ('^(ab)cd', '', ['cd']),
+        ('ab(c|d)ef', '', ['ab', 'ef']),
+        ('[abc]def', '', ['def']),
+        ('^[(]x', '', ['x']),
+        (r'^\d+abc', '', ['abc']),
+        (r'^a\.b', 'a.b', ['a.b']),
+        ('x{2}yz', '', ['yz']),
+        ('x{y', '', ['x{y']),
+        ('a|b', '', []),
+        (r'\x41bc', '', []),
+        (r'(a)\1', '', []),
+    ])
+    def test_literal_text(self, pattern, prefix, literals):
+        assert patterns.literal_text(pattern) == (prefix, literals)
+
+    def test_flags(self):
+        assert patterns.compile_pattern('(?i)abc').literals == []
+        assert patterns.compile_pattern('(?m)^abc').prefix == ''
+        assert patterns.compile_pattern('(?m)^abc').literals == ['abc']
+
+    def test_cached(self):
+        assert patterns.compile_pattern('^b.b') is \
+            patterns.compile_pattern('^b.b')
+
+    @pytest.mark.parametrize('pattern', [3, b'abc', ['abc'], re.compile(b'a')])
+    def test_bad_patterns(self, pattern):
+        with pytest.raises(ValueError):
+            patterns.compile_pattern(pattern)
+
+
+class TestRegexSearch:
+
+    @pytest.fixture(params=[False, True])
+    def table(self, request):
+        table = gitdb.Table('t', storage='dict')
+        for name in NAMES:
+            table.insert({'name': name})
+        table.insert({'name': 42})
+        table.insert({'name': ['bob']})
+        if request.param:
+            table.create_text_index('name')
+        return table
+
+    @pytest.mark.parametrize('pattern', [
+        '^bob', 'bob', 'ob$', '^r.b', 'o.*r', r'^a\.b', 'a.b', '^$', '',
+        'be?r', 'b+', '^(al|ro)', '(?i)^bob', '(?m)^rob', 'ü', '"q',
+        r'\\s', r'^\w+$', 'rob|bob', 'x{0}bob'])
+    def test_same_as_scan(self, table, pattern):
+        expected = {i for i, name in enumerate(NAMES)
+                    if re.search(pattern, name)}
+        assert set(table.find_ids({'name': {'regex': pattern}})) == \
+            expected
+
+    def test_compiled_pattern(self, table):
+        pattern = re.compile('^BOB', re.IGNORECASE)
+        assert sorted(table.find_ids({'name': {'regex': pattern}})) == \
+            [0, 1, 8, 9]
+
+    def test_bad_pattern(self, table):
+        with pytest.raises(ValueError):
+            table.find({'name': {'regex': 42}})
@@ -0,0 +1,67 @@
+from ogitm import gitdb
+from ogitm.gitdb import index_access, predicates, search_functions
+import pytest
+
+
+class TestPredicateSets:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        table = gitdb.Table('codes', str(tmpdir))
+        table.begin_transaction()
+        for code in ['123', 'abc', 'ABC', 'Abc', 'a1', ' ', '', '²', 'x y',
+                     'abc', 12, None, ['123']]:
+            table.insert({'code': code})
+        table.commit()
+        table.create_predicate_index('code')
+        return table
+
+    def scan(self, table, op, arg):
+        index = table.data_tree.get('index-code', {})
+        func = search_functions.SearchFunction.get(op)
+        # without the table, the accessor has no predicate sets to use
+        accessor = index_access.IndexAccessor('code', index)
+        return func('code', op, arg, accessor, {})
+
+    @pytest.mark.parametrize('op', predicates.PREDICATES)
+    @pytest.mark.parametrize('arg', [True, False, 1, 0, 'yes'])
+    def test_same_as_scan(self, table, op, arg):
+        assert 'props-code' in table.data_tree
+        found = set(table.find_ids({'code': {op: arg}}))
+        assert found == self.scan(table, op, arg)
+
+    def test_maintained_by_writes(self, table):
+        table.update(0, {'code': 'def'})
+        assert table.find_ids({'code': {'isdigit': True}}) == [7]
+        assert sorted(table.find_ids({'code': {'isupper': True}})) == [2]
+
+        table.update(2, {'code': 42})
+        assert table.find_ids({'code': {'isupper': True}}) == []
+        stored = table.data_tree['props-code']
+        assert '"ABC"' not in stored
+        assert '"def"' in stored
+
+        table.insert({'code': '\x00'})  # no predicate is true for it
+        assert table.data_tree['props-code'] == stored
+        assert table.find_ids({'code': {'isprintable': False}}) == [13]
+
+    def test_opt_in(self, tmpdir):
+        table = gitdb.Table('codes', str(tmpdir))
+        table.insert({'code': '123'})
+        table.insert({'code': 'abc'})
+        assert 'props-code' not in table.data_tree
+        table.drop_index('other')
+        with pytest.raises(ValueError):
+            table.create_predicate_index('other')
+
+        table.create_predicate_index('code')
+        table.insert({'code': '456'})
+        assert sorted(table.data_tree['props-code']) == \
+            ['"123"', '"456"', '"abc"']
+        assert table.find_ids({'code': {'isdigit': True}}) == [0, 2]
+
+        table.drop_predicate_index('code')
+        assert 'props-code' not in table.data_tree
+        table.insert({'code': '789'})
+        assert 'props-code' not in table.data_tree
+        assert table.find_ids({'code': {'isdigit': True}}) == [0, 2, 3]
@@ -0,0 +1,91 @@
+from ogitm import gitdb
+from ogitm.gitdb import backends, codecs, schema
+import pytest
+
+
+class TestSchemaCodec:
+
+    @pytest.fixture
+    def fields(self):
+        return [('name', None), ('age', None), ('height', None),
+                ('alive', None), ('colour', ['red', 'green', 1, True])]
+
+    @pytest.fixture(params=['json', 'marshal'])
+    def codec(self, request, fields):
+        people = schema.Schema()
+        assert people.add_version(fields)
+        return schema.SchemaCodec(people, codecs.get_codec(request.param))
+
+    def test_round_trip(self, codec):
+        doc = {'name': 'bób', 'age': 42, 'height': 1.5, 'alive': True,
+               'colour': 'green'}
+        data = codec.encode(doc)
+        assert data.startswith(schema.MAGIC)
+        assert b'name' not in data
+        assert codec.decode(data) == doc
+        assert codec.decode(memoryview(data)) == doc
+
+    def test_exact_types(self, codec):
+        docs = [{'age': True, 'colour': 1}, {'age': 1, 'colour': True},
+                {'alive': 1, 'height': 2}, {'colour': 1.0, 'age': 2 ** 70},
+                {'name': None, 'colour': None}, {'name': ['a', {'b': 1}]},
+                {}]
+        for doc in docs:
+            decoded = codec.decode(codec.encode(doc))
+            assert decoded == doc
+            assert [type(v) for v in decoded.values()] == \
+                [type(doc[k]) for k in decoded]
+
+    def test_smaller_than_json(self, codec):
+        doc = {'name': 'bob', 'age': 42, 'height': 1.5, 'alive': True,
+               'colour': 'green'}
+        assert len(codec.encode(doc)) < \
+            len(codecs.get_codec('json').encode(doc))
+
+    def test_fallback(self, codec):
+        for value in [{'other': 1}, {'"bob"': [1, 2]}, [1, 2], 'text', 3]:
+            data = codec.encode(value)
+            assert not backends.as_bytes(data).startswith(schema.MAGIC)
+            assert codec.decode(data) == value
+
+    def test_versions(self, codec, fields):
+        old = codec.encode({'name': 'bob', 'colour': 'red'})
+        assert not codec.schema.add_version(
+            fields[:-1] + [('colour', ['green', True, 1, 'red'])])
+        assert codec.schema.add_version(
+            [('weight', None), ('colour', ['blue'])] + fields[:2])
+        assert codec.schema.latest == 1
+        assert [f[:2] for f in codec.schema.versions[1]] == \
+            [(0, 'name'), (1, 'age'), (4, 'colour'), (5, 'weight')]
+
+        reloaded = schema.SchemaCodec(
+            schema.Schema.from_json(codec.schema.to_json()), codec.fallback)
+        assert reloaded.decode(old) == {'name': 'bob', 'colour': 'red'}
+        new = reloaded.encode({'weight': 3, 'colour': 'blue'})
+        assert reloaded.decode(new) == {'weight': 3, 'colour': 'blue'}
+        assert reloaded.decode(reloaded.encode({'alive': False})) == \
+            {'alive': False}
+
+
+class TestTableSchema:
+
+    def test_bind_schema(self, tmpdir):
+        table = gitdb.Table('people', str(tmpdir))
+        old = table.insert({'name': 'alice', 'age': 30})
+        assert table.bind_schema([('name', None), ('age', None)]) == 0
+        assert table.bind_schema([('age', None), ('name', None)]) == 0
+        new = table.insert({'name': 'bob', 'age': 12})
+
+        stored = table.data_tree.unwrap().get_bytes('doc-{i}'.format(i=new))
+        assert bytes(stored[:2]) == schema.MAGIC
+        assert table.find_ids({'age': {'lt': 20}}) == [new]
+        assert table.get(old) == {'name': 'alice', 'age': 30}
+
+        reopened = gitdb.Table('people', str(tmpdir))
+        assert reopened.get(new) == {'name': 'bob', 'age': 12}
+        assert reopened.snapshot().get(new) == {'name': 'bob', 'age': 12}
+
+        assert table.bind_schema([('name', None), ('age', None),
+                                  ('email', None)]) == 1
+        newest = table.insert({'name': 'carol', 'age': 50, 'email': 'c@d'})
+        assert reopened.get(newest)['email'] == 'c@d'
@@ -0,0 +1,126 @@
+import os
+
+from ogitm.gitdb import sequence, treewrapper
+import pygit2
+import pytest
+
+
+class TestCommitSequence:
+
+    @pytest.fixture
+    def repo(self, tmpdir):
+        return pygit2.init_repository(str(tmpdir), bare=True)
+
+    def seq_file(self, repo):
+        return os.path.join(repo.path, sequence.SEQUENCE_FILE)
+
+    def test_sequence_follows_saves(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        for i in range(5):
+            tree['item'] = str(i)
+            tree.save()
+
+        seq = tree.sequence()
+        assert len(seq) == 6
+        assert seq[-1] == tree.save_state()
+        assert seq.back(1) == repo[tree.save_state()].parent_ids[0]
+        assert seq.back(100) == seq[0]
+        assert tree.states(2) == [seq[5], seq[4]]
+        assert os.path.getsize(self.seq_file(repo)) == 6 * 20
+
+    def test_saves_only_append(self, repo, monkeypatch):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['item'] = 'one'
+        tree.save()
+
+        opened = []
+
+        def record_open(path, mode='r', *args, **kwargs):
+            opened.append(mode)
+            return open(path, mode, *args, **kwargs)
+        monkeypatch.setattr(sequence, 'open', record_open, raising=False)
+
+        tree['item'] = 'two'
+        tree.save()
+        assert opened == ['ab']
+        assert len(tree.sequence()) == 3
+
+    def test_sequence_follows_reverts(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['item'] = 'one'
+        tree.save()
+        state = tree.save_state()
+        tree['item'] = 'two'
+        tree.save()
+
+        tree.revert_steps(1)
+        assert tree.sequence()[-1] == state
+        assert len(tree.sequence()) == 2
+        assert os.path.getsize(self.seq_file(repo)) == 2 * 20
+
+        tree['item'] = 'three'
+        tree.save()
+        assert len(tree.sequence()) == 3
+        assert tree.sequence().back(1) == state
+
+    def test_sequence_is_rebuilt(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['item'] = 'one'
+        tree.save()
+        states = tree.states()
+
+        os.remove(self.seq_file(repo))
+        seq = sequence.CommitSequence.for_repo(repo)
+        seq.sync(repo.head.target)
+        assert [seq[i] for i in range(len(seq))] == states[::-1]
+
+        with open(self.seq_file(repo), 'wb') as file:
+            file.write(b'\0' * 20)
+        seq = sequence.CommitSequence.for_repo(repo)
+        seq.rebuild(repo.head.target)
+        assert len(seq) == len(states)
+        assert os.path.getsize(self.seq_file(repo)) == len(states) * 20
+
+    def test_shared_between_instances(self, repo):
+        tree1 = treewrapper.TreeWrapper(repo)
+        tree2 = treewrapper.TreeWrapper(repo)
+        tree1['item'] = 'one'
+        tree1.save()
+        tree2['item'] = 'two'
+        tree2.save()
+
+        assert tree1.states() == tree2.states()
+        assert len(tree1.states()) == len(set(tree1.states()))
+
+
+class TestStateReplacements:
+
+    @pytest.fixture
+    def repo(self, tmpdir):
+        return pygit2.init_repository(str(tmpdir), bare=True)
+
+    def test_compaction_is_recorded(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        states = []
+        for i in range(4):
+            tree['item'] = str(i)
+            tree.save()
+            states.append(tree.save_state())
+
+        mapping = tree.compact(keep_last=2)
+        assert mapping[states[0]] is None
+        assert mapping[states[1]] is None
+        assert tree.view(states[3])['item'] == '3'
+        assert tree.retired_states() == set(mapping)
+
+        # another instance reads the same record from disk
+        other = sequence.StateReplacements.for_repo(repo)
+        assert other.resolve(states[2]) == mapping[states[2]]
+        with pytest.raises(ValueError):
+            other.resolve(states[0])
+
+    def test_compact_refuses_unsaved_changes(self, repo):
+        tree = treewrapper.TreeWrapper(repo)
+        tree['item'] = 'unsaved'
+        with pytest.raises(ValueError):
+            tree.compact(keep_last=1)
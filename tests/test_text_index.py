@@ -0,0 +1,123 @@
+import json
+import random
+
+from ogitm import gitdb
+from ogitm.gitdb import text_index
+import pytest
+
+
+class TestTextIndex:
+
+    @pytest.fixture
+    def table(self, tmpdir):
+        table = gitdb.Table('people', str(tmpdir))
+        for name in ['bob', 'bobby', 'rob', 'robert', 'alberto', 'al']:
+            table.insert({'name': name, 'tags': ['a', name]})
+        table.insert({'name': 42})
+        return table
+
+    def scan(self, table, where):
+        text = table.data_tree.unwrap().get('text-name')
+        if text is not None:
+            del table.data_tree['text-name']
+        found = sorted(table.find_ids(where))
+        table.data_tree.rollback()
+        return found
+
+    def test_trigrams(self):
+        assert text_index.trigrams('bobby') == {'bob', 'obb', 'bby'}
+        assert text_index.trigrams('ab') == set()
+
+    @pytest.mark.parametrize('where', [
+        {'contains': 'ob'}, {'contains': 'ober'}, {'contains': 'bert'},
+        {'contains': ''}, {'contains': 'xyz'}, {'contains': 'a'},
+        {'startswith': 'bob'}, {'startswith': 'b'}, {'startswith': ''},
+        {'startswith': ('al', 'ro')}, {'endswith': 'ob'},
+        {'endswith': 'rto'}, {'contains': 3}])
+    def test_same_as_scan(self, table, where):
+        expected = self.scan(table, {'name': where, 'tags': {'exists': True}})
+        table.create_text_index('name')
+        table.create_text_index('tags')
+        assert sorted(table.find_ids({'name': where})) == \
+            self.scan(table, {'name': where})
+        assert sorted(table.find_ids(
+            {'name': where, 'tags': {'exists': True}})) == expected
+
+    def test_container_values(self, table):
+        table.create_text_index('tags')
+        assert sorted(table.find_ids({'tags': {'contains': 'a'}})) == \
+            list(range(6))
+        assert table.find_ids({'tags': {'contains': 'rob'}}) == [2]
+
+    def test_maintained_by_writes(self, table):
+        table.create_text_index('name')
+        table.update(0, {'name': 'roberta'})
+        table.insert({'name': 'bobbin'})
+        assert sorted(table.find_ids({'name': {'startswith': 'bob'}})) == \
+            [1, 7]
+        assert sorted(table.find_ids({'name': {'contains': 'bert'}})) == \
+            [0, 3, 4]
+
+        stored = text_index.TextIndex(table.data_tree['text-name'])
+        assert 'bob' not in stored.prefixes
+        assert sorted(stored.strings[i] for i in stored.grams['bob']) == \
+            ['bobbin', 'bobby']
+        assert len(stored.strings) == 7  # the id of 'bob' was reused
+
+        table.drop_text_index('name')
+        assert 'text-name' not in table.data_tree
+        assert sorted(table.find_ids({'name': {'contains': 'bert'}})) == \
+            [0, 3, 4]
+
+    def test_long_values_stored_once(self, tmpdir):
+        rand = random.Random(2)
+        table = gitdb.Table('long', str(tmpdir))
+        table.create_text_index('text')
+        values = [''.join(rand.choices('abcdefgh', k=200)) for _ in range(20)]
+        for value in values:
+            table.insert({'text': value})
+
+        dumped = json.dumps(table.data_tree['text-text'])
+        assert all(dumped.count(value) == 2 for value in values)
+        assert table.find_ids({'text': {'contains': values[3][50:60]}}) == [3]
+
+    def test_random_values(self, tmpdir):
+        rand = random.Random(4)
+        table = gitdb.Table('random', str(tmpdir))
+        table.create_text_index('word')
+        table.begin_transaction()
+        for _ in range(200):
+            length = rand.randint(0, 6)
+            table.insert({'word': ''.join(rand.choices('abc', k=length))})
+        table.commit()
+
+        for _ in range(30):
+            arg = ''.join(rand.choices('abc', k=rand.randint(0, 4)))
+            for op in text_index.TEXT_OPERATORS:
+                where = {'word': {op: arg}}
+                assert sorted(table.find_ids(where)) == \
+                    self.scan(table, where)
+
+    def test_random_changes(self, tmpdir):
+        rand = random.Random(7)
+        table = gitdb.Table('random', str(tmpdir))
+        table.create_text_index('word')
+
+        def word():
+            return ''.join(rand.choices('abcd', k=rand.randint(3, 7)))
+
+        table.begin_transaction()
+        ids = [table.insert({'word': word()}) for _ in range(100)]
+        for doc_id in rand.sample(ids, 60):
+            if rand.random() < 0.5:
+                table.delete(doc_id)
+            else:
+                table.update(doc_id, {'word': word()})
+        table.commit()
+
+        for _ in range(30):
+            arg = ''.join(rand.choices('abcd', k=rand.randint(1, 4)))
+            for op in text_index.TEXT_OPERATORS:
+                where = {'word': {op: arg}}
+                assert sorted(table.find_ids(where)) == \
+                    self.scan(table, where)
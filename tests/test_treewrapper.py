@@ -1,4 +1,4 @@
-from ogitm.gitdb import treewrapper
+from ogitm.gitdb import treewrapper, memory
 import pygit2
 import pytest
 
@@ -12,9 +12,12 @@ import pytest
 
 class TestTreeWrapper:
 
-    @pytest.fixture
-    def gittree(self, tmpdir):
-        git = pygit2.init_repository(str(tmpdir), bare=True)
+    @pytest.fixture(params=['disk', 'memory'])
+    def gittree(self, request, tmpdir):
+        if request.param == 'memory':
+            git = memory.memory_repository()
+        else:
+            git = pygit2.init_repository(str(tmpdir), bare=True)
         return treewrapper.TreeWrapper(git)
 
     def test_instantiation(self, tmpdir):
@@ -120,3 +123,19 @@ class TestTreeWrapper:
         gittree['bubble'] = 'squaretastic'
 
         assert set(gittree.items_list()) == {'box', 'square', 'bubble'}
+
+    def test_view(self, gittree):
+        gittree['box'] = 'bubblicious'
+        gittree.save()
+        view = gittree.view()
+
+        gittree['box'] = 'squaretastic'
+        gittree['bubble'] = 'boxifabulous'
+        gittree.save()
+
+        assert view['box'] == 'bubblicious'
+        assert view.get('bubble') is None
+        assert 'bubble' not in view
+        assert view.items_list() == ['box']
+        assert gittree.view(view.state)['box'] == 'bubblicious'
+        assert gittree.view()['box'] == 'squaretastic'